@@ -1,15 +1,87 @@
+from fastapi import HTTPException
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
+from sqlalchemy import event, inspect, select, update, or_
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from user_cache import user_cache, CachedUser
+from dashboard_stats import dashboard_stats
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
 import models
 import os
+import time
+import uuid
 
 SECRET_KEY = os.getenv("JWT_SECRET", "DakitAI2026JWTSecretKey!")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# bcrypt maliyeti; değiştirilirse eski özetler girişte yeniden hesaplanır
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Parola işlemleri için iş parçacığı sayısı (0: olay döngüsünde, eski davranış)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(os.cpu_count() or 1)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", str(max(1, PASSWORD_HASH_WORKERS) * 8)))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordHasherBusy(Exception):
+    """Parola kuyruğu dolu - istek reddedilmeli (HTTP 503)"""
+
+
+class PasswordHasher:
+    """bcrypt işlemlerini olay döngüsünü bloklamadan sınırlı havuzda çalıştırır.
+
+    bcrypt hesaplama sırasında GIL'i bırakır; iş parçacıkları çekirdek başına
+    paralel çalışır. Kuyruk dolunca yeni işler beklemek yerine reddedilir.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_MAX_PENDING):
+        self.workers = workers
+        self.max_pending = max(1, max_pending)
+        self._executor = None
+        self._pending = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+
+    def get_stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "rounds": BCRYPT_ROUNDS
+        }
+
+
+# Global hasher instance
+password_hasher = PasswordHasher()
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -17,6 +89,13 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    """(doğru mu, maliyet değiştiyse yeni özet)"""
+    return await password_hasher.run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await password_hasher.run(pwd_context.hash, password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -27,56 +106,114 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str, db: Session):
+async def verify_token(token: str, db: AsyncSession):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = db.query(models.User).filter(models.User.username == username).first()
+        # Kullanıcı her istekte veritabanından okunmaz; değişiklikte önbellek silinir
+        user = await user_cache.get(username)
         if user is None:
-            raise HTTPException(status_code=401, detail="User not found")
+            result = await db.execute(select(models.User).where(models.User.username == username))
+            db_user = result.scalars().first()
+            if db_user is None:
+                raise HTTPException(status_code=401, detail="User not found")
+            user = CachedUser.from_model(db_user)
+            await user_cache.put(username, user)
+        if user.is_active is False:
+            raise HTTPException(status_code=401, detail="User inactive")
         return user
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def authenticate_user(username: str, password: str, db: Session):
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def logout_user(token: str):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("jti"):
+        await dashboard_stats.session_ended(payload["jti"])
+    return {"message": "Logged out"}
+
+# Kullanıcı güncellenir/silinirse önbellek kaydı commit sonrası silinir; commit
+# öncesi silmek, araya giren bir isteğin eski satırı yeniden önbelleğe almasına izin verir
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session, flush_context):
+    changed = session.info.setdefault("changed_usernames", set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, models.User):
+            history = inspect(obj).attrs.username.history
+            changed.update(name for name in (obj.username, *history.deleted) if name)
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session):
+    changed = session.info.pop("changed_usernames", None)
+    if changed:
+        user_cache.invalidate_later(*changed)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_usernames", None)
+
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    result = await db.execute(select(models.User).where(models.User.username == username))
+    user = result.scalars().first()
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    
+    hashed_password = user.hashed_password
+    profile = CachedUser.from_model(user)
+    # bcrypt beklenirken veritabanı bağlantısı havuza dönsün; aksi halde giriş
+    # fırtınasında havuz tükenir ve diğer istekler bağlantı bekler
+    await db.rollback()
+    verified, new_hash = await verify_password_async(password, hashed_password)
+    if not verified:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # jti oturumu tanımlar; aktif oturum sayacı token süresi dolunca kendiliğinden düşer
+    session_id = uuid.uuid4().hex
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": profile.username, "jti": session_id}, expires_delta=access_token_expires
     )
-    
-    user.last_login = datetime.utcnow()
-    db.commit()
-    
+
+    changes = {"last_login": datetime.utcnow()}
+    if new_hash:
+        # BCRYPT_ROUNDS değişti: özet yeni maliyetle saklanır
+        changes["hashed_password"] = new_hash
+        password_hasher.rehashed += 1
+    await db.execute(
+        update(models.User).where(models.User.id == profile.id).values(**changes).execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    await dashboard_stats.session_started(session_id, time.time() + access_token_expires.total_seconds())
+
     return {
         "access_token": access_token,
         "token_type": "bearer",
         "user": {
-            "id": user.id,
-            "username": user.username,
-            "email": user.email,
-            "full_name": user.full_name,
-            "is_admin": user.is_admin
+            "id": profile.id,
+            "username": profile.username,
+            "email": profile.email,
+            "full_name": profile.full_name,
+            "is_admin": profile.is_admin
         }
     }
 
-def create_user(user_data: dict, db: Session):
+async def create_user(user_data: dict, db: AsyncSession):
     # Check if user exists
-    existing_user = db.query(models.User).filter(
-        (models.User.username == user_data["username"]) | 
-        (models.User.email == user_data["email"])
-    ).first()
+    result = await db.execute(select(models.User).where(or_(
+        models.User.username == user_data["username"],
+        models.User.email == user_data["email"]
+    )))
+    existing_user = result.scalars().first()
     
     if existing_user:
         raise HTTPException(status_code=400, detail="User already exists")
-    
+    await db.rollback()
+
     # Create new user
-    hashed_password = get_password_hash(user_data["password"])
+    hashed_password = await get_password_hash_async(user_data["password"])
     db_user = models.User(
         username=user_data["username"],
         email=user_data["email"],
@@ -86,7 +223,9 @@ def create_user(user_data: dict, db: Session):
     )
     
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    
-    return {"message": "User created successfully", "user_id": db_user.id}
+    # Kimlik commit öncesi alınır; commit sonrası erişim bağlantıyı yeniden tutar
+    await db.flush()
+    user_id = db_user.id
+    await db.commit()
+
+    return {"message": "User created successfully", "user_id": user_id}
@@ -0,0 +1,90 @@
+"""Giriş fırtınası altında /auth/login ve ilgisiz uç nokta gecikmesi.
+
+Kullanım: python bench_auth.py [eşzamanlı_giriş] [toplam_giriş]
+
+PASSWORD_HASH_WORKERS=0 ile eski (olay döngüsünde bcrypt) davranış ölçülür.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Uygulama içe aktarılmadan önce geçici veritabanı seçilmeli
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/bench_auth.db")
+
+import httpx
+
+import auth
+import main
+from database import init_schema
+
+PROBE_INTERVAL = 0.01
+
+
+def _percentiles(samples) -> str:
+    if not samples:
+        return "-"
+    values = np.array(samples) * 1000
+    return f"p50={np.percentile(values, 50):8.1f} ms  p99={np.percentile(values, 99):8.1f} ms  n={len(values)}"
+
+
+async def _login(client, latencies, statuses):
+    start = time.perf_counter()
+    response = await client.post("/auth/login", json={"username": "bench", "password": "bench-password"})
+    latencies.append(time.perf_counter() - start)
+    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def _probe(client, latencies, stop: asyncio.Event):
+    # Gecikme planlanan gönderim anından ölçülür; olay döngüsü donarsa
+    # istek hiç başlayamaz ve bu bekleme de sonuca yansır
+    scheduled = time.perf_counter()
+    while not stop.is_set():
+        await client.get("/health")
+        latencies.append(time.perf_counter() - scheduled)
+        scheduled = time.perf_counter() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def run(concurrency: int, total: int):
+    # ASGITransport başlangıç olaylarını çalıştırmaz
+    await init_schema()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await client.post("/auth/register", json={
+            "username": "bench", "email": "bench@example.com", "password": "bench-password"
+        })
+
+        login_latencies, probe_latencies, statuses = [], [], {}
+        stop = asyncio.Event()
+        probe = asyncio.create_task(_probe(client, probe_latencies, stop))
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited():
+            async with semaphore:
+                await _login(client, login_latencies, statuses)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(limited() for _ in range(total)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await probe
+
+    print(f"bcrypt rounds={auth.BCRYPT_ROUNDS} workers={auth.PASSWORD_HASH_WORKERS} "
+          f"max_pending={auth.PASSWORD_HASH_MAX_PENDING} eşzamanlı={concurrency}")
+    print(f"login   {_percentiles(login_latencies)}  durumlar={statuses}  {total / elapsed:.1f} giriş/sn")
+    print(f"health  {_percentiles(probe_latencies)}")
+    auth.password_hasher.shutdown()
+
+
+def main_cli():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    asyncio.run(run(concurrency, total))
+
+
+if __name__ == "__main__":
+    main_cli()
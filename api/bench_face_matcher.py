@@ -0,0 +1,62 @@
+"""Tanıma motoru karşılaştırması: galeri boyutuna göre kare başına gecikme.
+
+Kullanım: python bench_face_matcher.py [kare_başına_yüz] [tekrar]
+"""
+import sys
+import time
+
+import numpy as np
+
+from face_gallery import FACE_SIZE
+from face_matcher import VectorRecognizer
+
+GALLERY_SIZES = (100, 1000, 10000)
+
+
+def _random_faces(rng, count: int) -> np.ndarray:
+    return rng.integers(0, 256, size=(count, FACE_SIZE[1], FACE_SIZE[0]), dtype=np.uint8)
+
+
+def _time_ms(func, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return float(np.median(samples))
+
+
+def main():
+    faces_per_frame = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    rng = np.random.default_rng(42)
+    frame_faces = _random_faces(rng, faces_per_frame)
+
+    try:
+        import cv2
+        lbph_available = hasattr(cv2, "face")
+    except ImportError:
+        lbph_available = False
+
+    print(f"Kare başına {faces_per_frame} yüz, {repeat} tekrar (medyan ms)")
+    print(f"{'kimlik':>8} {'vector':>10} {'lbph':>10}")
+
+    for size in GALLERY_SIZES:
+        gallery = _random_faces(rng, size)
+        labels = np.arange(size, dtype=np.int32)
+
+        vector = VectorRecognizer()
+        vector.train(gallery, labels)
+        vector_ms = _time_ms(lambda: vector.predict_batch(frame_faces, top_k=5), repeat)
+
+        lbph_ms = "-"
+        if lbph_available:
+            lbph = cv2.face.LBPHFaceRecognizer_create()
+            lbph.train(list(gallery), labels)
+            lbph_ms = f"{_time_ms(lambda: [lbph.predict(face) for face in frame_faces], repeat):10.2f}"
+
+        print(f"{size:>8} {vector_ms:10.2f} {lbph_ms:>10}")
+
+
+if __name__ == "__main__":
+    main()
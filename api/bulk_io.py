@@ -0,0 +1,358 @@
+import codecs
+import csv
+import io
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from sqlalchemy import Boolean, DateTime, Float, Integer, insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from dashboard_stats import record as record_stats
+from database import AsyncSessionLocal, async_engine
+from listing import parse_fields
+import models
+
+# İçe aktarmada bir işlemde (transaction) yazılan satır sayısı
+BULK_IMPORT_CHUNK = int(os.getenv("BULK_IMPORT_CHUNK", "1000"))
+# Raporda ayrıntısı dönen en fazla satır hatası (sayım her zaman tam)
+BULK_IMPORT_MAX_ERRORS = int(os.getenv("BULK_IMPORT_MAX_ERRORS", "1000"))
+# PostgreSQL'de çok satırlı INSERT yerine COPY kullan
+BULK_IMPORT_USE_COPY = os.getenv("BULK_IMPORT_USE_COPY", "true").lower() == "true"
+# Dışa aktarmada sunucu tarafı imleçten bir seferde okunan satır
+BULK_EXPORT_BATCH = int(os.getenv("BULK_EXPORT_BATCH", "1000"))
+
+ENTITIES = {
+    "devices": models.Device,
+    "customers": models.Customer,
+    "vehicles": models.Vehicle,
+    "cameras": models.Camera,
+}
+
+# Satırda bulunması zorunlu alanlar
+REQUIRED_FIELDS = {
+    "devices": ("name",),
+    "customers": ("name",),
+    "vehicles": ("plate_number",),
+    "cameras": ("name",),
+}
+
+# Veritabanının atadığı, içe aktarmada kabul edilmeyen alanlar
+SERVER_FIELDS = {"id", "created_at"}
+
+FORMATS = ("csv", "ndjson")
+
+# Son içe/dışa aktarma raporları (/bulk/stats)
+recent_runs: deque = deque(maxlen=20)
+
+
+class RowError(ValueError):
+    pass
+
+
+def get_model(entity: str):
+    model = ENTITIES.get(entity)
+    if model is None:
+        raise KeyError(entity)
+    return model
+
+
+def detect_format(fmt: Optional[str], content_type: str) -> str:
+    if fmt:
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format, expected one of {list(FORMATS)}")
+        return fmt
+    return "csv" if "csv" in (content_type or "") else "ndjson"
+
+
+def _convert(column, value):
+    """Ham değeri sütun tipine çevir (CSV'de her şey metindir)"""
+    if value is None or value == "":
+        return None
+    column_type = column.type
+    try:
+        if isinstance(column_type, Boolean):
+            if isinstance(value, bool):
+                return value
+            lowered = str(value).strip().lower()
+            if lowered in ("1", "true", "yes", "evet"):
+                return True
+            if lowered in ("0", "false", "no", "hayır"):
+                return False
+            raise ValueError(value)
+        if isinstance(column_type, Integer):
+            if isinstance(value, bool):
+                raise ValueError(value)
+            return int(value)
+        if isinstance(column_type, Float):
+            return float(value)
+        if isinstance(column_type, DateTime):
+            if isinstance(value, datetime):
+                return value
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+            if parsed.tzinfo is not None:
+                parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+            return parsed
+    except (TypeError, ValueError):
+        raise RowError(f"{column.name}: invalid {column_type.__class__.__name__.lower()} {value!r}")
+    return str(value)
+
+
+class RowValidator:
+    """Ham satırları tabloya yazılabilir, hepsi aynı anahtarlara sahip sözlüklere çevirir"""
+
+    def __init__(self, entity: str, owner_id: int, is_admin: bool):
+        self.entity = entity
+        self.model = get_model(entity)
+        self.table = self.model.__table__
+        self.owner_id = owner_id
+        self.is_admin = is_admin
+        self.columns = [c for c in self.table.columns if c.name not in SERVER_FIELDS]
+        # Yazılan sütunlar: kullanıcı alanları + Python tarafı varsayılanlı sunucu alanları (created_at);
+        # COPY ORM/Core varsayılanlarını uygulamaz, değerler defaults() ile verilir
+        self.write_columns = [c for c in self.table.columns if c.name != "id"]
+        self.names = {c.name for c in self.columns}
+        self.unique = [c.name for c in self.columns if c.unique]
+
+    def defaults(self) -> Dict:
+        # executemany/COPY tüm satırlarda aynı sütunları ister; ORM varsayılanları burada doldurulur
+        defaults = {}
+        for column in self.write_columns:
+            default = column.default
+            if default is None:
+                defaults[column.name] = None
+            elif default.is_callable:
+                defaults[column.name] = default.arg(None)
+            else:
+                defaults[column.name] = default.arg
+        return defaults
+
+    def validate(self, raw: Dict) -> Dict:
+        if not isinstance(raw, dict):
+            raise RowError("row must be an object")
+        unknown = [k for k in raw if k not in self.names and k not in SERVER_FIELDS]
+        if unknown:
+            raise RowError(f"unknown fields {unknown}")
+        row = {}
+        for column in self.columns:
+            if column.name in raw:
+                value = _convert(column, raw[column.name])
+                if value is not None:
+                    row[column.name] = value
+        for name in REQUIRED_FIELDS[self.entity]:
+            if row.get(name) in (None, ""):
+                raise RowError(f"{name} is required")
+        user_id = row.get("user_id", self.owner_id)
+        if user_id != self.owner_id and not self.is_admin:
+            raise RowError("user_id must be your own user id")
+        row["user_id"] = user_id
+        return row
+
+    async def check_chunk(self, db, rows: List[Dict]) -> Dict[int, str]:
+        """Yabancı anahtar ve benzersizlik hatalarını satır bazında bul (index -> hata).
+
+        Tek bir bozuk satır tüm işlemi geri aldırmasın diye yazmadan önce kontrol edilir.
+        """
+        errors = {}
+        user_ids = {row["user_id"] for row in rows}
+        existing_users = set((await db.execute(
+            select(models.User.id).where(models.User.id.in_(user_ids))
+        )).scalars())
+        for i, row in enumerate(rows):
+            if row["user_id"] not in existing_users:
+                errors[i] = f"user_id {row['user_id']} does not exist"
+
+        for name in self.unique:
+            values = {row[name] for row in rows if row.get(name) is not None}
+            column = self.table.c[name]
+            taken = set((await db.execute(select(column).where(column.in_(values)))).scalars())
+            seen = set()
+            for i, row in enumerate(rows):
+                value = row.get(name)
+                if value is None or i in errors:
+                    continue
+                if value in taken or value in seen:
+                    errors[i] = f"{name} {value!r} already exists"
+                seen.add(value)
+        return errors
+
+
+async def iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Bayt akışını tamamı belleğe alınmadan satırlara böl (UTF-8, BOM toleranslı)"""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in stream:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def iter_csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    """Başlık satırlı CSV; tırnak içindeki satır sonları kayıt birleştirilerek korunur"""
+    header = None
+    record = ""
+    async for line in lines:
+        record += line
+        # Tek sayıda tırnak: alan hâlâ açık, kayıt sonraki satırda devam ediyor
+        if record.count('"') % 2:
+            continue
+        values = next(csv.reader([record]), [])
+        record = ""
+        if not values or values == [""]:
+            continue
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield RowError(f"expected {len(header)} columns, got {len(values)}")
+            continue
+        yield dict(zip(header, values))
+    if record.strip():
+        yield RowError("unterminated quoted field")
+
+
+async def iter_ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    async for line in lines:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as e:
+            yield RowError(f"invalid JSON: {e.msg}")
+
+
+async def _write_chunk(validator: RowValidator, chunk: List[tuple], report: Dict):
+    """Doğrulanmış satırları tek işlemde yaz; satır hatalarını rapora ekle"""
+    numbers = [number for number, _ in chunk]
+    rows = [row for _, row in chunk]
+    async with AsyncSessionLocal() as db:
+        try:
+            rejected = await validator.check_chunk(db, rows)
+            for i in sorted(rejected):
+                _add_error(report, numbers[i], rejected[i])
+            defaults = validator.defaults()
+            rows = [{**defaults, **row} for i, row in enumerate(rows) if i not in rejected]
+            if rows:
+                conn = await db.connection()
+                if BULK_IMPORT_USE_COPY and conn.dialect.name == "postgresql":
+                    columns = list(defaults)
+                    raw = await conn.get_raw_connection()
+                    await raw.driver_connection.copy_records_to_table(
+                        validator.table.name, records=[tuple(row[c] for c in columns) for row in rows], columns=columns
+                    )
+                else:
+                    # SQLAlchemy bunu çok satırlı INSERT ... VALUES gruplarına çevirir
+                    await db.execute(insert(validator.table), rows)
+                if validator.model is models.Device:
+                    record_stats(db.sync_session, total_devices=len(rows),
+                                 online_devices=sum(row["status"] == "online" for row in rows))
+            await db.commit()
+            report["inserted"] += len(rows)
+        except SQLAlchemyError as e:
+            await db.rollback()
+            print(f"Toplu içe aktarma hatası: {e}")
+            message = str(getattr(e, "orig", None) or e).splitlines()[0]
+            for number in numbers:
+                _add_error(report, number, f"chunk rolled back: {message}")
+        except Exception as e:
+            # asyncpg COPY hataları SQLAlchemy sarmalayıcısı olmadan gelir
+            await db.rollback()
+            print(f"Toplu içe aktarma hatası: {e}")
+            for number in numbers:
+                _add_error(report, number, f"chunk rolled back: {e}")
+
+
+def _add_error(report: Dict, row_number: int, message: str):
+    report["failed"] += 1
+    if len(report["errors"]) < BULK_IMPORT_MAX_ERRORS:
+        report["errors"].append({"row": row_number, "error": message})
+
+
+async def import_rows(entity: str, fmt: str, stream: AsyncIterator[bytes], owner_id: int, is_admin: bool = False) -> Dict:
+    """Akıştan satırları oku, parça parça doğrula ve her parçayı ayrı işlemde yaz"""
+    validator = RowValidator(entity, owner_id, is_admin)
+    parser = iter_csv_rows if fmt == "csv" else iter_ndjson_rows
+    report = {"entity": entity, "format": fmt, "rows": 0, "inserted": 0, "failed": 0, "errors": []}
+    start = time.perf_counter()
+
+    chunk = []
+    async for raw in parser(iter_lines(stream)):
+        report["rows"] += 1
+        # Satır numarası veri satırını gösterir (CSV başlığı sayılmaz)
+        number = report["rows"]
+        try:
+            if isinstance(raw, RowError):
+                raise raw
+            chunk.append((number, validator.validate(raw)))
+        except RowError as e:
+            _add_error(report, number, str(e))
+        if len(chunk) >= BULK_IMPORT_CHUNK:
+            await _write_chunk(validator, chunk, report)
+            chunk = []
+    if chunk:
+        await _write_chunk(validator, chunk, report)
+
+    report["errors"].sort(key=lambda error: error["row"])
+    elapsed = time.perf_counter() - start
+    report["elapsed"] = round(elapsed, 3)
+    report["rows_per_sec"] = round(report["rows"] / elapsed, 1) if elapsed > 0 else None
+    recent_runs.append({key: value for key, value in report.items() if key != "errors"} | {"kind": "import"})
+    return report
+
+
+async def export_rows(entity: str, fmt: str, owner_id: int, is_admin: bool = False, fields: Optional[str] = None,
+                      user_id: Optional[int] = None, status: Optional[str] = None) -> AsyncIterator[str]:
+    """Tabloyu sunucu tarafı imleçle parça parça okuyup CSV/NDJSON satırları üret.
+
+    İçe aktarmadaki gibi yönetici olmayan kullanıcı yalnızca kendi kayıtlarını alır.
+    NDJSON akışı son satırda özet ({"export": {...}}) döner.
+    """
+    if not is_admin:
+        user_id = owner_id
+    model = get_model(entity)
+    table = model.__table__
+    columns = parse_fields(model, fields)
+    stmt = select(*[table.c[name] for name in columns]).order_by(table.c.id)
+    if user_id is not None:
+        stmt = stmt.where(table.c.user_id == user_id)
+    if status is not None:
+        stmt = stmt.where(table.c.status == status)
+
+    start = time.perf_counter()
+    count = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(columns)
+        yield buffer.getvalue()
+
+    async with async_engine.connect() as conn:
+        result = await conn.stream(stmt.execution_options(yield_per=BULK_EXPORT_BATCH))
+        async for partition in result.partitions(BULK_EXPORT_BATCH):
+            buffer.seek(0)
+            buffer.truncate()
+            for row in partition:
+                values = [value.isoformat() + "Z" if isinstance(value, datetime) else value for value in row]
+                if fmt == "csv":
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(columns, values))) + "\n")
+            count += len(partition)
+            yield buffer.getvalue()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "kind": "export", "entity": entity, "format": fmt, "rows": count, "elapsed": round(elapsed, 3),
+        "rows_per_sec": round(count / elapsed, 1) if elapsed > 0 else None
+    }
+    recent_runs.append(summary)
+    if fmt == "ndjson":
+        yield json.dumps({"export": summary}) + "\n"
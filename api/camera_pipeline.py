@@ -0,0 +1,266 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+import cv2
+import numpy as np
+
+from database import SessionLocal
+from face_executor import face_executor, FaceServiceBusy
+import models
+
+# Her N. işlenen karede tam tespit, aradaki karelerde takip
+CAMERA_DETECT_EVERY = int(os.getenv("CAMERA_DETECT_EVERY", "5"))
+# Kamera başına analiz hızı üst sınırı (kare/saniye)
+CAMERA_ANALYSIS_FPS = float(os.getenv("CAMERA_ANALYSIS_FPS", "10"))
+CAMERA_RECONNECT_DELAY = float(os.getenv("CAMERA_RECONNECT_DELAY", "5"))
+# Kamera karelerinde kullanılacak tespit profili (face_profiles.DETECTION_PROFILES)
+CAMERA_DETECTION_PROFILE = os.getenv("CAMERA_DETECTION_PROFILE", "balanced")
+
+
+def build_stream_url(camera) -> Optional[str]:
+    """Camera satırından akış adresi oluştur"""
+    if camera.stream_url:
+        return camera.stream_url
+    if not camera.ip_address:
+        return None
+    # Kimlik bilgilerindeki @ : / gibi karakterler URL'yi bozmasın
+    credentials = f"{quote(camera.username, safe='')}:{quote(camera.password or '', safe='')}@" if camera.username else ""
+    return f"rtsp://{credentials}{camera.ip_address}:{camera.port or 554}/"
+
+
+class CameraReader(threading.Thread):
+    """Akıştan sürekli kare okuyup yalnızca en yenisini tutan okuyucu.
+
+    Analiz geride kalırsa eski kareler üzerine yazılır (latest-frame-wins);
+    böylece kuyruk birikmez ve gecikme sabit kalır.
+    """
+
+    def __init__(self, camera_id: int, url: str):
+        super().__init__(name=f"camera-reader-{camera_id}", daemon=True)
+        self.camera_id = camera_id
+        self.url = url
+        # Yerel dosyalar (test/loopback) bitince başa sarılır
+        self.loop_file = os.path.isfile(url)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._frame = None
+        self._frame_seq = 0
+        self._frame_time = 0.0
+        self.frames_read = 0
+        self.connected = False
+
+    def stop(self):
+        self._stop_event.set()
+
+    def get_latest(self):
+        """(kare, sıra no, zaman) - henüz kare yoksa kare None"""
+        with self._lock:
+            return self._frame, self._frame_seq, self._frame_time
+
+    def run(self):
+        while not self._stop_event.is_set():
+            capture = cv2.VideoCapture(self.url)
+            if not capture.isOpened():
+                self.connected = False
+                self._stop_event.wait(CAMERA_RECONNECT_DELAY)
+                continue
+
+            self.connected = True
+            frame_interval = 0.0
+            if self.loop_file:
+                # Dosyayı gerçek zamanlı hızda oynat
+                fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+                frame_interval = 1.0 / fps
+
+            while not self._stop_event.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    break
+
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                with self._lock:
+                    self._frame = gray
+                    self._frame_seq += 1
+                    self._frame_time = time.time()
+                self.frames_read += 1
+
+                if frame_interval:
+                    self._stop_event.wait(frame_interval)
+
+            capture.release()
+            self.connected = False
+            if not self.loop_file:
+                self._stop_event.wait(CAMERA_RECONNECT_DELAY)
+
+
+class FaceTracker:
+    """Tespitler arasında yüz kutularını OpenCV izleyicileriyle takip et"""
+
+    def __init__(self):
+        self._create = getattr(cv2, "TrackerKCF_create", None)
+        self._tracks = []
+
+    def reset(self, frame: np.ndarray, faces: List[Dict]):
+        self._tracks = []
+        for face in faces:
+            tracker = self._create() if self._create else None
+            if tracker is not None:
+                tracker.init(frame, (face['x'], face['y'], face['width'], face['height']))
+            self._tracks.append((tracker, dict(face)))
+
+    def update(self, frame: np.ndarray) -> List[Dict]:
+        faces = []
+        tracks = []
+        for tracker, face in self._tracks:
+            if tracker is not None:
+                ok, (x, y, w, h) = tracker.update(frame)
+                if not ok:
+                    # Kaybedilen yüz bir sonraki tespite kadar düşülür
+                    continue
+                face.update({'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)})
+            face['tracked'] = True
+            tracks.append((tracker, face))
+            faces.append(dict(face))
+        self._tracks = tracks
+        return faces
+
+
+class CameraPipeline:
+    """Camera tablosundaki her kamera için okuma + analiz hattı"""
+
+    def __init__(self, detect_every: int = CAMERA_DETECT_EVERY, analysis_fps: float = CAMERA_ANALYSIS_FPS):
+        self.detect_every = max(1, detect_every)
+        self.analysis_interval = 1.0 / analysis_fps if analysis_fps > 0 else 0.0
+        self.readers: Dict[int, CameraReader] = {}
+        self.tasks: Dict[int, asyncio.Task] = {}
+        self.results: Dict[int, Dict] = {}
+        self.stats: Dict[int, Dict] = {}
+        self._subscribers: List[asyncio.Queue] = []
+
+    def load_cameras(self) -> Dict[int, str]:
+        """Veritabanından kamera akış adreslerini oku"""
+        db = SessionLocal()
+        try:
+            cameras = db.query(models.Camera).all()
+            urls = {}
+            for camera in cameras:
+                url = build_stream_url(camera)
+                if url:
+                    urls[camera.id] = url
+            return urls
+        finally:
+            db.close()
+
+    async def sync(self):
+        """Çalışan hatları Camera tablosuyla eşitle"""
+        urls = await asyncio.to_thread(self.load_cameras)
+
+        for camera_id in list(self.readers):
+            reader = self.readers[camera_id]
+            if urls.get(camera_id) != reader.url:
+                self.stop_camera(camera_id)
+
+        for camera_id, url in urls.items():
+            if camera_id not in self.readers:
+                self.start_camera(camera_id, url)
+
+    def start_camera(self, camera_id: int, url: str):
+        reader = CameraReader(camera_id, url)
+        reader.start()
+        self.readers[camera_id] = reader
+        self.stats[camera_id] = {'analyzed': 0, 'detections': 0, 'skipped_busy': 0}
+        self.tasks[camera_id] = asyncio.create_task(self._analyze(camera_id, reader))
+
+    def stop_camera(self, camera_id: int):
+        reader = self.readers.pop(camera_id, None)
+        if reader is not None:
+            reader.stop()
+        task = self.tasks.pop(camera_id, None)
+        if task is not None:
+            task.cancel()
+        self.results.pop(camera_id, None)
+        self.stats.pop(camera_id, None)
+
+    async def stop(self):
+        for camera_id in list(self.readers):
+            self.stop_camera(camera_id)
+
+    def subscribe(self, maxsize: int = 100) -> asyncio.Queue:
+        """Analiz sonuçlarını alacak kuyruk"""
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        if queue in self._subscribers:
+            self._subscribers.remove(queue)
+
+    def _publish(self, result: Dict):
+        for queue in self._subscribers:
+            if queue.full():
+                # Yavaş abone en eski sonucu kaybeder
+                queue.get_nowait()
+            queue.put_nowait(result)
+
+    async def _analyze(self, camera_id: int, reader: CameraReader):
+        tracker = FaceTracker()
+        stats = self.stats[camera_id]
+        last_seq = 0
+        processed = 0
+
+        while True:
+            await asyncio.sleep(self.analysis_interval)
+
+            frame, seq, frame_time = reader.get_latest()
+            if frame is None or seq == last_seq:
+                continue
+            last_seq = seq
+
+            faces = None
+            try:
+                if processed % self.detect_every == 0:
+                    try:
+                        faces = await face_executor.run("detect_faces_image", frame, CAMERA_DETECTION_PROFILE)
+                        await asyncio.to_thread(tracker.reset, frame, faces)
+                        stats['detections'] += 1
+                    except FaceServiceBusy:
+                        stats['skipped_busy'] += 1
+                if faces is None:
+                    faces = await asyncio.to_thread(tracker.update, frame)
+            except Exception as e:
+                print(f"Kamera {camera_id} analiz hatası: {e}")
+                continue
+
+            processed += 1
+            stats['analyzed'] = processed
+
+            result = {
+                'camera_id': camera_id,
+                'frame_seq': seq,
+                'frame_time': datetime.fromtimestamp(frame_time).isoformat(),
+                'faces': faces,
+                'count': len(faces)
+            }
+            self.results[camera_id] = result
+            self._publish(result)
+
+    def get_status(self) -> List[Dict]:
+        status = []
+        for camera_id, reader in self.readers.items():
+            status.append({
+                'camera_id': camera_id,
+                'connected': reader.connected,
+                'frames_read': reader.frames_read,
+                'frames_dropped': max(0, reader.frames_read - self.stats.get(camera_id, {}).get('analyzed', 0)),
+                **self.stats.get(camera_id, {})
+            })
+        return status
+
+
+# Global pipeline instance
+camera_pipeline = CameraPipeline()
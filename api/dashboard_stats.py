@@ -0,0 +1,319 @@
+import asyncio
+import heapq
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from database import AsyncSessionLocal
+import models
+import redis_client
+
+# Sayaçların veritabanındaki gerçek değerlerle karşılaştırılma aralığı (saniye)
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "300"))
+# Redis yokken okumada sayaçların veritabanından yenilenme aralığı (saniye); işçiler
+# kendi artışlarını göremediği için değerler en fazla bu kadar eski kalır
+STATS_LOCAL_REFRESH = float(os.getenv("STATS_LOCAL_REFRESH", "10"))
+# Commit'lerde biriken sayaç farklarının Redis'e gönderilme aralığı (saniye)
+STATS_PUSH_INTERVAL = float(os.getenv("STATS_PUSH_INTERVAL", "1"))
+# uvicorn --workers ile aynı değişken; Redis'siz çok işçili kurulumda uyarı için
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+REDIS_COUNTERS_KEY = "dakitai:stats:counters"
+REDIS_SESSIONS_KEY = "dakitai:stats:sessions"
+# Aynı anda tek işçinin uzlaştırma yapması için kilit anahtarı
+REDIS_RECONCILE_LOCK = "dakitai:stats:reconcile"
+
+COUNTERS = ("total_devices", "online_devices", "total_users")
+
+
+def record(session: Session, **deltas: int):
+    """Toplu (ORM olayı üretmeyen) işlemlerin sayaç değişikliklerini oturuma ekle.
+
+    Değişiklikler commit sonrası uygulanır, rollback olursa atılır.
+    """
+    pending = session.info.setdefault("stats_deltas", {})
+    for name, delta in deltas.items():
+        if delta:
+            pending[name] = pending.get(name, 0) + delta
+
+
+def _device_online(obj, history=None) -> bool:
+    if history is not None and history.deleted:
+        return history.deleted[0] == "online"
+    return obj.status == "online"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_deltas(session, flush_context):
+    deltas = {}
+
+    def add(name, delta):
+        deltas[name] = deltas.get(name, 0) + delta
+
+    for obj in session.new:
+        if isinstance(obj, models.Device):
+            add("total_devices", 1)
+            add("online_devices", int(obj.status == "online"))
+        elif isinstance(obj, models.User):
+            add("total_users", 1)
+    for obj in session.deleted:
+        if isinstance(obj, models.Device):
+            add("total_devices", -1)
+            add("online_devices", -int(_device_online(obj, inspect(obj).attrs.status.history)))
+        elif isinstance(obj, models.User):
+            add("total_users", -1)
+    for obj in session.dirty:
+        if isinstance(obj, models.Device):
+            history = inspect(obj).attrs.status.history
+            if history.added or history.deleted:
+                add("online_devices", int(obj.status == "online") - int(_device_online(obj, history)))
+    record(session, **deltas)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_deltas(session):
+    deltas = session.info.pop("stats_deltas", None)
+    if deltas:
+        dashboard_stats.apply(deltas)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_deltas(session):
+    session.info.pop("stats_deltas", None)
+
+
+class DashboardStats:
+    """Pano sayaçları: değişiklikte artırılır, okumada sorgu çalışmaz.
+
+    Redis varsa sayaçlar ve oturumlar işçiler arasında paylaşılır; commit
+    kancası yalnızca bellekteki farkı biriktirir, fark olay döngüsündeki
+    görevle Redis'e gönderilir. Redis yoksa sayaçlar okumada en geç
+    STATS_LOCAL_REFRESH saniyede bir veritabanından yenilenir; aktif oturumlar
+    ise yalnızca bu işçinin oturumlarıdır, bu yüzden çok işçili kurulumda Redis
+    gerekir. Kaçan değişiklikler (toplu SQL, başka süreçler) periyodik
+    uzlaştırmada veritabanından düzeltilir.
+    """
+
+    def __init__(self):
+        self._counters = {name: 0 for name in COUNTERS}
+        # Redis'e henüz gönderilmemiş sayaç farkları
+        self._pending: Dict[str, int] = {}
+        # Yerel oturumlar: jti -> bitiş; süresi dolanlar yığından sırayla düşer
+        self._sessions = {}
+        self._session_heap = []
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._counted_at = 0.0
+        self.reconciled_at: Optional[datetime] = None
+        self.last_drift: Dict[str, int] = {}
+        self.reconciles = 0
+
+    def apply(self, deltas: Dict[str, int]):
+        """Commit kancasından (herhangi bir iş parçacığı) çağrılır; ağ erişimi yapmaz"""
+        with self._lock:
+            for name, delta in deltas.items():
+                # Yerel sayaçlar Redis kesintisinde yedek olarak her zaman güncel tutulur
+                self._counters[name] = self._counters.get(name, 0) + delta
+                if redis_client.redis_available():
+                    self._pending[name] = self._pending.get(name, 0) + delta
+
+    async def _push_pending(self):
+        """Biriken farkları Redis'e gönder; hata olursa farklar bir sonraki tura kalır"""
+        client = redis_client.get_async_redis()
+        if client is None:
+            return
+        with self._lock:
+            deltas, self._pending = self._pending, {}
+        deltas = {name: delta for name, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            for name, delta in deltas.items():
+                pipe.hincrby(REDIS_COUNTERS_KEY, name, delta)
+            await pipe.execute()
+        except Exception as e:
+            print(f"Redis sayaç hatası: {e}")
+            redis_client.mark_failed()
+            with self._lock:
+                for name, delta in deltas.items():
+                    self._pending[name] = self._pending.get(name, 0) + delta
+
+    async def session_started(self, session_id: str, expires: float):
+        """expires: oturumun (token'ın) bitişi, Unix zamanı"""
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                await client.zadd(REDIS_SESSIONS_KEY, {session_id: expires})
+            except Exception as e:
+                print(f"Redis oturum hatası: {e}")
+                redis_client.mark_failed()
+        with self._lock:
+            self._sessions[session_id] = expires
+            heapq.heappush(self._session_heap, (expires, session_id))
+
+    async def session_ended(self, session_id: str):
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                await client.zrem(REDIS_SESSIONS_KEY, session_id)
+            except Exception as e:
+                print(f"Redis oturum hatası: {e}")
+                redis_client.mark_failed()
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _prune_sessions(self, now: float):
+        heap = self._session_heap
+        while heap and heap[0][0] <= now:
+            expires, session_id = heapq.heappop(heap)
+            if self._sessions.get(session_id) == expires:
+                del self._sessions[session_id]
+
+    async def get(self) -> Dict[str, int]:
+        now = time.time()
+        client = redis_client.get_async_redis()
+        if client is not None:
+            # Bu işçinin gönderilmemiş değişiklikleri de okumaya yansısın
+            await self._push_pending()
+            try:
+                pipe = client.pipeline(transaction=False)
+                pipe.hgetall(REDIS_COUNTERS_KEY)
+                pipe.zremrangebyscore(REDIS_SESSIONS_KEY, "-inf", now)
+                pipe.zcard(REDIS_SESSIONS_KEY)
+                counters, _, sessions = await pipe.execute()
+                values = {name: int(counters.get(name.encode(), 0)) for name in COUNTERS}
+                values["active_sessions"] = sessions
+                return values
+            except Exception as e:
+                print(f"Redis sayaç okuma hatası: {e}")
+                redis_client.mark_failed()
+        with self._lock:
+            self._prune_sessions(now)
+            values = {name: self._counters.get(name, 0) for name in COUNTERS}
+            values["active_sessions"] = len(self._sessions)
+        return values
+
+    async def read(self) -> Dict[str, int]:
+        """Pano değerleri; Redis yoksa süresi dolan yerel sayaçlar önce veritabanından yenilenir"""
+        if redis_client.get_async_redis() is None and time.monotonic() - self._counted_at > STATS_LOCAL_REFRESH:
+            # Eşzamanlı okumalar aynı yenilemeyi tekrarlamasın
+            self._counted_at = time.monotonic()
+            try:
+                actual = await self.count_from_database()
+            except Exception:
+                self._counted_at = 0.0
+                raise
+            with self._lock:
+                self._counters.update(actual)
+        return await self.get()
+
+    async def count_from_database(self) -> Dict[str, int]:
+        async with AsyncSessionLocal() as db:
+            total_devices = await db.scalar(select(func.count()).select_from(models.Device))
+            online_devices = await db.scalar(
+                select(func.count()).select_from(models.Device).where(models.Device.status == "online")
+            )
+            total_users = await db.scalar(select(func.count()).select_from(models.User))
+        return {"total_devices": total_devices, "online_devices": online_devices, "total_users": total_users}
+
+    async def _acquire_reconcile(self) -> bool:
+        client = redis_client.get_async_redis()
+        if client is None:
+            return True
+        try:
+            ttl = max(1, int(STATS_RECONCILE_INTERVAL * 0.9))
+            return bool(await client.set(REDIS_RECONCILE_LOCK, "1", nx=True, ex=ttl))
+        except Exception as e:
+            print(f"Redis kilit hatası: {e}")
+            redis_client.mark_failed()
+            return True
+
+    async def reconcile(self, force: bool = False) -> Dict[str, int]:
+        """Sayaçları COUNT sorgularıyla düzelt; sapmayı döndür.
+
+        Sorgu ile yazma arasında commit edilen değişiklikler bir sonraki
+        uzlaştırmaya kadar sapma olarak kalabilir.
+        """
+        if not force and not await self._acquire_reconcile():
+            return {}
+        actual = await self.count_from_database()
+        current = await self.get()
+        drift = {name: actual[name] - current.get(name, 0) for name in COUNTERS if actual[name] != current.get(name, 0)}
+
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                await client.hset(REDIS_COUNTERS_KEY, mapping=actual)
+            except Exception as e:
+                print(f"Redis sayaç yazma hatası: {e}")
+                redis_client.mark_failed()
+        with self._lock:
+            self._counters.update(actual)
+            self._prune_sessions(time.time())
+        self._counted_at = time.monotonic()
+
+        self.reconciled_at = datetime.utcnow()
+        self.last_drift = drift
+        self.reconciles += 1
+        return drift
+
+    async def _reconcile_loop(self):
+        # İlk uzlaştırma başlangıçta: sayaçlar mevcut verilerden başlar
+        force = True
+        while True:
+            try:
+                drift = await self.reconcile(force=force)
+                force = False
+                if drift:
+                    print(f"Pano sayaçları düzeltildi: {drift}")
+            except Exception as e:
+                print(f"Sayaç uzlaştırma hatası: {e}")
+            await asyncio.sleep(STATS_RECONCILE_INTERVAL)
+
+    async def _push_loop(self):
+        while True:
+            await asyncio.sleep(STATS_PUSH_INTERVAL)
+            await self._push_pending()
+
+    def start(self):
+        if not self._tasks:
+            if WEB_CONCURRENCY > 1 and not redis_client.redis_available():
+                print("Uyarı: REDIS_URL yok; aktif oturum sayısı ve çıkışlar yalnızca tek işçide geçerli")
+            self._tasks = [asyncio.create_task(self._reconcile_loop())]
+            if redis_client.redis_available():
+                self._tasks.append(asyncio.create_task(self._push_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Kapanışta gönderilmemiş farklar kaybolmasın
+        await self._push_pending()
+
+    def get_stats(self) -> Dict:
+        redis = redis_client.get_async_redis() is not None
+        return {
+            "redis": redis,
+            "reconcile_interval": STATS_RECONCILE_INTERVAL,
+            # Redis yoksa aktif oturumlar yalnızca bu işçiye aittir
+            "sessions_scope": "cluster" if redis else "worker",
+            "pending": dict(self._pending),
+            "reconciled_at": self.reconciled_at.isoformat() + "Z" if self.reconciled_at else None,
+            "reconciles": self.reconciles,
+            "last_drift": self.last_drift
+        }
+
+
+# Global sayaç instance
+dashboard_stats = DashboardStats()
@@ -1,63 +1,282 @@
 import asyncio
 import json
+import os
 import psutil
 import time
-import requests
+import httpx
+import numpy as np
 from datetime import datetime
+from typing import Dict, List, Optional
+from edge_impulse_client import create_async_client, aggregate_values, AGGREGATE_STATS
+from edge_impulse_outbox import edge_impulse_outbox, EdgeImpulseOutbox, OutboxBusy
+
+# Metriklerin gönderileceği panel API adresi
+DEVICE_MONITOR_API_BASE = os.getenv("DEVICE_MONITOR_API_BASE", "https://panel.dakiktabela.com/api")
+# true: metrikler API yerine doğrudan yerel kalıcı kuyruğa yazılır
+DEVICE_MONITOR_OUTBOX = os.getenv("DEVICE_MONITOR_OUTBOX", "false").lower() == "true"
+# simple: 30 sn'de bir tek örnek, aggregate: yüksek frekanslı örnekleme + pencere özetleri
+DEVICE_MONITOR_MODE = os.getenv("DEVICE_MONITOR_MODE", "simple")
+DEVICE_MONITOR_DEVICE_NAME = os.getenv("DEVICE_MONITOR_DEVICE_NAME", "dakitai_server")
+# Örnekleme hızı (Hz), özet penceresi (sn) ve halka tampon kapasitesi (örnek)
+DEVICE_MONITOR_SAMPLE_HZ = float(os.getenv("DEVICE_MONITOR_SAMPLE_HZ", "10"))
+DEVICE_MONITOR_WINDOW = float(os.getenv("DEVICE_MONITOR_WINDOW", "30"))
+DEVICE_MONITOR_BUFFER_SIZE = int(os.getenv("DEVICE_MONITOR_BUFFER_SIZE", "4096"))
+
+
+class MetricRingBuffer:
+    """Sabit boyutlu NumPy halka tamponu; en eski örneklerin üzerine yazılır"""
+
+    def __init__(self, columns: List[str], capacity: int = DEVICE_MONITOR_BUFFER_SIZE):
+        self.columns = columns
+        self.capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._data = np.zeros((capacity, len(columns)), dtype=np.float32)
+        self._next = 0
+        self._count = 0
+        self.overwritten = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp: float, values):
+        if self._count == self.capacity:
+            self.overwritten += 1
+        else:
+            self._count += 1
+        self._times[self._next] = timestamp
+        self._data[self._next] = values
+        self._next = (self._next + 1) % self.capacity
+
+    def window(self, start: float, end: float):
+        """[start, end) aralığındaki örnekler (zamanlar, değerler)"""
+        if self._count < self.capacity:
+            times, data = self._times[:self._count], self._data[:self._count]
+        else:
+            times, data = self._times, self._data
+        mask = (times >= start) & (times < end)
+        return times[mask], data[mask]
+
+    def aggregate(self, start: float, end: float) -> Optional[Dict]:
+        """Penceredeki her kolon için min/max/mean/p95"""
+        times, data = self.window(start, end)
+        if len(times) == 0:
+            return None
+        stats = np.stack([
+            data.min(axis=0),
+            data.max(axis=0),
+            data.mean(axis=0),
+            np.percentile(data, 95, axis=0)
+        ])
+        return {
+            "window_start": start,
+            "window_end": end,
+            "samples": int(len(times)),
+            "columns": self.columns,
+            **{name: stats[i].round(3).tolist() for i, name in enumerate(AGGREGATE_STATS)}
+        }
+
+
+class SystemSampler:
+    """psutil sayaçlarından bloklamayan anlık örnek üretici.
+
+    cpu_percent(interval=None) bir önceki çağrıya göre hesaplar, uyumaz;
+    ağ hızları ardışık sayaç farklarından çıkarılır.
+    """
+
+    def __init__(self, disk_path: str = '/'):
+        self.disk_path = disk_path
+        self.core_count = psutil.cpu_count() or 1
+        self.columns = ["cpu", "ram", "disk", "net_sent_bps", "net_recv_bps"] + \
+            [f"cpu{i}" for i in range(self.core_count)]
+        # İlk çağrılar referans noktasını oluşturur
+        psutil.cpu_percent(interval=None)
+        psutil.cpu_percent(interval=None, percpu=True)
+        self._last_net = psutil.net_io_counters()
+        self._last_time = time.monotonic()
+
+    def sample(self) -> List[float]:
+        now = time.monotonic()
+        elapsed = max(now - self._last_time, 1e-6)
+        net = psutil.net_io_counters()
+        sent_bps = (net.bytes_sent - self._last_net.bytes_sent) / elapsed
+        recv_bps = (net.bytes_recv - self._last_net.bytes_recv) / elapsed
+        self._last_net, self._last_time = net, now
+
+        cores = psutil.cpu_percent(interval=None, percpu=True)[:self.core_count]
+        cores += [0.0] * (self.core_count - len(cores))
+        return [
+            psutil.cpu_percent(interval=None),
+            psutil.virtual_memory().percent,
+            psutil.disk_usage(self.disk_path).percent,
+            sent_bps,
+            recv_bps
+        ] + cores
 
 class DeviceMonitor:
-    def __init__(self):
-        self.api_base = "https://panel.dakiktabela.com/api"
-        
+    def __init__(self, api_base: str = DEVICE_MONITOR_API_BASE, client: Optional[httpx.AsyncClient] = None,
+                 outbox: Optional[EdgeImpulseOutbox] = edge_impulse_outbox if DEVICE_MONITOR_OUTBOX else None):
+        self.api_base = api_base.rstrip('/')
+        self.outbox = outbox
+        # Dışarıdan verilen istemci paylaşılır, kapatılması sahibine aittir
+        self._client = client
+        self._owns_client = client is None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = create_async_client(self.api_base)
+        return self._client
+
+    async def close(self):
+        if self._owns_client and self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
     async def collect_system_metrics(self):
         """Sistem metriklerini topla"""
-        cpu_percent = psutil.cpu_percent(interval=1)
+        # 1 sn'lik ölçüm olay döngüsünü bloklamasın
+        cpu_percent = await asyncio.to_thread(psutil.cpu_percent, 1)
         memory = psutil.virtual_memory()
         disk = psutil.disk_usage('/')
-        
+
         return {
-            "device_name": "dakitai_server",
+            "device_name": DEVICE_MONITOR_DEVICE_NAME,
             "cpu_usage": cpu_percent,
             "ram_usage": memory.percent,
             "disk_usage": disk.percent,
             "timestamp": datetime.now().isoformat()
         }
-    
+
     async def send_to_edge_impulse(self, metrics):
         """Metrikleri Edge Impulse'a gönder"""
+        if self.outbox is not None:
+            try:
+                await self.outbox.enqueue_async(
+                    metrics["device_name"],
+                    [[metrics["cpu_usage"], metrics["ram_usage"], metrics["disk_usage"]]],
+                    "system_metrics"
+                )
+            except OutboxBusy:
+                print("Edge Impulse kuyruğu meşgul, örnek atlandı")
+                return False
+            return True
+
         try:
-            response = requests.post(
+            client = await self._get_client()
+            response = await client.post(
                 f"{self.api_base}/edge-impulse/device-metrics",
-                json=metrics,
-                headers={"Content-Type": "application/json"}
+                json=metrics
             )
             return response.status_code == 200
         except Exception as e:
             print(f"Edge Impulse gönderim hatası: {e}")
             return False
-    
+
     async def monitor_loop(self):
         """Ana izleme döngüsü"""
         print("DAKİTAI Edge Impulse Monitor başlatıldı...")
-        
+        if self.outbox is not None:
+            # Kuyruğu başka süreç (API) boşaltmıyorsa bu süreç boşaltır
+            self.outbox.start()
+
+        try:
+            while True:
+                try:
+                    # Metrikleri topla
+                    metrics = await self.collect_system_metrics()
+
+                    # Edge Impulse'a gönder
+                    success = await self.send_to_edge_impulse(metrics)
+
+                    status = "✅ Başarılı" if success else "❌ Hata"
+                    print(f"{datetime.now().strftime('%H:%M:%S')} - {status} - CPU: {metrics['cpu_usage']:.1f}% RAM: {metrics['ram_usage']:.1f}%")
+
+                    # 30 saniye bekle
+                    await asyncio.sleep(30)
+
+                except Exception as e:
+                    print(f"Monitor hatası: {e}")
+                    await asyncio.sleep(10)
+        finally:
+            if self.outbox is not None:
+                await self.outbox.stop()
+                await self.outbox.client.aclose()
+            await self.close()
+
+    async def send_aggregate(self, aggregate: Dict) -> bool:
+        """Pencere özetini tek kayıt olarak gönder"""
+        aggregate = {"device_name": DEVICE_MONITOR_DEVICE_NAME, **aggregate}
+        if self.outbox is not None:
+            try:
+                await self.outbox.enqueue_async(aggregate["device_name"], [aggregate_values(aggregate)],
+                                                "system_metrics_aggregate")
+            except OutboxBusy:
+                print("Edge Impulse kuyruğu meşgul, özet atlandı")
+                return False
+            return True
+
+        try:
+            client = await self._get_client()
+            response = await client.post(
+                f"{self.api_base}/edge-impulse/device-metrics/aggregate",
+                json=aggregate
+            )
+            return response.status_code == 200
+        except Exception as e:
+            print(f"Edge Impulse özet gönderim hatası: {e}")
+            return False
+
+    async def _sample_loop(self, sampler: SystemSampler, buffer: MetricRingBuffer, interval: float):
+        # Örnekleme çağrıları ~0.3 ms sürer; sabit takvimle kayma biriktirmeden örnekle
+        next_time = time.monotonic()
         while True:
             try:
-                # Metrikleri topla
-                metrics = await self.collect_system_metrics()
-                
-                # Edge Impulse'a gönder
-                success = await self.send_to_edge_impulse(metrics)
-                
-                status = "✅ Başarılı" if success else "❌ Hata"
-                print(f"{datetime.now().strftime('%H:%M:%S')} - {status} - CPU: {metrics['cpu_usage']:.1f}% RAM: {metrics['ram_usage']:.1f}%")
-                
-                # 30 saniye bekle
-                await asyncio.sleep(30)
-                
+                buffer.append(time.time(), sampler.sample())
             except Exception as e:
-                print(f"Monitor hatası: {e}")
-                await asyncio.sleep(10)
+                print(f"Örnekleme hatası: {e}")
+            next_time += interval
+            delay = next_time - time.monotonic()
+            if delay < 0:
+                # Geride kalındıysa kaçırılan örnekler atlanır
+                next_time = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def aggregate_loop(self, sample_hz: float = DEVICE_MONITOR_SAMPLE_HZ, window: float = DEVICE_MONITOR_WINDOW):
+        """Yüksek frekanslı örnekleme, pencere özetlerini ayrı takvimle gönder"""
+        print(f"DAKİTAI Edge Impulse Monitor başlatıldı ({sample_hz:g} Hz, {window:g} sn pencere)...")
+        if self.outbox is not None:
+            self.outbox.start()
+
+        sampler = SystemSampler()
+        # Tampon en az iki pencereyi tutmalı; gönderim gecikirse örnek kaybolmasın
+        capacity = max(DEVICE_MONITOR_BUFFER_SIZE, int(sample_hz * window * 2))
+        buffer = MetricRingBuffer(sampler.columns, capacity)
+        sample_task = asyncio.create_task(self._sample_loop(sampler, buffer, 1.0 / sample_hz))
+
+        window_start = time.time()
+        try:
+            while True:
+                await asyncio.sleep(max(0.0, window_start + window - time.time()))
+                window_end = time.time()
+                aggregate = buffer.aggregate(window_start, window_end)
+                window_start = window_end
+                if aggregate is None:
+                    continue
+
+                success = await self.send_aggregate(aggregate)
+                status = "✅ Başarılı" if success else "❌ Hata"
+                print(f"{datetime.now().strftime('%H:%M:%S')} - {status} - {aggregate['samples']} örnek - "
+                      f"CPU ort/p95: {aggregate['mean'][0]:.1f}/{aggregate['p95'][0]:.1f}% RAM: {aggregate['mean'][1]:.1f}%")
+        finally:
+            sample_task.cancel()
+            if self.outbox is not None:
+                await self.outbox.stop()
+                await self.outbox.client.aclose()
+            await self.close()
 
 if __name__ == "__main__":
     monitor = DeviceMonitor()
-    asyncio.run(monitor.monitor_loop())
+    if DEVICE_MONITOR_MODE == "aggregate":
+        asyncio.run(monitor.aggregate_loop())
+    else:
+        asyncio.run(monitor.monitor_loop())
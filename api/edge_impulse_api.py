@@ -1,12 +1,38 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from typing import List
+from typing import List, Dict, Optional
+from collections import OrderedDict
+from datetime import datetime
 import asyncio
+import json
 import logging
-from edge_impulse_client import EdgeImpulseClient
+import os
+import uuid
+from edge_impulse_client import edge_impulse_client, aggregate_values
+from edge_impulse_outbox import edge_impulse_outbox, EDGE_IMPULSE_OUTBOX_ENABLED, OutboxBusy
+from metrics_store import metrics_store
+from realtime_hub import realtime_hub
+import redis_client
+
+# Toplu gönderimde eşzamanlı istek sayısı ve istek başına en fazla örnek
+EDGE_IMPULSE_BULK_CONCURRENCY = int(os.getenv("EDGE_IMPULSE_BULK_CONCURRENCY", "10"))
+EDGE_IMPULSE_BULK_CHUNK = int(os.getenv("EDGE_IMPULSE_BULK_CHUNK", "100"))
+# Durumu sorgulanabilir tutulan son arka plan işi sayısı
+EDGE_IMPULSE_BULK_JOBS_KEEP = int(os.getenv("EDGE_IMPULSE_BULK_JOBS_KEEP", "100"))
+# İş durumunun Redis'te tutulma süresi ve çalışırken yazılma aralığı (saniye)
+EDGE_IMPULSE_BULK_JOB_TTL = int(os.getenv("EDGE_IMPULSE_BULK_JOB_TTL", "86400"))
+EDGE_IMPULSE_BULK_JOB_SAVE_INTERVAL = float(os.getenv("EDGE_IMPULSE_BULK_JOB_SAVE_INTERVAL", "1"))
+
+BULK_JOB_PREFIX = "dakitai:bulk-job:"
 
 router = APIRouter(prefix="/api/edge-impulse", tags=["Edge Impulse"])
 
+# Arka plan toplu gönderim işleri (job_id -> durum). Redis varsa durum oraya da
+# yazılır ve sorgu başka işçiye düşse de bulunur; yoksa yalnızca işi başlatan
+# işçi yanıt verebilir (tek işçili kurulum)
+bulk_jobs: "OrderedDict[str, Dict]" = OrderedDict()
+_bulk_tasks: Dict[str, asyncio.Task] = {}
+
 class SensorData(BaseModel):
     device_name: str
     sensor_type: str
@@ -18,12 +44,34 @@ class DeviceMetrics(BaseModel):
     ram_usage: float
     disk_usage: float
 
+class AggregatedMetrics(BaseModel):
+    device_name: str
+    window_start: float
+    window_end: float
+    samples: int
+    columns: List[str]
+    min: List[float]
+    max: List[float]
+    mean: List[float]
+    p95: List[float]
+
+async def _enqueue(device_name: str, samples: List[List[float]], sensor_name: str):
+    """Kalıcı kuyruğa yaz; dosya kilidi kısa sürede alınamazsa bekletmeden 503 döndür"""
+    try:
+        await edge_impulse_outbox.enqueue_async(device_name, samples, sensor_name)
+    except OutboxBusy:
+        raise HTTPException(status_code=503, detail="Outbox busy, try again later", headers={"Retry-After": "1"})
+
 @router.post("/sensor-data")
 async def send_sensor_data(data: SensorData):
     """Sensor verilerini Edge Impulse'a gönder"""
+    if EDGE_IMPULSE_OUTBOX_ENABLED:
+        # Kalıcı kuyruğa yaz, gönderimi arka plan boşaltıcısı yapar
+        await _enqueue(data.device_name, [data.values], data.sensor_type)
+        return {"status": "queued", "message": "Veri gönderim kuyruğuna alındı"}
+
     try:
-        client = EdgeImpulseClient()
-        response = client.send_sensor_data(
+        response = await edge_impulse_client.send_sensor_data(
             data.device_name, 
             data.values, 
             data.sensor_type
@@ -34,6 +82,8 @@ async def send_sensor_data(data: SensorData):
         else:
             raise HTTPException(status_code=400, detail=f"Edge Impulse hatası: {response.text}")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Edge Impulse gönderim hatası: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -41,9 +91,23 @@ async def send_sensor_data(data: SensorData):
 @router.post("/device-metrics")
 async def send_device_metrics(metrics: DeviceMetrics):
     """Cihaz metriklerini Edge Impulse'a gönder"""
+    values = {
+        "cpu": metrics.cpu_usage,
+        "ram": metrics.ram_usage,
+        "disk": metrics.disk_usage
+    }
+    metrics_store.record(metrics.device_name, values)
+    realtime_hub.publish("metrics", metrics.device_name, values)
+    if EDGE_IMPULSE_OUTBOX_ENABLED:
+        await _enqueue(
+            metrics.device_name,
+            [[metrics.cpu_usage, metrics.ram_usage, metrics.disk_usage]],
+            "system_metrics"
+        )
+        return {"status": "queued", "message": "Metrikler gönderim kuyruğuna alındı"}
+
     try:
-        client = EdgeImpulseClient()
-        response = client.send_device_metrics(
+        response = await edge_impulse_client.send_device_metrics(
             metrics.device_name,
             metrics.cpu_usage,
             metrics.ram_usage,
@@ -55,34 +119,172 @@ async def send_device_metrics(metrics: DeviceMetrics):
         else:
             raise HTTPException(status_code=400, detail=f"Edge Impulse hatası: {response.text}")
             
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Edge Impulse metrik gönderim hatası: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/bulk-data")
-async def send_bulk_data(devices_data: List[DeviceMetrics]):
-    """Toplu cihaz verisi gönder"""
-    results = []
-    client = EdgeImpulseClient()
-    
+@router.post("/device-metrics/aggregate")
+async def send_aggregated_metrics(aggregate: AggregatedMetrics):
+    """DeviceMonitor pencere özetini (kolon başına min/max/mean/p95) gönder"""
+    stats = (aggregate.min, aggregate.max, aggregate.mean, aggregate.p95)
+    if any(len(values) != len(aggregate.columns) for values in stats):
+        raise HTTPException(status_code=400, detail="Statistic lengths must match columns")
+
+    # Geçmiş için pencere ortalamaları pencere sonu zamanıyla saklanır
+    means = dict(zip(aggregate.columns, aggregate.mean))
+    metrics_store.record(aggregate.device_name, means, datetime.utcfromtimestamp(aggregate.window_end))
+    realtime_hub.publish("metrics", aggregate.device_name, means)
+
+    values = aggregate_values(aggregate.model_dump())
+    if EDGE_IMPULSE_OUTBOX_ENABLED:
+        await _enqueue(aggregate.device_name, [values], "system_metrics_aggregate")
+        return {"status": "queued", "message": "Özet gönderim kuyruğuna alındı"}
+
+    try:
+        response = await edge_impulse_client.send_sensor_data(aggregate.device_name, values, "system_metrics_aggregate")
+    except Exception as e:
+        logging.error(f"Edge Impulse özet gönderim hatası: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if response.status_code != 200:
+        raise HTTPException(status_code=400, detail=f"Edge Impulse hatası: {response.text}")
+    return {"status": "success", "message": "Özet başarıyla gönderildi"}
+
+def _chunk_samples(devices_data: List[DeviceMetrics]) -> List[tuple]:
+    """Aynı cihazın örneklerini birleştirip en fazla EDGE_IMPULSE_BULK_CHUNK örneklik parçalara böl"""
+    samples = OrderedDict()
     for device in devices_data:
-        try:
-            response = client.send_device_metrics(
-                device.device_name,
-                device.cpu_usage,
-                device.ram_usage,
-                device.disk_usage
-            )
-            results.append({
-                "device": device.device_name,
-                "status": "success" if response.status_code == 200 else "failed",
-                "response_code": response.status_code
-            })
-        except Exception as e:
-            results.append({
-                "device": device.device_name,
-                "status": "error",
-                "error": str(e)
-            })
-    
-    return {"results": results}
+        samples.setdefault(device.device_name, []).append(
+            [device.cpu_usage, device.ram_usage, device.disk_usage]
+        )
+
+    chunks = []
+    for device_name, rows in samples.items():
+        for i in range(0, len(rows), EDGE_IMPULSE_BULK_CHUNK):
+            chunks.append((device_name, rows[i:i + EDGE_IMPULSE_BULK_CHUNK]))
+    return chunks
+
+async def _run_bulk(devices_data: List[DeviceMetrics], job: Optional[Dict] = None) -> List[Dict]:
+    """Parçaları sınırlı eşzamanlılıkla gönder, cihaz başına sonuç döndür"""
+    chunks = _chunk_samples(devices_data)
+    semaphore = asyncio.Semaphore(EDGE_IMPULSE_BULK_CONCURRENCY)
+    results = OrderedDict()
+    for device_name, rows in chunks:
+        result = results.setdefault(device_name, {"device": device_name, "samples": 0, "sent": 0, "status": "success"})
+        result["samples"] += len(rows)
+
+    async def send_chunk(device_name: str, rows: List[List[float]]):
+        result = results[device_name]
+        async with semaphore:
+            try:
+                response = await edge_impulse_client.send_samples(device_name, rows, "system_metrics")
+                result["response_code"] = response.status_code
+                if response.status_code == 200:
+                    result["sent"] += len(rows)
+                else:
+                    result["status"] = "failed"
+            except Exception as e:
+                result["status"] = "error"
+                result["error"] = str(e)
+                response = None
+            if EDGE_IMPULSE_OUTBOX_ENABLED and (response is None or response.status_code != 200):
+                # Gönderilemeyen örnekler kaybolmaz, kuyruktan yeniden denenir
+                try:
+                    await edge_impulse_outbox.enqueue_async(device_name, rows, "system_metrics")
+                    result["queued"] = result.get("queued", 0) + len(rows)
+                except OutboxBusy:
+                    result["queue_error"] = "Outbox busy"
+        if job is not None:
+            job["processed_samples"] += len(rows)
+
+    await asyncio.gather(*(send_chunk(device_name, rows) for device_name, rows in chunks))
+    return list(results.values())
+
+async def _save_job(job: Dict):
+    """İş durumunu diğer işçilerin okuyabilmesi için Redis'e yaz"""
+    client = redis_client.get_async_redis()
+    if client is None:
+        return
+    try:
+        await client.set(BULK_JOB_PREFIX + job["job_id"], json.dumps(job), ex=EDGE_IMPULSE_BULK_JOB_TTL)
+    except Exception as e:
+        print(f"Redis iş durumu yazma hatası: {e}")
+        redis_client.mark_failed()
+
+async def _load_job(job_id: str) -> Optional[Dict]:
+    client = redis_client.get_async_redis()
+    if client is None:
+        return None
+    try:
+        value = await client.get(BULK_JOB_PREFIX + job_id)
+    except Exception as e:
+        print(f"Redis iş durumu okuma hatası: {e}")
+        redis_client.mark_failed()
+        return None
+    return json.loads(value) if value is not None else None
+
+async def _report_progress(job: Dict):
+    while True:
+        await asyncio.sleep(EDGE_IMPULSE_BULK_JOB_SAVE_INTERVAL)
+        await _save_job(job)
+
+async def _run_bulk_job(job: Dict, devices_data: List[DeviceMetrics]):
+    progress = asyncio.create_task(_report_progress(job))
+    try:
+        job["results"] = await _run_bulk(devices_data, job)
+        job["status"] = "completed"
+    except Exception as e:
+        logging.error(f"Edge Impulse toplu gönderim hatası: {e}")
+        job["status"] = "error"
+        job["error"] = str(e)
+    finally:
+        progress.cancel()
+        job["finished_at"] = datetime.now().isoformat()
+        await _save_job(job)
+        _bulk_tasks.pop(job["job_id"], None)
+
+@router.post("/bulk-data")
+async def send_bulk_data(devices_data: List[DeviceMetrics], background: bool = False):
+    """Toplu cihaz verisi gönder (background=true ile iş numarası döner)"""
+    if not background:
+        return {"results": await _run_bulk(devices_data)}
+
+    job_id = uuid.uuid4().hex
+    job = {
+        "job_id": job_id,
+        "status": "running",
+        "total_samples": len(devices_data),
+        "processed_samples": 0,
+        "created_at": datetime.now().isoformat(),
+        "finished_at": None,
+        "results": None
+    }
+    bulk_jobs[job_id] = job
+    while len(bulk_jobs) > EDGE_IMPULSE_BULK_JOBS_KEEP:
+        bulk_jobs.popitem(last=False)
+    await _save_job(job)
+    # Görev referansı tutulmazsa çöp toplayıcı tarafından iptal edilebilir
+    _bulk_tasks[job_id] = asyncio.create_task(_run_bulk_job(job, devices_data))
+    return {"job_id": job_id, "status": "running"}
+
+@router.get("/bulk-data/{job_id}")
+async def get_bulk_job(job_id: str):
+    """Arka plan toplu gönderim işinin durumu"""
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        # İş başka bir işçide başlatılmış olabilir
+        job = await _load_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/client/stats")
+async def get_client_stats():
+    """Ingestion istemcisinin bağlantı havuzu ayarları"""
+    return edge_impulse_client.get_stats()
+
+@router.get("/outbox/stats")
+async def get_outbox_stats():
+    """Kalıcı gönderim kuyruğunun derinlik/yaş metrikleri"""
+    return await asyncio.to_thread(edge_impulse_outbox.get_stats)
@@ -1,20 +1,86 @@
-import requests
+import httpx
 import hmac
 import hashlib
 import json
 import time
 import os
-from typing import List, Dict
+import asyncio
+from typing import List, Dict, Optional
+
+# Ingestion adresi (yerel test sunucusuna yönlendirmek için değiştirilebilir)
+EDGE_IMPULSE_INGESTION_URL = os.getenv("EDGE_IMPULSE_INGESTION_URL", "https://ingestion.edgeimpulse.com/api")
+# Zaman aşımları (saniye)
+EDGE_IMPULSE_TIMEOUT = float(os.getenv("EDGE_IMPULSE_TIMEOUT", "10"))
+EDGE_IMPULSE_CONNECT_TIMEOUT = float(os.getenv("EDGE_IMPULSE_CONNECT_TIMEOUT", "5"))
+# Bağlantı havuzu sınırları
+EDGE_IMPULSE_MAX_CONNECTIONS = int(os.getenv("EDGE_IMPULSE_MAX_CONNECTIONS", "20"))
+EDGE_IMPULSE_MAX_KEEPALIVE = int(os.getenv("EDGE_IMPULSE_MAX_KEEPALIVE", "10"))
+EDGE_IMPULSE_KEEPALIVE_EXPIRY = float(os.getenv("EDGE_IMPULSE_KEEPALIVE_EXPIRY", "30"))
+EDGE_IMPULSE_HTTP2 = os.getenv("EDGE_IMPULSE_HTTP2", "true").lower() == "true"
+
+# Pencere özetlerinde kolon başına gönderilen istatistikler (sırası satır sırasıdır)
+AGGREGATE_STATS = ("min", "max", "mean", "p95")
+
+
+def aggregate_values(aggregate: Dict) -> List[float]:
+    """Özeti tek örnek satırına çevir: kolon başına min, max, mean, p95"""
+    return [aggregate[name][i] for i in range(len(aggregate["columns"])) for name in AGGREGATE_STATS]
+
+
+def http2_available() -> bool:
+    """HTTP/2 için h2 paketi kurulu mu"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def create_async_client(base_url: str = "", headers: Optional[Dict] = None) -> httpx.AsyncClient:
+    """Keep-alive ve bağlantı havuzu ayarlı paylaşılan async HTTP istemcisi"""
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        http2=EDGE_IMPULSE_HTTP2 and http2_available(),
+        timeout=httpx.Timeout(EDGE_IMPULSE_TIMEOUT, connect=EDGE_IMPULSE_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=EDGE_IMPULSE_MAX_CONNECTIONS,
+            max_keepalive_connections=EDGE_IMPULSE_MAX_KEEPALIVE,
+            keepalive_expiry=EDGE_IMPULSE_KEEPALIVE_EXPIRY
+        )
+    )
+
 
 class EdgeImpulseClient:
-    def __init__(self):
+    """Uygulama ömrü boyunca tek bağlantı havuzunu kullanan ingestion istemcisi"""
+
+    def __init__(self, base_url: str = EDGE_IMPULSE_INGESTION_URL):
         self.api_key = os.getenv("EDGE_IMPULSE_API_KEY", "ei_2c3de7eb7709a48a29157acdcd5f63fd76c548abbf52e0e7130bc444f67631dd")
         self.hmac_key = os.getenv("EDGE_IMPULSE_HMAC_KEY", "ef700bb07877e8e29b52e2c1db85396a")
-        self.base_url = "https://ingestion.edgeimpulse.com/api"
-    
-    def send_sensor_data(self, device_name: str, sensor_data: List[float], sensor_name: str = "accelerometer"):
-        """Cihaz sensor verilerini Edge Impulse'a gönder"""
-        
+        self.base_url = base_url.rstrip('/')
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = create_async_client(self.base_url, {"x-api-key": self.api_key})
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        # Başlatılmamışsa (ör. betik kullanımı) ilk istekte havuzu aç
+        if self._client is None:
+            await self.start()
+        return self._client
+
+    def build_payload(self, device_name: str, sensor_data: List[float], sensor_name: str = "accelerometer") -> Dict:
+        """İmzalı ingestion gövdesini oluştur"""
+        return self.build_batch_payload(device_name, [sensor_data], sensor_name)
+
+    def build_batch_payload(self, device_name: str, samples: List[List[float]], sensor_name: str = "accelerometer") -> Dict:
+        """Birden fazla örneği tek imzalı gövdede birleştir (her örnek bir satır)"""
         payload = {
             "protected": {
                 "ver": "v1",
@@ -26,10 +92,10 @@ class EdgeImpulseClient:
                 "device_type": "DAKITAI_DEVICE",
                 "interval_ms": 10,
                 "sensors": [{"name": sensor_name, "units": "m/s2"}],
-                "values": [sensor_data]
+                "values": samples
             }
         }
-        
+
         # HMAC imzalama
         message = json.dumps(payload["payload"], separators=(',', ':'))
         signature = hmac.new(
@@ -37,32 +103,56 @@ class EdgeImpulseClient:
             message.encode('utf-8'),
             hashlib.sha256
         ).hexdigest()
-        
+
         payload["signature"] = signature
-        
-        headers = {
-            "x-api-key": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(
-            f"{self.base_url}/training/data",
-            json=payload,
-            headers=headers
+        return payload
+
+    async def send_sensor_data(self, device_name: str, sensor_data: List[float], sensor_name: str = "accelerometer") -> httpx.Response:
+        """Cihaz sensor verilerini Edge Impulse'a gönder"""
+        client = await self._get_client()
+        return await client.post(
+            "/training/data",
+            json=self.build_payload(device_name, sensor_data, sensor_name)
         )
-        
-        return response
-    
-    def send_device_metrics(self, device_name: str, cpu: float, ram: float, disk: float):
+
+    async def send_samples(self, device_name: str, samples: List[List[float]], sensor_name: str = "accelerometer") -> httpx.Response:
+        """Aynı cihazın birden fazla örneğini tek istekte gönder"""
+        client = await self._get_client()
+        return await client.post(
+            "/training/data",
+            json=self.build_batch_payload(device_name, samples, sensor_name)
+        )
+
+    async def send_device_metrics(self, device_name: str, cpu: float, ram: float, disk: float) -> httpx.Response:
         """Sistem metriklerini gönder"""
         metrics = [cpu, ram, disk]
-        return self.send_sensor_data(device_name, metrics, "system_metrics")
+        return await self.send_sensor_data(device_name, metrics, "system_metrics")
+
+    def get_stats(self) -> Dict:
+        return {
+            "base_url": self.base_url,
+            "started": self._client is not None,
+            "http2": EDGE_IMPULSE_HTTP2 and http2_available(),
+            "max_connections": EDGE_IMPULSE_MAX_CONNECTIONS,
+            "max_keepalive_connections": EDGE_IMPULSE_MAX_KEEPALIVE
+        }
+
+
+# Global istemci instance (main.py startup/shutdown ile açılıp kapanır)
+edge_impulse_client = EdgeImpulseClient()
+
+
+async def _test():
+    client = EdgeImpulseClient()
+    try:
+        # Test verisi gönder
+        response = await client.send_device_metrics("test_device", 45.2, 67.8, 23.1)
+        print(f"Response: {response.status_code} ({response.http_version})")
+        print(f"Content: {response.text}")
+    finally:
+        await client.aclose()
+
 
 # Test fonksiyonu
 if __name__ == "__main__":
-    client = EdgeImpulseClient()
-    
-    # Test verisi gönder
-    response = client.send_device_metrics("test_device", 45.2, 67.8, 23.1)
-    print(f"Response: {response.status_code}")
-    print(f"Content: {response.text}")
+    asyncio.run(_test())
@@ -0,0 +1,355 @@
+import asyncio
+import fcntl
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from edge_impulse_client import EdgeImpulseClient, edge_impulse_client
+
+# true: alım uç noktaları gönderimi beklemeden kuyruğa yazıp hemen döner (isteğe bağlı)
+EDGE_IMPULSE_OUTBOX_ENABLED = os.getenv("EDGE_IMPULSE_OUTBOX_ENABLED", "false").lower() == "true"
+EDGE_IMPULSE_OUTBOX_PATH = os.getenv("EDGE_IMPULSE_OUTBOX_PATH", "/app/data/outbox/edge_impulse.db")
+# Yazma kilidini başka süreç tutuyorsa beklenecek en uzun süre (saniye); aşılırsa OutboxBusy
+EDGE_IMPULSE_OUTBOX_BUSY_TIMEOUT = float(os.getenv("EDGE_IMPULSE_OUTBOX_BUSY_TIMEOUT", "2"))
+# Kuyruğun diskte kaplayabileceği en fazla veri (bayt); aşılırsa en eskiler silinir
+EDGE_IMPULSE_OUTBOX_MAX_BYTES = int(os.getenv("EDGE_IMPULSE_OUTBOX_MAX_BYTES", str(50 * 1024 * 1024)))
+# Bir turda okunacak kayıt ve istek başına en fazla örnek
+EDGE_IMPULSE_OUTBOX_BATCH = int(os.getenv("EDGE_IMPULSE_OUTBOX_BATCH", "500"))
+EDGE_IMPULSE_OUTBOX_CHUNK = int(os.getenv("EDGE_IMPULSE_OUTBOX_CHUNK", "100"))
+EDGE_IMPULSE_OUTBOX_CONCURRENCY = int(os.getenv("EDGE_IMPULSE_OUTBOX_CONCURRENCY", "5"))
+# Boş kuyrukta bekleme ve üstel geri çekilme sınırları (saniye)
+EDGE_IMPULSE_OUTBOX_POLL = float(os.getenv("EDGE_IMPULSE_OUTBOX_POLL", "1"))
+EDGE_IMPULSE_OUTBOX_BACKOFF_BASE = float(os.getenv("EDGE_IMPULSE_OUTBOX_BACKOFF_BASE", "1"))
+EDGE_IMPULSE_OUTBOX_BACKOFF_MAX = float(os.getenv("EDGE_IMPULSE_OUTBOX_BACKOFF_MAX", "300"))
+
+
+class OutboxBusy(Exception):
+    """Kuyruk dosyası kilitli - istek reddedilmeli (HTTP 503)"""
+
+
+class EdgeImpulseOutbox:
+    """Edge Impulse gönderimleri için SQLite tabanlı kalıcı giden kutusu.
+
+    `enqueue` yalnızca yerel bir INSERT yapar (WAL, fsync'siz commit); ağ
+    işini arka plandaki boşaltıcı üstlenir. Aynı dosyayı birden fazla süreç
+    (API işçileri, DeviceMonitor) kullanabilir; dosya kilidini alan tek süreç
+    boşaltır. Bir cihazın gönderimi başarısız olursa yalnızca o cihaz geri
+    çekilir, sonraki kayıtları sırası bozulmadan bekler. Kalıcı 4xx yanıtı
+    alan kayıtlar yeniden denenmez, outbox_dead tablosuna taşınır.
+    """
+
+    def __init__(self, path: str = EDGE_IMPULSE_OUTBOX_PATH, client: EdgeImpulseClient = edge_impulse_client,
+                 max_bytes: int = EDGE_IMPULSE_OUTBOX_MAX_BYTES):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self.client = client
+        self.max_bytes = max_bytes
+        self._conn: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._bytes: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._drain_lock_file = None
+        # cihaz -> (deneme sayısı, bir sonraki deneme zamanı)
+        self._backoff: Dict[str, tuple] = {}
+        self.enqueued = 0
+        self.sent = 0
+        self.failed_attempts = 0
+        self.evicted = 0
+        self.dead_lettered = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                   timeout=EDGE_IMPULSE_OUTBOX_BUSY_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: commit fsync beklemez, çökme sonrası veritabanı yine tutarlı kalır
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device_name TEXT NOT NULL,
+                    sensor_name TEXT NOT NULL,
+                    sample_values TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_device ON outbox (device_name, id)")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS outbox_dead (
+                    id INTEGER PRIMARY KEY,
+                    device_name TEXT NOT NULL,
+                    sensor_name TEXT NOT NULL,
+                    sample_values TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    status_code INTEGER,
+                    error TEXT,
+                    failed_at REAL NOT NULL
+                )
+            """)
+            self._conn = conn
+        return self._conn
+
+    def _total_bytes(self, conn: sqlite3.Connection) -> int:
+        return conn.execute("SELECT COALESCE(SUM(size), 0) FROM outbox").fetchone()[0]
+
+    def enqueue(self, device_name: str, values: List[float], sensor_name: str = "accelerometer") -> int:
+        """Örneği kalıcı kuyruğa ekle, eklenen kayıt sayısını döndür (olay döngüsünde enqueue_async kullanılır)"""
+        return self.enqueue_many(device_name, [values], sensor_name)
+
+    def enqueue_many(self, device_name: str, samples: List[List[float]], sensor_name: str = "accelerometer") -> int:
+        """Örnekleri tek işlemde kalıcı kuyruğa ekle"""
+        now = time.time()
+        records = []
+        added = 0
+        for values in samples:
+            encoded = json.dumps(values, separators=(',', ':'))
+            size = len(device_name) + len(sensor_name) + len(encoded)
+            records.append((device_name, sensor_name, encoded, size, now))
+            added += size
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT INTO outbox (device_name, sensor_name, sample_values, size, created_at) VALUES (?, ?, ?, ?, ?)",
+                    records
+                )
+                if self._bytes is None:
+                    self._bytes = self._total_bytes(conn)
+                else:
+                    self._bytes += added
+                if self._bytes > self.max_bytes:
+                    self._evict(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                self._bytes = None
+                raise
+        self.enqueued += len(records)
+        return len(records)
+
+    async def enqueue_async(self, device_name: str, samples: List[List[float]], sensor_name: str = "accelerometer") -> int:
+        """enqueue_many'yi olay döngüsünü bloklamadan çalıştır; dosya kilitliyse OutboxBusy"""
+        try:
+            return await asyncio.to_thread(self.enqueue_many, device_name, samples, sensor_name)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise OutboxBusy() from e
+            raise
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Disk bütçesi aşıldıysa en eski kayıtları sil"""
+        # Diğer süreçlerin ekleme/silmelerini de hesaba kat
+        self._bytes = self._total_bytes(conn)
+        while self._bytes > self.max_bytes:
+            excess = self._bytes - int(self.max_bytes * 0.9)
+            rows = conn.execute("SELECT id, size FROM outbox ORDER BY id LIMIT 1000").fetchall()
+            if not rows:
+                break
+            cutoff, freed, count = rows[-1][0], 0, 0
+            for row_id, size in rows:
+                freed += size
+                count += 1
+                if freed >= excess:
+                    cutoff = row_id
+                    break
+            conn.execute("DELETE FROM outbox WHERE id <= ?", (cutoff,))
+            self.evicted += count
+            self._bytes -= freed
+
+    def _fetch_batch(self, skip_devices: List[str]) -> List[tuple]:
+        with self._db_lock:
+            conn = self._connect()
+            placeholders = ",".join("?" * len(skip_devices))
+            where = f"WHERE device_name NOT IN ({placeholders})" if skip_devices else ""
+            return conn.execute(
+                f"SELECT id, device_name, sensor_name, sample_values, size FROM outbox {where} ORDER BY id LIMIT ?",
+                (*skip_devices, EDGE_IMPULSE_OUTBOX_BATCH)
+            ).fetchall()
+
+    def _delete(self, ids: List[int], size: int):
+        with self._db_lock:
+            conn = self._connect()
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids])
+            if self._bytes is not None:
+                self._bytes = max(0, self._bytes - size)
+
+    def _dead_letter(self, rows: List[tuple], status_code: int, error: str):
+        """Kalıcı hatayla reddedilen kayıtları yeniden denenmeyecekleri tabloya taşı"""
+        ids = [(row[0],) for row in rows]
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO outbox_dead (id, device_name, sensor_name, sample_values, size, created_at, "
+                    "status_code, error, failed_at) SELECT id, device_name, sensor_name, sample_values, size, created_at, "
+                    "?, ?, ? FROM outbox WHERE id = ?",
+                    [(status_code, error, time.time(), row_id) for (row_id,) in ids]
+                )
+                conn.executemany("DELETE FROM outbox WHERE id = ?", ids)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            if self._bytes is not None:
+                self._bytes = max(0, self._bytes - sum(row[4] for row in rows))
+
+    @staticmethod
+    def _is_permanent(status_code: int) -> bool:
+        """Yeniden denemeyle düzelmeyecek istemci hataları (zaman aşımı ve hız sınırı hariç)"""
+        return 400 <= status_code < 500 and status_code not in (408, 429)
+
+    @staticmethod
+    def _group(rows: List[tuple]) -> "OrderedDict[str, List[tuple]]":
+        """Kayıtları cihaz bazında, ekleme sırasını koruyarak grupla"""
+        groups = OrderedDict()
+        for row in rows:
+            groups.setdefault(row[1], []).append(row)
+        return groups
+
+    async def _send_device(self, device_name: str, rows: List[tuple], semaphore: asyncio.Semaphore):
+        """Cihazın kayıtlarını sırayla, aynı sensörlü ardışık parçalar halinde gönder"""
+        async with semaphore:
+            start = 0
+            while start < len(rows):
+                sensor_name = rows[start][2]
+                end = start
+                while end < len(rows) and end - start < EDGE_IMPULSE_OUTBOX_CHUNK and rows[end][2] == sensor_name:
+                    end += 1
+                chunk = rows[start:end]
+
+                response = None
+                try:
+                    response = await self.client.send_samples(
+                        device_name, [json.loads(row[3]) for row in chunk], sensor_name
+                    )
+                    ok = response.status_code == 200
+                except Exception as e:
+                    print(f"Edge Impulse kuyruk gönderim hatası ({device_name}): {e}")
+                    ok = False
+
+                if not ok and response is not None and self._is_permanent(response.status_code):
+                    # Aynı veri her denemede reddedilir; cihazın kuyruğunu tıkamaması için ayrılır
+                    print(f"Edge Impulse kayıtları reddetti ({device_name}, {response.status_code}), "
+                          f"{len(chunk)} kayıt outbox_dead tablosuna taşındı")
+                    await asyncio.to_thread(self._dead_letter, chunk, response.status_code, response.text[:500])
+                    self.dead_lettered += len(chunk)
+                    self._backoff.pop(device_name, None)
+                    start = end
+                    continue
+
+                if not ok:
+                    # Sonraki kayıtlar sıranın bozulmaması için bekletilir
+                    self.failed_attempts += 1
+                    attempts = self._backoff.get(device_name, (0, 0))[0] + 1
+                    delay = min(EDGE_IMPULSE_OUTBOX_BACKOFF_MAX, EDGE_IMPULSE_OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+                    self._backoff[device_name] = (attempts, time.monotonic() + delay * random.uniform(0.5, 1.0))
+                    return
+
+                await asyncio.to_thread(self._delete, [row[0] for row in chunk], sum(row[4] for row in chunk))
+                self.sent += len(chunk)
+                self._backoff.pop(device_name, None)
+                start = end
+
+    async def drain_once(self) -> int:
+        """Kuyruktan bir tur gönder, gönderilmeye çalışılan kayıt sayısını döndür"""
+        now = time.monotonic()
+        waiting = [device for device, (_, retry_at) in self._backoff.items() if retry_at > now]
+        rows = await asyncio.to_thread(self._fetch_batch, waiting)
+        if not rows:
+            return 0
+
+        semaphore = asyncio.Semaphore(EDGE_IMPULSE_OUTBOX_CONCURRENCY)
+        groups = self._group(rows)
+        await asyncio.gather(*(self._send_device(device, device_rows, semaphore) for device, device_rows in groups.items()))
+        return len(rows)
+
+    def _try_acquire_drainer(self) -> bool:
+        """Aynı kuyruk dosyasını yalnızca bir süreç boşaltsın"""
+        if self._drain_lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._drain_lock_file = lock_file
+        return True
+
+    def _release_drainer(self):
+        if self._drain_lock_file is not None:
+            fcntl.flock(self._drain_lock_file, fcntl.LOCK_UN)
+            self._drain_lock_file.close()
+            self._drain_lock_file = None
+
+    async def _drain_loop(self):
+        while True:
+            try:
+                if not self._try_acquire_drainer():
+                    await asyncio.sleep(EDGE_IMPULSE_OUTBOX_POLL * 5)
+                    continue
+                if await self.drain_once() == 0:
+                    await asyncio.sleep(EDGE_IMPULSE_OUTBOX_POLL)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Edge Impulse kuyruk boşaltma hatası: {e}")
+                await asyncio.sleep(EDGE_IMPULSE_OUTBOX_POLL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._drain_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._release_drainer()
+        with self._db_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_stats(self) -> Dict:
+        with self._db_lock:
+            conn = self._connect()
+            depth, oldest, total_bytes = conn.execute(
+                "SELECT COUNT(*), MIN(created_at), COALESCE(SUM(size), 0) FROM outbox"
+            ).fetchone()
+            devices = conn.execute("SELECT COUNT(DISTINCT device_name) FROM outbox").fetchone()[0]
+            dead = conn.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+        now = time.monotonic()
+        return {
+            "depth": depth,
+            "devices": devices,
+            "oldest_age_seconds": time.time() - oldest if oldest else 0.0,
+            "bytes": total_bytes,
+            "max_bytes": self.max_bytes,
+            "draining": self._drain_lock_file is not None,
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "failed_attempts": self.failed_attempts,
+            "evicted": self.evicted,
+            "dead_letters": dead,
+            "dead_lettered": self.dead_lettered,
+            "backoff_devices": sum(1 for _, retry_at in self._backoff.values() if retry_at > now)
+        }
+
+
+# Global kuyruk instance
+edge_impulse_outbox = EdgeImpulseOutbox()
@@ -0,0 +1,92 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+FACE_CACHE_SIZE = int(os.getenv("FACE_CACHE_SIZE", "512"))
+FACE_CACHE_TTL = float(os.getenv("FACE_CACHE_TTL", "60"))
+
+# FaceRecognitionService'in model sürüm işaretçisi ve galeri indeksi; herhangi
+# bir süreçte eğitim/ekleme/silme bu dosyalardan birini değiştirir
+MODEL_FILES = ("/app/data/models/CURRENT", "/app/data/gallery/gallery_index.json")
+
+
+class DetectionCache:
+    """Görüntü içeriği + model sürümüne göre anahtarlanan LRU sonuç önbelleği"""
+
+    def __init__(self, max_size: int = FACE_CACHE_SIZE, ttl: float = FACE_CACHE_TTL,
+                 model_files: tuple = MODEL_FILES):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.model_files = model_files
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def model_version(self) -> tuple:
+        """Model dosyalarının değişim zamanları; yeni model yeni sürüm demektir"""
+        version = []
+        for path in self.model_files:
+            try:
+                stat = os.stat(path)
+                version.append((stat.st_ino, stat.st_mtime_ns))
+            except OSError:
+                version.append(None)
+        version = tuple(version)
+
+        with self._lock:
+            if version != self._version:
+                # Yeni model: eski sonuçların hepsi geçersiz
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self._version = version
+        return version
+
+    @staticmethod
+    def make_key(image_bytes, version: tuple, *params) -> tuple:
+        """Görüntü özeti + model sürümü + tespit parametreleri (profil, ROI)"""
+        return hashlib.blake2b(image_bytes, digest_size=16).digest(), version, params
+
+    def get(self, key: tuple) -> Optional[List[Dict]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, faces: List[Dict]):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, faces)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+
+# Global önbellek instance
+detection_cache = DetectionCache()
@@ -0,0 +1,123 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Çalışma modu: "process" her CPU çekirdeği için ayrı işçi süreci,
+# "thread" ise ana süreçteki servis üzerinde iş parçacığı havuzu kullanır
+FACE_EXECUTION_MODE = os.getenv("FACE_EXECUTION_MODE", "process")
+FACE_WORKERS = int(os.getenv("FACE_WORKERS", str(os.cpu_count() or 1)))
+FACE_MAX_PENDING = int(os.getenv("FACE_MAX_PENDING", str(FACE_WORKERS * 4)))
+
+
+class FaceServiceBusy(Exception):
+    """Kuyruk dolu - istek reddedilmeli (HTTP 429)"""
+
+
+class FaceServiceUnavailable(Exception):
+    """İşçi havuzu yeniden kurulduktan sonra da çöktü (HTTP 503)"""
+
+
+def _init_worker():
+    """İşçi süreci başlangıcı - her işçi kendi kaskad ve tanıyıcısını yükler"""
+    import cv2
+    # İşçi başına tek OpenCV iş parçacığı; paralellik süreç sayısından gelir
+    cv2.setNumThreads(1)
+    import face_recognition  # noqa: F401
+
+
+def _call(method: str, *args):
+    from face_recognition import face_service
+    # Başka bir iş parçacığı yeni modeli yüklüyorsa beklemeden geçerli modelle devam et
+    face_service.reload_if_changed(wait=False)
+    return getattr(face_service, method)(*args)
+
+
+class FaceExecutor:
+    def __init__(self, mode: str = FACE_EXECUTION_MODE, workers: int = FACE_WORKERS,
+                 max_pending: int = FACE_MAX_PENDING):
+        self.mode = mode
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._executor = None
+        self._pending = 0
+        self.restarts = 0
+
+    def start(self):
+        """Havuzu başlat"""
+        if self._executor is not None:
+            return
+        if self.mode == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.workers,
+                thread_name_prefix="face-worker"
+            )
+
+    def shutdown(self):
+        """Havuzu kapat"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, broken):
+        """Çöken havuzu yenisiyle değiştir (aynı anda bozulan çağrılar yalnızca bir kez kurar)"""
+        if self._executor is not broken:
+            return
+        print("Yüz işçi havuzu çöktü, yeniden başlatılıyor")
+        broken.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.restarts += 1
+        self.start()
+
+    async def _submit(self, method: str, args: tuple):
+        if self.mode == "process":
+            # memoryview süreçler arası aktarılamaz; sadece burada kopyalanır
+            args = tuple(bytes(a) if isinstance(a, memoryview) else a for a in args)
+        loop = asyncio.get_running_loop()
+        try:
+            # İşçi süreci ölürse (OOM, cv2 segfault) havuz bir kez yeniden kurulup iş tekrar denenir
+            for _ in range(2):
+                executor = self._executor
+                try:
+                    return await loop.run_in_executor(executor, _call, method, *args)
+                except BrokenProcessPool:
+                    self._restart(executor)
+            raise FaceServiceUnavailable()
+        finally:
+            self._pending -= 1
+
+    async def run(self, method: str, *args):
+        """FaceRecognitionService metodunu havuzda çalıştır"""
+        return (await self.run_many(method, [args]))[0]
+
+    async def run_many(self, method: str, args_list: list) -> list:
+        """Aynı metodu birden çok argüman kümesiyle paralel çalıştır.
+
+        Tüm iş için kuyrukta yer yoksa hiçbiri başlatılmaz.
+        """
+        if self._pending + len(args_list) > self.max_pending:
+            raise FaceServiceBusy()
+
+        self.start()
+        self._pending += len(args_list)
+        return await asyncio.gather(*(self._submit(method, args) for args in args_list))
+
+    def get_stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "restarts": self.restarts
+        }
+
+
+# Global executor instance
+face_executor = FaceExecutor()
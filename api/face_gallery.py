@@ -0,0 +1,299 @@
+import cv2
+import numpy as np
+import fcntl
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Dict, Optional, Tuple
+
+# Tüm yüz kırpıntıları bu boyuta normalize edilip sabit boyutlu slotlarda saklanır
+FACE_SIZE = (100, 100)
+SLOT_BYTES = FACE_SIZE[0] * FACE_SIZE[1]
+# Sıkıştırmadan sonra diskte tutulan veri dosyası nesli (geçerli dahil); diğer
+# süreçler eski indeksle okurken önceki nesil silinmemeli
+FACE_GALLERY_KEEP_GENERATIONS = max(2, int(os.getenv("FACE_GALLERY_KEEP_GENERATIONS", "2")))
+
+
+def normalize_face(face_img: np.ndarray) -> np.ndarray:
+    """Gri yüz kırpıntısını galeri boyutuna getir"""
+    if face_img.shape[:2] == (FACE_SIZE[1], FACE_SIZE[0]):
+        return np.ascontiguousarray(face_img, dtype=np.uint8)
+    return cv2.resize(face_img, FACE_SIZE, interpolation=cv2.INTER_AREA)
+
+
+class FaceGallery:
+    """Tek paketlenmiş dosyada (memmap) yüz kırpıntıları + JSON indeks.
+
+    Veri dosyası `gallery.<nesil>.bin` yalnızca sona ekleme ile büyür; indeks
+    (`gallery_index.json`) hangi slotun hangi kişiye ait olduğunu tutar ve her
+    değişiklikte atomik olarak yeniden yazılır. Silinen slotlar sıkıştırma
+    (compact) ile yeni nesil dosyaya taşınana kadar ölü kalır.
+    """
+
+    def __init__(self, gallery_dir: str = "/app/data/gallery"):
+        self.gallery_dir = gallery_dir
+        self.index_path = os.path.join(gallery_dir, "gallery_index.json")
+        self.lock_path = os.path.join(gallery_dir, "gallery.lock")
+        os.makedirs(gallery_dir, exist_ok=True)
+
+        self.index = {'generation': 0, 'slot_count': 0, 'persons': {}}
+        self._index_mtime = None
+        self._mmap = None
+        self._mmap_key = None
+        self.reload_if_changed()
+
+    def _data_path(self, generation: int) -> str:
+        return os.path.join(self.gallery_dir, f"gallery.{generation}.bin")
+
+    @contextmanager
+    def _locked(self):
+        """Süreçler arası yazma kilidi"""
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Kilit altında diğer süreçlerin değişikliklerini gör
+                self.reload_if_changed()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reload_if_changed(self) -> bool:
+        """İndeks başka bir süreç tarafından güncellendiyse yeniden oku"""
+        try:
+            # os.replace her yazımda yeni inode üretir; mtime çözünürlüğüne güvenilmez
+            stat = os.stat(self.index_path)
+            mtime = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            return False
+        if mtime == self._index_mtime:
+            return False
+
+        with open(self.index_path, 'r') as f:
+            self.index = json.load(f)
+        self._index_mtime = mtime
+        return True
+
+    @property
+    def index_version(self):
+        """Okunan indeks dosyasının kimliği; her yazımda değişir"""
+        return self._index_mtime
+
+    def _write_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        stat = os.stat(self.index_path)
+        self._index_mtime = (stat.st_ino, stat.st_mtime_ns)
+
+    def _get_mmap(self) -> Optional[np.memmap]:
+        """Geçerli veri dosyasının salt okunur görünümü"""
+        slot_count = self.index['slot_count']
+        if slot_count == 0:
+            return None
+
+        key = (self.index['generation'], slot_count)
+        if self._mmap_key != key:
+            try:
+                self._mmap = self._open_mmap(self.index['generation'], slot_count)
+            except FileNotFoundError:
+                # İndeks birkaç sıkıştırma geride kalmış; güncelini okuyup yeniden dene
+                self._index_mtime = None
+                self.reload_if_changed()
+                slot_count = self.index['slot_count']
+                if slot_count == 0:
+                    return None
+                key = (self.index['generation'], slot_count)
+                self._mmap = self._open_mmap(self.index['generation'], slot_count)
+            self._mmap_key = key
+        return self._mmap
+
+    def _open_mmap(self, generation: int, slot_count: int) -> np.memmap:
+        return np.memmap(
+            self._data_path(generation),
+            dtype=np.uint8,
+            mode='r',
+            shape=(slot_count, FACE_SIZE[1], FACE_SIZE[0])
+        )
+
+    def append(self, person_id: int, person_name: str, face_img: np.ndarray) -> np.ndarray:
+        """Yüzü galeriye ekle, normalize edilmiş kırpıntıyı döndür"""
+        face = normalize_face(face_img)
+
+        with self._locked():
+            slot = self.index['slot_count']
+            data_path = self._data_path(self.index['generation'])
+
+            # İndekste olmayan (yarım kalmış) baytların üzerine yaz
+            mode = 'r+b' if os.path.exists(data_path) else 'wb'
+            with open(data_path, mode) as f:
+                f.seek(slot * SLOT_BYTES)
+                f.write(face.tobytes())
+                f.truncate()
+                f.flush()
+                os.fsync(f.fileno())
+
+            key = str(person_id)
+            person = self.index['persons'].get(key)
+            if person is None:
+                person = {
+                    'id': person_id,
+                    'name': person_name,
+                    'added_date': datetime.now().isoformat(),
+                    'images': []
+                }
+                self.index['persons'][key] = person
+
+            person['images'].append({
+                'slot': slot,
+                'timestamp': datetime.now().strftime("%Y%m%d_%H%M%S")
+            })
+            self.index['slot_count'] = slot + 1
+            self._write_index()
+
+        return face
+
+    def delete_person(self, person_id: int) -> int:
+        """Kişiyi indeksten çıkar, ölü kalan slot sayısını döndür"""
+        with self._locked():
+            person = self.index['persons'].pop(str(person_id), None)
+            if person is None:
+                return 0
+            self._write_index()
+            return len(person['images'])
+
+    def get_persons(self) -> List[Dict]:
+        """Kayıtlı kişiler (indeksten, dizin taraması olmadan)"""
+        self.reload_if_changed()
+        return list(self.index['persons'].values())
+
+    def set_threshold(self, person_id: int, threshold: Optional[float]) -> bool:
+        """Kişiye özel eşleşme eşiğini ayarla (None varsayılana döndürür)"""
+        with self._locked():
+            person = self.index['persons'].get(str(person_id))
+            if person is None:
+                return False
+            if threshold is None:
+                person.pop('threshold', None)
+            else:
+                person['threshold'] = threshold
+            self._write_index()
+            return True
+
+    def has_person(self, person_id: int) -> bool:
+        self.reload_if_changed()
+        return str(person_id) in self.index['persons']
+
+    def live_slot_count(self) -> int:
+        return sum(len(p['images']) for p in self.index['persons'].values())
+
+    def get_fragmentation(self) -> float:
+        """Veri dosyasındaki ölü slot oranı"""
+        slot_count = self.index['slot_count']
+        if slot_count == 0:
+            return 0.0
+        return 1.0 - self.live_slot_count() / slot_count
+
+    def load_training_data(self, start_slot: int = 0) -> Tuple[List[np.ndarray], np.ndarray, Tuple[int, int]]:
+        """Canlı slotları memmap üzerinden (JPEG decode olmadan) döndür.
+
+        Yalnızca `start_slot` ve sonrasındaki slotlar okunur; üçüncü değer
+        okunan indeksin (nesil, slot sayısı) bilgisidir.
+        """
+        self.reload_if_changed()
+        index = self.index
+        snapshot = (index['generation'], index['slot_count'])
+        data = self._get_mmap()
+        if data is None:
+            return [], np.array([], dtype=np.int32), snapshot
+
+        slots = []
+        labels = []
+        for person in index['persons'].values():
+            for image in person['images']:
+                if image['slot'] >= start_slot:
+                    slots.append(image['slot'])
+                    labels.append(int(person['id']))
+
+        faces = data[np.array(slots, dtype=np.int64)] if slots else data[:0]
+        return list(faces), np.array(labels, dtype=np.int32), snapshot
+
+    def compact(self) -> bool:
+        """Canlı slotları yeni nesil veri dosyasına taşı"""
+        with self._locked():
+            if self.live_slot_count() == self.index['slot_count']:
+                return False
+
+            old_generation = self.index['generation']
+            new_generation = old_generation + 1
+            data = self._get_mmap()
+
+            new_slot = 0
+            with open(self._data_path(new_generation), 'wb') as f:
+                for person in self.index['persons'].values():
+                    for image in person['images']:
+                        f.write(data[image['slot']].tobytes())
+                        image['slot'] = new_slot
+                        new_slot += 1
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.index['generation'] = new_generation
+            self.index['slot_count'] = new_slot
+            self._write_index()
+
+            self._mmap = None
+            self._mmap_key = None
+            self._remove_old_generations(new_generation)
+            return True
+
+    def _remove_old_generations(self, generation: int):
+        """Saklama sınırının dışında kalan nesilleri sil (önceki nesil bir sonraki sıkıştırmaya kadar kalır)"""
+        for file_name in os.listdir(self.gallery_dir):
+            parts = file_name.split('.')
+            if len(parts) != 3 or parts[0] != 'gallery' or parts[2] != 'bin' or not parts[1].isdigit():
+                continue
+            if int(parts[1]) <= generation - FACE_GALLERY_KEEP_GENERATIONS:
+                try:
+                    os.remove(os.path.join(self.gallery_dir, file_name))
+                except OSError:
+                    pass
+
+
+def migrate_from_directories(faces_dir: str, gallery: FaceGallery) -> int:
+    """Eski kişi başına JPEG dizin düzenini galeriye aktar"""
+    migrated = 0
+    for person_id in sorted(os.listdir(faces_dir)):
+        person_dir = os.path.join(faces_dir, person_id)
+        if not os.path.isdir(person_dir) or not person_id.isdigit():
+            continue
+        if gallery.has_person(int(person_id)):
+            continue
+
+        info_path = os.path.join(person_dir, "info.json")
+        person_name = person_id
+        if os.path.exists(info_path):
+            with open(info_path, 'r') as f:
+                person_name = json.load(f).get('name', person_id)
+
+        for image_file in sorted(os.listdir(person_dir)):
+            if not image_file.endswith('.jpg'):
+                continue
+            face_img = cv2.imread(os.path.join(person_dir, image_file), cv2.IMREAD_GRAYSCALE)
+            if face_img is not None:
+                gallery.append(int(person_id), person_name, face_img)
+                migrated += 1
+
+    return migrated
+
+
+if __name__ == "__main__":
+    # Kullanım: python face_gallery.py [eski_yuz_dizini] [galeri_dizini]
+    source_dir = sys.argv[1] if len(sys.argv) > 1 else "/app/data/faces"
+    target_dir = sys.argv[2] if len(sys.argv) > 2 else "/app/data/gallery"
+    count = migrate_from_directories(source_dir, FaceGallery(target_dir))
+    print(f"{count} yüz görüntüsü galeriye aktarıldı")
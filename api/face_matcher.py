@@ -0,0 +1,159 @@
+import numpy as np
+import os
+from typing import Dict, List, Optional, Tuple
+
+# LBP hücre ızgarası (grid x grid) ve varsayılan benzerlik eşiği
+FACE_FEATURE_GRID = int(os.getenv("FACE_FEATURE_GRID", "6"))
+FACE_MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", "0.9"))
+# Öznitelik çıkarımında bellek kullanımını sınırlamak için parça boyutu
+FEATURE_CHUNK = 256
+
+
+def _uniform_lbp_table() -> np.ndarray:
+    """256 LBP kodunu 59 'uniform' kutuya eşleyen tablo"""
+    table = np.full(256, 58, dtype=np.int64)
+    next_bin = 0
+    for code in range(256):
+        bits = [(code >> i) & 1 for i in range(8)]
+        transitions = sum(bits[i] != bits[(i + 1) % 8] for i in range(8))
+        if transitions <= 2:
+            table[code] = next_bin
+            next_bin += 1
+    return table
+
+
+UNIFORM_LBP = _uniform_lbp_table()
+LBP_BINS = 59
+
+
+def extract_features(faces, grid: int = FACE_FEATURE_GRID) -> np.ndarray:
+    """Normalize yüzlerden (N, H, W) uniform LBP hücre histogramları çıkar.
+
+    Histogramların karekökü alınıp L2 normalize edilir; böylece iki vektörün
+    iç çarpımı Bhattacharyya benzerliği olur ve eşleştirme tek matris çarpımıdır.
+    """
+    faces = np.asarray(faces)
+    if faces.ndim == 2:
+        faces = faces[np.newaxis]
+    if len(faces) > FEATURE_CHUNK:
+        return np.vstack([extract_features(faces[i:i + FEATURE_CHUNK], grid)
+                          for i in range(0, len(faces), FEATURE_CHUNK)])
+
+    faces = faces.astype(np.int16)
+    count, height, width = faces.shape
+
+    center = faces[:, 1:-1, 1:-1]
+    codes = np.zeros(center.shape, dtype=np.int64)
+    offsets = [(-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1)]
+    for bit, (dy, dx) in enumerate(offsets):
+        neighbor = faces[:, 1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx]
+        codes |= (neighbor >= center).astype(np.int64) << bit
+    bins = UNIFORM_LBP[codes]
+
+    # Her pikselin hücre numarası; tüm yüzlerin histogramları tek bincount ile
+    inner_h, inner_w = height - 2, width - 2
+    cell_y = np.minimum(np.arange(inner_h) * grid // inner_h, grid - 1)
+    cell_x = np.minimum(np.arange(inner_w) * grid // inner_w, grid - 1)
+    cells = (cell_y[:, np.newaxis] * grid + cell_x[np.newaxis, :]) * LBP_BINS
+    dims = grid * grid * LBP_BINS
+    flat = bins + cells[np.newaxis] + (np.arange(count) * dims)[:, np.newaxis, np.newaxis]
+    hist = np.bincount(flat.ravel(), minlength=count * dims).reshape(count, dims)
+
+    features = np.sqrt(hist.astype(np.float32))
+    return _normalize_rows(features)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorRecognizer:
+    """Kimlik başına tek öznitelik vektörü tutan toplu en-yakın-komşu eşleştirici.
+
+    Galeri, bitişik bir (kimlik x boyut) float32 matristir; bir karedeki tüm
+    yüzler tek bir matris çarpımıyla tüm kimliklere karşı puanlanır.
+    """
+
+    def __init__(self, grid: int = FACE_FEATURE_GRID, default_threshold: float = FACE_MATCH_THRESHOLD):
+        self.grid = grid
+        self.default_threshold = default_threshold
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, grid * grid * LBP_BINS), dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.matrix = self.sums.copy()
+        self.thresholds: Dict[int, float] = {}
+        self._rows: Dict[int, int] = {}
+
+    def train(self, faces, labels):
+        """Galeriyi baştan oluştur"""
+        self.labels = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((0, self.sums.shape[1]), dtype=np.float32)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._rows = {}
+        self.update(faces, labels)
+
+    def update(self, faces, labels):
+        """Yeni örnekleri ilgili kimliklerin ortalama vektörüne ekle"""
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return
+        features = extract_features(faces, self.grid)
+
+        new_labels = [label for label in np.unique(labels) if int(label) not in self._rows]
+        if new_labels:
+            start = len(self.labels)
+            self.labels = np.concatenate([self.labels, np.array(new_labels, dtype=np.int64)])
+            self.sums = np.vstack([self.sums, np.zeros((len(new_labels), self.sums.shape[1]), dtype=np.float32)])
+            self.counts = np.concatenate([self.counts, np.zeros(len(new_labels), dtype=np.int64)])
+            for offset, label in enumerate(new_labels):
+                self._rows[int(label)] = start + offset
+
+        rows = np.array([self._rows[int(label)] for label in labels], dtype=np.int64)
+        np.add.at(self.sums, rows, features)
+        np.add.at(self.counts, rows, 1)
+
+        if new_labels:
+            self._refresh()
+        else:
+            # Yalnızca değişen kimliklerin satırlarını yeniden normalize et
+            changed = np.unique(rows)
+            self.matrix[changed] = _normalize_rows(self.sums[changed])
+
+    def _refresh(self):
+        self.matrix = np.ascontiguousarray(_normalize_rows(self.sums))
+
+    def predict_batch(self, faces, top_k: int = 1, exclude: Optional[set] = None) -> List[List[Tuple[int, float]]]:
+        """Her yüz için en benzer top_k kimlik: [(kimlik, benzerlik), ...]"""
+        if len(self.labels) == 0 or len(faces) == 0:
+            return [[] for _ in range(len(faces))]
+
+        scores = extract_features(faces, self.grid) @ self.matrix.T
+        if exclude:
+            mask = np.isin(self.labels, np.fromiter(exclude, dtype=np.int64))
+            scores[:, mask] = -np.inf
+
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append([(int(self.labels[i]), float(row[i])) for i in ordered if np.isfinite(row[i])])
+        return results
+
+    def threshold_for(self, label: int) -> float:
+        return self.thresholds.get(label, self.default_threshold)
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            np.savez(f, labels=self.labels, sums=self.sums, counts=self.counts, grid=self.grid)
+
+    def read(self, path: str):
+        with np.load(path) as data:
+            self.grid = int(data['grid'])
+            self.labels = data['labels']
+            self.sums = data['sums']
+            self.counts = data['counts']
+        self._rows = {int(label): row for row, label in enumerate(self.labels)}
+        self._refresh()
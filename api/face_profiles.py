@@ -0,0 +1,49 @@
+import cv2
+import os
+from typing import Optional
+
+# Tespit profilleri: düşük çözünürlüklü gri decode + kaskad parametreleri.
+# 'scale' küçültme oranıdır; koordinatlar orijinal görüntüye geri ölçeklenir.
+DETECTION_PROFILES = {
+    'fast': {
+        'decode_flag': cv2.IMREAD_REDUCED_GRAYSCALE_4,
+        'scale': 4,
+        'scale_factor': 1.2,
+        'min_neighbors': 4,
+        'min_size': (20, 20)
+    },
+    'balanced': {
+        'decode_flag': cv2.IMREAD_REDUCED_GRAYSCALE_2,
+        'scale': 2,
+        'scale_factor': 1.15,
+        'min_neighbors': 5,
+        'min_size': (24, 24)
+    },
+    'accurate': {
+        'decode_flag': cv2.IMREAD_GRAYSCALE,
+        'scale': 1,
+        'scale_factor': 1.1,
+        'min_neighbors': 5,
+        'min_size': (30, 30)
+    }
+}
+DEFAULT_DETECTION_PROFILE = os.getenv("FACE_DETECTION_PROFILE", "accurate")
+
+
+def parse_roi(roi) -> Optional[tuple]:
+    """"x,y,w,h" metni, liste ya da {x, y, width, height} sözlüğünden ROI demeti"""
+    if roi is None or roi == "":
+        return None
+    if isinstance(roi, dict):
+        values = [roi.get('x'), roi.get('y'), roi.get('width'), roi.get('height')]
+    elif isinstance(roi, str):
+        values = roi.split(',')
+    else:
+        values = list(roi)
+
+    if len(values) != 4:
+        raise ValueError("ROI must have x, y, width, height")
+    x, y, w, h = (int(v) for v in values)
+    if w <= 0 or h <= 0:
+        raise ValueError("ROI width and height must be positive")
+    return (x, y, w, h)
@@ -4,85 +4,339 @@ import base64
 from typing import List, Dict, Optional
 import os
 import json
+import fcntl
+import threading
+from collections import Counter
 from datetime import datetime
+from face_gallery import FaceGallery, normalize_face
+from face_profiles import DETECTION_PROFILES, DEFAULT_DETECTION_PROFILE
+from face_matcher import VectorRecognizer
+
+# Silinen örneklerin modeldeki oranı bu eşiği geçince arka planda tam eğitim yapılır
+FACE_MODEL_COMPACT_THRESHOLD = float(os.getenv("FACE_MODEL_COMPACT_THRESHOLD", "0.25"))
+# Temel modele artımlı eklenen örnek sayısı bunu geçince yeni sürüm yayınlanır
+FACE_MODEL_SNAPSHOT_SLOTS = int(os.getenv("FACE_MODEL_SNAPSHOT_SLOTS", "500"))
+# Diskte tutulacak eski model sürümü sayısı
+FACE_MODEL_KEEP_VERSIONS = int(os.getenv("FACE_MODEL_KEEP_VERSIONS", "3"))
+# Tanıma motoru: "lbph" (OpenCV) ya da "vector" (toplu NumPy eşleştirme)
+FACE_RECOGNITION_BACKEND = os.getenv("FACE_RECOGNITION_BACKEND", "lbph")
+# LBPH mesafe eşiği (düşük = daha benzer)
+LBPH_THRESHOLD = 100
 
 class FaceRecognitionService:
     def __init__(self):
         # Haar Cascade yükle
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
         
-        # Yüz tanıma modeli (LBPH)
-        self.recognizer = cv2.face.LBPHFaceRecognizer_create()
+        # Yüz tanıma modeli (LBPH ya da vektör eşleştirici)
+        self.backend = FACE_RECOGNITION_BACKEND
+        self.model_ext = ".npz" if self.backend == "vector" else ".yml"
+        self.recognizer = self._create_recognizer()
+        
+        # Kayıtlı yüzler: paketlenmiş galeri (eski dizin düzeni için face_gallery.py ile aktarım)
+        self.gallery = FaceGallery("/app/data/gallery")
+        
+        # Sürümlü model dosyaları: face_model.v<N>.yml + .json, CURRENT geçerli sürümü gösterir
+        self.model_dir = "/app/data/models"
+        self.current_path = os.path.join(self.model_dir, "CURRENT")
+        self.train_lock_path = os.path.join(self.model_dir, "train.lock")
+        os.makedirs(self.model_dir, exist_ok=True)
         
-        # Kayıtlı yüzler dizini
-        self.faces_dir = "/app/data/faces"
-        self.model_path = "/app/data/face_model.yml"
+        # _model_lock tahmin ve referans değişimini korur; _reload_lock aynı anda tek yüklemeye izin verir
+        self._model_lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._rebuild_thread = None
         
-        # Dizinleri oluştur
-        os.makedirs(self.faces_dir, exist_ok=True)
+        # Temel model sürümü ve üzerine galeriden uygulanan artımlı örnekler
+        self.model_version = 0
+        self._current_key = None
+        self._base = None
+        self._applied_slots = 0
+        self._gallery_key = None
+        self.label_counts = Counter()
+        self.tombstones = set()
+        self.tombstoned_samples = 0
         
         # Model varsa yükle
-        if os.path.exists(self.model_path):
+        self.is_trained = False
+        self.reload_if_changed()
+    
+    def _create_recognizer(self):
+        if self.backend == "vector":
+            return VectorRecognizer()
+        return cv2.face.LBPHFaceRecognizer_create()
+    
+    def _artifact_path(self, version: int, ext: str) -> str:
+        return os.path.join(self.model_dir, f"face_model.v{version}{ext}")
+    
+    def _read_current_version(self) -> int:
+        try:
+            with open(self.current_path, 'r') as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return 0
+    
+    def reload_if_changed(self, wait: bool = True) -> bool:
+        """Yeni model sürümü yayınlandıysa yükle ve galerideki değişiklikleri uygula.
+        
+        Kontrol yalnızca iki stat çağrısıdır; yeni model kilit dışında ayrı bir
+        nesneye yüklenir ve _model_lock yalnızca referans değişimi için alınır,
+        böylece süren tahminler yükleme süresince beklemez. wait=False iken başka
+        bir iş parçacığı zaten yüklüyorsa geçerli modelle hemen devam edilir.
+        """
+        if not self._reload_lock.acquire(blocking=wait):
+            return False
+        try:
+            return self._reload()
+        finally:
+            self._reload_lock.release()
+    
+    def _reload(self) -> bool:
+        changed = False
+        try:
+            stat = os.stat(self.current_path)
+            current_key = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            current_key = None
+        
+        if current_key is not None and current_key != self._current_key:
             try:
-                self.recognizer.read(self.model_path)
-                self.is_trained = True
-            except:
-                self.is_trained = False
-        else:
-            self.is_trained = False
+                changed = self._load_version(self._read_current_version())
+                self._current_key = current_key
+            except ValueError as e:
+                # Farklı motorla eğitilmiş sürüm: tekrar denemenin anlamı yok
+                print(f"Model yükleme hatası: {e}")
+                self._current_key = current_key
+            except Exception as e:
+                print(f"Model yükleme hatası: {e}")
+        
+        if self.is_trained:
+            changed = self._apply_gallery_changes() or changed
+        
+        return changed
+    
+    def _load_version(self, version: int) -> bool:
+        if version == self.model_version:
+            return False
+        
+        with open(self._artifact_path(version, ".json"), 'r') as f:
+            base = json.load(f)
+        if base.get('backend', 'lbph') != self.backend:
+            raise ValueError(f"model v{version} {base.get('backend', 'lbph')} motoru ile eğitilmiş, yeniden eğitim gerekli")
+        
+        # Dosya okuma kilit dışında; tahminler bu sırada eski modelle sürer
+        recognizer = self._create_recognizer()
+        recognizer.read(self._artifact_path(version, self.model_ext))
+        label_counts = Counter({int(k): v for k, v in base['label_counts'].items()})
+        
+        with self._model_lock:
+            self.recognizer = recognizer
+            self.model_version = version
+            self._base = base
+            self._applied_slots = base['slot_count']
+            self._gallery_key = None
+            self.label_counts = label_counts
+            self.is_trained = True
+        return True
+    
+    def _apply_gallery_changes(self) -> bool:
+        """Temel modelden sonra galeriye eklenen slotları modele ekle, silinenleri tombstone yap"""
+        self.gallery.reload_if_changed()
+        index = self.gallery.index
+        gallery_key = self.gallery.index_version
+        if gallery_key == self._gallery_key:
+            return False
+        
+        # Sıkıştırılmış galeri yeni temel modelle birlikte yayınlanır; o zamana
+        # kadar yeni nesildeki slotlar uygulanmaz
+        faces, labels, slot_count = [], None, self._applied_slots
+        if index['generation'] == self._base['generation'] and index['slot_count'] > self._applied_slots:
+            faces, labels, (_, slot_count) = self.gallery.load_training_data(self._applied_slots)
+        
+        persons = {int(person_id) for person_id in index['persons']}
+        thresholds = {
+            int(person['id']): person['threshold']
+            for person in index['persons'].values() if 'threshold' in person
+        }
+        
+        # Galeri okuması kilit dışında; kilit altında yalnızca yeni örnekler eklenir
+        with self._model_lock:
+            if len(faces) > 0:
+                self.recognizer.update(faces, labels)
+                self.label_counts.update(labels.tolist())
+            self._applied_slots = slot_count
+            self._gallery_key = gallery_key
+            
+            # Modelde olup galeride olmayan kimlikler silinmiştir
+            self.tombstones = {label for label in self.label_counts if label not in persons}
+            self.tombstoned_samples = sum(self.label_counts[label] for label in self.tombstones)
+            
+            # Kişiye özel eşikler galeri indeksinde tutulur
+            if self.backend == "vector":
+                self.recognizer.thresholds = thresholds
+        return True
+    
+    def get_fragmentation(self) -> float:
+        """Modeldeki silinmiş örneklerin oranı"""
+        total = sum(self.label_counts.values())
+        return self.tombstoned_samples / total if total else 0.0
+    
+    def get_model_info(self) -> Dict:
+        """Geçerli model sürümü ve durum bilgisi"""
+        self.reload_if_changed()
+        return {
+            'version': self.model_version,
+            'backend': self.backend,
+            'is_trained': self.is_trained,
+            'samples': sum(self.label_counts.values()),
+            'incremental_samples': self._applied_slots - self._base['slot_count'] if self._base else 0,
+            'tombstoned_samples': self.tombstoned_samples,
+            'fragmentation': self.get_fragmentation()
+        }
+    
+    def _start_rebuild(self):
+        """Arka planda tam eğitim başlat (zaten çalışıyorsa atla)"""
+        with self._model_lock:
+            if self._rebuild_thread is not None and self._rebuild_thread.is_alive():
+                return
+            self._rebuild_thread = threading.Thread(target=self.train_model, args=(False,), daemon=True)
+            self._rebuild_thread.start()
     
     def detect_faces(self, image_data: str) -> List[Dict]:
         """Base64 encoded görüntüden yüzleri tespit et"""
         try:
             # Base64'ü decode et
             image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
+            return self.detect_faces_bytes(image_bytes) or []
+        except Exception as e:
+            print(f"Yüz tespit hatası: {e}")
+            return []
+    
+    def detect_faces_bytes(self, image_bytes, profile: str = DEFAULT_DETECTION_PROFILE,
+                           roi: Optional[tuple] = None, top_k: int = 1) -> Optional[List[Dict]]:
+        """Ham (JPEG/PNG) görüntü baytlarından yüzleri tespit et.
+        
+        bytes/memoryview kopyalanmadan np.frombuffer ile okunur ve profilin
+        belirlediği çözünürlükte doğrudan gri olarak decode edilir; görüntü
+        çözülemezse None döner.
+        """
+        try:
+            params = DETECTION_PROFILES[profile]
             nparr = np.frombuffer(image_bytes, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            gray = cv2.imdecode(nparr, params['decode_flag'])
             
-            if img is None:
-                return []
+            if gray is None:
+                return None
             
-            # Gri tonlamaya çevir
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            return self._detect_gray(gray, params, roi, top_k)
             
-            # Yüzleri tespit et
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(30, 30)
-            )
-            
-            detected_faces = []
-            for i, (x, y, w, h) in enumerate(faces):
-                face_data = {
-                    'id': i,
-                    'x': int(x),
-                    'y': int(y),
-                    'width': int(w),
-                    'height': int(h),
-                    'confidence': 0.0
-                }
-                
-                # Eğer model eğitilmişse tanımaya çalış
-                if self.is_trained:
-                    face_roi = gray[y:y+h, x:x+w]
-                    label, confidence = self.recognizer.predict(face_roi)
-                    face_data['recognized_id'] = int(label)
-                    face_data['confidence'] = float(confidence)
-                    face_data['is_known'] = confidence < 100  # Eşik değeri
-                
-                detected_faces.append(face_data)
+        except Exception as e:
+            print(f"Yüz tespit hatası: {e}")
+            return []
+    
+    def detect_faces_image(self, img: np.ndarray, profile: str = DEFAULT_DETECTION_PROFILE,
+                           roi: Optional[tuple] = None, top_k: int = 1) -> List[Dict]:
+        """Çözülmüş BGR (ya da gri) kareden yüzleri tespit et"""
+        try:
+            params = DETECTION_PROFILES[profile]
+            
+            # Gri tonlamaya çevir ve profil ölçeğine küçült
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+            if params['scale'] > 1:
+                gray = cv2.resize(gray, None, fx=1.0 / params['scale'], fy=1.0 / params['scale'],
+                                  interpolation=cv2.INTER_AREA)
             
-            return detected_faces
+            return self._detect_gray(gray, params, roi, top_k)
             
         except Exception as e:
             print(f"Yüz tespit hatası: {e}")
             return []
     
+    def _detect_gray(self, gray: np.ndarray, params: Dict, roi: Optional[tuple], top_k: int = 1) -> List[Dict]:
+        """Küçültülmüş gri görüntüde (isteğe bağlı ROI içinde) tespit ve tanıma"""
+        scale = params['scale']
+        
+        # ROI orijinal görüntü koordinatlarındadır
+        offset_x, offset_y = 0, 0
+        if roi is not None:
+            rx, ry, rw, rh = (int(v) // scale for v in roi)
+            # Bitiş kırpılmamış başlangıçtan hesaplanır; negatif x/y alanı büyütmez
+            height, width = gray.shape[:2]
+            x2, y2 = min(width, rx + max(0, rw)), min(height, ry + max(0, rh))
+            offset_x, offset_y = min(width, max(0, rx)), min(height, max(0, ry))
+            gray = gray[offset_y:max(offset_y, y2), offset_x:max(offset_x, x2)]
+            if gray.size == 0:
+                return []
+        
+        # Yüzleri tespit et
+        faces = self.face_cascade.detectMultiScale(
+            gray,
+            scaleFactor=params['scale_factor'],
+            minNeighbors=params['min_neighbors'],
+            minSize=params['min_size']
+        )
+        
+        detected_faces = []
+        for i, (x, y, w, h) in enumerate(faces):
+            detected_faces.append({
+                'id': i,
+                'x': int((x + offset_x) * scale),
+                'y': int((y + offset_y) * scale),
+                'width': int(w * scale),
+                'height': int(h * scale),
+                'confidence': 0.0
+            })
+        
+        # Eğer model eğitilmişse tanımaya çalış
+        if self.is_trained and len(faces) > 0:
+            face_rois = [normalize_face(gray[y:y+h, x:x+w]) for (x, y, w, h) in faces]
+            if self.backend == "vector":
+                self._recognize_vector(detected_faces, face_rois, top_k)
+            else:
+                self._recognize_lbph(detected_faces, face_rois)
+        
+        return detected_faces
+    
+    def _recognize_lbph(self, detected_faces: List[Dict], face_rois: List[np.ndarray]):
+        """Her yüz için ayrı LBPH tahmini (galeri boyutuyla doğrusal)"""
+        for face_data, face_roi in zip(detected_faces, face_rois):
+            with self._model_lock:
+                label, confidence = self.recognizer.predict(face_roi)
+            face_data['recognized_id'] = int(label)
+            face_data['confidence'] = float(confidence)
+            face_data['is_known'] = confidence < LBPH_THRESHOLD  # Eşik değeri
+            
+            # Silinmiş kişiye eşleşme bilinmeyen sayılır
+            if int(label) in self.tombstones:
+                face_data['recognized_id'] = -1
+                face_data['is_known'] = False
+    
+    def _recognize_vector(self, detected_faces: List[Dict], face_rois: List[np.ndarray], top_k: int):
+        """Karedeki tüm yüzleri tek matris çarpımıyla galeriye karşı puanla"""
+        with self._model_lock:
+            matches = self.recognizer.predict_batch(np.stack(face_rois), top_k, self.tombstones)
+            thresholds = [self.recognizer.threshold_for(candidates[0][0]) if candidates else None
+                          for candidates in matches]
+        
+        for face_data, candidates, threshold in zip(detected_faces, matches, thresholds):
+            if not candidates:
+                face_data['recognized_id'] = -1
+                face_data['is_known'] = False
+                continue
+            
+            label, similarity = candidates[0]
+            face_data['recognized_id'] = label
+            # LBPH ile uyumlu ölçek: düşük değer daha güvenilir eşleşme
+            face_data['confidence'] = (1.0 - similarity) * 100
+            face_data['similarity'] = similarity
+            face_data['is_known'] = similarity >= threshold
+            if top_k > 1:
+                face_data['matches'] = [
+                    {'id': candidate, 'similarity': score} for candidate, score in candidates
+                ]
+    
     def add_face(self, image_data: str, person_name: str, person_id: int) -> bool:
-        """Yeni yüz ekle ve modeli yeniden eğit"""
+        """Yeni yüz ekle ve modeli artımlı olarak güncelle"""
         try:
             # Base64'ü decode et
             image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
@@ -103,71 +357,65 @@ class FaceRecognitionService:
             
             # İlk yüzü al
             (x, y, w, h) = faces[0]
-            face_roi = gray[y:y+h, x:x+w]
-            
-            # Yüzü kaydet
-            person_dir = os.path.join(self.faces_dir, str(person_id))
-            os.makedirs(person_dir, exist_ok=True)
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            face_path = os.path.join(person_dir, f"{person_name}_{timestamp}.jpg")
-            cv2.imwrite(face_path, face_roi)
-            
-            # Kişi bilgilerini kaydet
-            info_path = os.path.join(person_dir, "info.json")
-            info = {
-                'id': person_id,
-                'name': person_name,
-                'added_date': datetime.now().isoformat(),
-                'images': []
-            }
-            
-            if os.path.exists(info_path):
-                with open(info_path, 'r') as f:
-                    info = json.load(f)
-            
-            info['images'].append({
-                'path': face_path,
-                'timestamp': timestamp
-            })
             
-            with open(info_path, 'w') as f:
-                json.dump(info, f, indent=2)
+            # Silinmiş bir kimlik yeniden ekleniyorsa eski örnekleri modelde durduğundan tam eğitim gerekir
+            self.reload_if_changed()
+            was_tombstoned = person_id in self.tombstones
+            
+            # Yüzü galeriye ekle; diğer işçiler örneği galeriden artımlı uygular
+            self.gallery.append(person_id, person_name, gray[y:y+h, x:x+w])
             
-            # Modeli yeniden eğit
-            self.train_model()
+            if not self.is_trained or was_tombstoned:
+                return self.train_model()
             
+            # Modeli artımlı güncelle
+            self.reload_if_changed()
+            if self._applied_slots - self._base['slot_count'] > FACE_MODEL_SNAPSHOT_SLOTS:
+                self._start_rebuild()
             return True
             
         except Exception as e:
             print(f"Yüz ekleme hatası: {e}")
             return False
     
-    def train_model(self) -> bool:
-        """Kayıtlı yüzlerle modeli eğit"""
+    def train_model(self, blocking: bool = True) -> bool:
+        """Kayıtlı yüzlerle modeli baştan eğit ve yeni sürüm olarak yayınla.
+        
+        Süreçler arası kilit sayesinde aynı anda tek eğitim çalışır;
+        blocking=False iken kilit doluysa hemen False döner.
+        """
+        with open(self.train_lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            try:
+                return self._train_full()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    
+    def _train_full(self) -> bool:
         try:
-            faces = []
-            labels = []
-            
-            # Tüm kayıtlı yüzleri yükle
-            for person_id in os.listdir(self.faces_dir):
-                person_dir = os.path.join(self.faces_dir, person_id)
-                if not os.path.isdir(person_dir):
-                    continue
-                
-                for image_file in os.listdir(person_dir):
-                    if image_file.endswith('.jpg'):
-                        image_path = os.path.join(person_dir, image_file)
-                        face_img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
-                        if face_img is not None:
-                            faces.append(face_img)
-                            labels.append(int(person_id))
+            # Silinen slotlar birikmişse galeriyi de sıkıştır
+            if self.gallery.get_fragmentation() > FACE_MODEL_COMPACT_THRESHOLD:
+                self.gallery.compact()
+            
+            # Tüm kayıtlı yüzleri memmap'ten yükle
+            faces, labels, (generation, slot_count) = self.gallery.load_training_data()
             
             if len(faces) > 0:
-                # Modeli eğit
-                self.recognizer.train(faces, np.array(labels))
-                self.recognizer.save(self.model_path)
-                self.is_trained = True
+                # Modeli eğit (kilit dışında - tahminler eski modelle devam eder)
+                recognizer = self._create_recognizer()
+                recognizer.train(faces, labels)
+                
+                self._publish_version(recognizer, {
+                    'backend': self.backend,
+                    'generation': generation,
+                    'slot_count': slot_count,
+                    'label_counts': {str(k): v for k, v in Counter(labels.tolist()).items()},
+                    'trained_at': datetime.now().isoformat()
+                })
+                self.reload_if_changed()
                 return True
             
             return False
@@ -176,35 +424,61 @@ class FaceRecognitionService:
             print(f"Model eğitim hatası: {e}")
             return False
     
+    def _publish_version(self, recognizer, base: Dict):
+        """Yeni sürüm dosyalarını atomik yaz, ardından CURRENT'ı güncelle"""
+        version = self._read_current_version() + 1
+        base['version'] = version
+        
+        model_path = self._artifact_path(version, self.model_ext)
+        tmp_model_path = self._artifact_path(version, ".tmp" + self.model_ext)
+        recognizer.save(tmp_model_path)
+        os.replace(tmp_model_path, model_path)
+        
+        meta_path = self._artifact_path(version, ".json")
+        with open(meta_path + ".tmp", 'w') as f:
+            json.dump(base, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        
+        # Sürüm işaretçisi en son değişir; okuyucular yarım sürüm görmez
+        with open(self.current_path + ".tmp", 'w') as f:
+            f.write(str(version))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.current_path + ".tmp", self.current_path)
+        
+        # Eski sürümleri temizle
+        for file_name in os.listdir(self.model_dir):
+            parts = file_name.split('.')
+            if parts[0] != 'face_model' or not parts[1][1:].isdigit():
+                continue
+            if int(parts[1][1:]) <= version - FACE_MODEL_KEEP_VERSIONS:
+                try:
+                    os.remove(os.path.join(self.model_dir, file_name))
+                except OSError:
+                    pass
+    
+    def set_threshold(self, person_id: int, threshold: Optional[float]) -> bool:
+        """Kişiye özel eşleşme eşiği (vektör motoru)"""
+        return self.gallery.set_threshold(person_id, threshold)
+    
     def get_registered_faces(self) -> List[Dict]:
         """Kayıtlı yüzlerin listesini getir"""
-        registered_faces = []
-        
         try:
-            for person_id in os.listdir(self.faces_dir):
-                person_dir = os.path.join(self.faces_dir, person_id)
-                info_path = os.path.join(person_dir, "info.json")
-                
-                if os.path.exists(info_path):
-                    with open(info_path, 'r') as f:
-                        info = json.load(f)
-                        registered_faces.append(info)
-        
+            return self.gallery.get_persons()
         except Exception as e:
             print(f"Kayıtlı yüzler listesi hatası: {e}")
-        
-        return registered_faces
+            return []
     
     def delete_face(self, person_id: int) -> bool:
         """Kayıtlı yüzü sil"""
         try:
-            person_dir = os.path.join(self.faces_dir, str(person_id))
-            if os.path.exists(person_dir):
-                import shutil
-                shutil.rmtree(person_dir)
+            if self.gallery.delete_person(person_id):
+                # Modelden çıkarmak yerine kimlik tombstone olur (galeride yok)
+                self.reload_if_changed()
                 
-                # Modeli yeniden eğit
-                self.train_model()
+                # Parçalanma eşiği aşıldıysa arka planda yeniden eğit
+                if self.get_fragmentation() > FACE_MODEL_COMPACT_THRESHOLD:
+                    self._start_rebuild()
                 return True
             
             return False
@@ -0,0 +1,100 @@
+import base64
+import binascii
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Sayfa başına varsayılan ve en fazla satır
+LIST_DEFAULT_LIMIT = int(os.getenv("LIST_DEFAULT_LIMIT", "50"))
+LIST_MAX_LIMIT = int(os.getenv("LIST_MAX_LIMIT", "500"))
+
+# Listelerde hiçbir zaman dönmeyen sütunlar
+HIDDEN_FIELDS = {"password", "hashed_password"}
+
+
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def public_fields(model) -> List[str]:
+    return [column.name for column in model.__table__.columns if column.name not in HIDDEN_FIELDS]
+
+
+def parse_fields(model, fields: Optional[str]) -> List[str]:
+    """fields=a,b,c parametresini doğrula; id imleç için her zaman seçilir"""
+    allowed = public_fields(model)
+    if not fields:
+        return allowed
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}, expected any of {allowed}")
+    return ["id"] + [name for name in requested if name != "id"]
+
+
+def owner_filter(current_user, user_id: Optional[int]) -> Optional[int]:
+    """Listelenecek sahip: yönetici isterse herkesi görür, diğerleri yalnızca kendi kayıtlarını"""
+    if getattr(current_user, "is_admin", False):
+        return user_id
+    if user_id is not None and user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="Not allowed to list other users' records")
+    return current_user.id
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def list_page(request: Request, db: AsyncSession, model, cursor: Optional[str] = None,
+                    limit: int = LIST_DEFAULT_LIMIT, fields: Optional[str] = None,
+                    user_id: Optional[int] = None, status: Optional[str] = None) -> Response:
+    """Anahtar kümesi (id azalan) sayfalama ile tablo listesi.
+
+    Yalnızca istenen sütunlar seçilir ve satırlar ORM nesnesine dönüştürülmez.
+    (user_id, id) ve (status, id) indeksleri filtreli sorguları karşılar.
+    ETag sayfa içeriğinden üretilir; eşleşen If-None-Match için gövde gönderilmez.
+    """
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {LIST_MAX_LIMIT}")
+    table = model.__table__
+    columns = parse_fields(model, fields)
+
+    stmt = select(*[table.c[name] for name in columns])
+    if user_id is not None:
+        stmt = stmt.where(table.c.user_id == user_id)
+    if status is not None:
+        stmt = stmt.where(table.c.status == status)
+    if cursor:
+        stmt = stmt.where(table.c.id < decode_cursor(cursor))
+    # Bir fazla satır okunur: sonraki sayfa olup olmadığı ek sorgu olmadan anlaşılır
+    stmt = stmt.order_by(table.c.id.desc()).limit(limit + 1)
+
+    rows = (await db.execute(stmt)).mappings().all()
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1]["id"]) if len(rows) > limit else None
+
+    body = json.dumps({"items": items, "next_cursor": next_cursor}, default=_json_default,
+                      separators=(",", ":")).encode()
+    etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
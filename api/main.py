@@ -1,17 +1,45 @@
-from fastapi import FastAPI, WebSocket, Depends, HTTPException, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db, engine, Base
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal, get_async_db, init_schema, dispose
 import models
 import auth
 import uvicorn
 import os
+import struct
+import time
+import asyncio
+import json
+import base64
+import binascii
 from edge_impulse_api import router as edge_impulse_router
-from face_recognition import face_service
+from edge_impulse_client import edge_impulse_client
+from edge_impulse_outbox import edge_impulse_outbox, EDGE_IMPULSE_OUTBOX_ENABLED
+from face_executor import face_executor, FaceServiceBusy, FaceServiceUnavailable
+from camera_pipeline import camera_pipeline
+from network_scanner import network_scanner
+from metrics_store import metrics_store, ROLLUP_RESOLUTIONS
+from datetime import datetime, timedelta
+from face_cache import detection_cache
+from user_cache import user_cache
+from dashboard_stats import dashboard_stats
+from listing import list_page, owner_filter, parse_fields, LIST_DEFAULT_LIMIT
+import bulk_io
+from vehicle_tracking import vehicle_tracker
+from response_cache import response_cache
+from realtime_hub import realtime_hub
+import redis_client
+from face_profiles import DETECTION_PROFILES, DEFAULT_DETECTION_PROFILE, parse_roi
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Toplu tespitte istek başına en fazla görüntü sayısı
+FACE_BATCH_MAX_IMAGES = int(os.getenv("FACE_BATCH_MAX_IMAGES", "32"))
+# Canlı (WebSocket) tespitte varsayılan profil ve kabul edilen en büyük JPEG karesi
+FACE_STREAM_PROFILE = os.getenv("FACE_STREAM_PROFILE", "balanced")
+FACE_STREAM_MAX_FRAME_BYTES = int(os.getenv("FACE_STREAM_MAX_FRAME_BYTES", str(2 * 1024 * 1024)))
+# Sunucu tarafı kamera analizi (Camera tablosundaki akışlar)
+CAMERA_PIPELINE_ENABLED = os.getenv("CAMERA_PIPELINE_ENABLED", "false").lower() == "true"
 
 app = FastAPI(
     title="DAKiTAI API",
@@ -33,9 +61,114 @@ security = HTTPBearer()
 # Include Edge Impulse router
 app.include_router(edge_impulse_router)
 
+# Kamera analiz sonuçlarını canlı panele aktaran görev
+face_events_task = None
+
+async def forward_face_results():
+    queue = camera_pipeline.subscribe()
+    try:
+        while True:
+            result = await queue.get()
+            realtime_hub.publish("faces", result["camera_id"], result)
+    finally:
+        camera_pipeline.unsubscribe(queue)
+
+@app.on_event("startup")
+async def startup():
+    await init_schema()
+    await edge_impulse_client.start()
+    if EDGE_IMPULSE_OUTBOX_ENABLED:
+        edge_impulse_outbox.start()
+    face_executor.start()
+    metrics_store.start()
+    dashboard_stats.start()
+    await vehicle_tracker.start()
+    realtime_hub.start()
+    global face_events_task
+    face_events_task = asyncio.create_task(forward_face_results())
+    if CAMERA_PIPELINE_ENABLED:
+        await camera_pipeline.sync()
+
+@app.on_event("shutdown")
+async def shutdown():
+    if face_events_task is not None:
+        face_events_task.cancel()
+    await realtime_hub.stop()
+    await camera_pipeline.stop()
+    await network_scanner.stop()
+    face_executor.shutdown()
+    auth.password_hasher.shutdown()
+    await edge_impulse_outbox.stop()
+    await metrics_store.stop()
+    await dashboard_stats.stop()
+    await vehicle_tracker.stop()
+    await edge_impulse_client.aclose()
+    await redis_client.close()
+    await dispose()
+
+async def run_face_task(method: str, *args):
+    """Yüz tanıma işini olay döngüsünü bloklamadan işçi havuzunda çalıştır"""
+    try:
+        return await face_executor.run(method, *args)
+    except FaceServiceBusy:
+        raise HTTPException(status_code=429, detail="Face service busy, try again later")
+    except FaceServiceUnavailable:
+        raise HTTPException(status_code=503, detail="Face service restarting, try again later",
+                            headers={"Retry-After": "1"})
+
+def detection_options(profile, roi) -> tuple:
+    """İstekteki profil ve ROI değerlerini doğrula"""
+    profile = profile or DEFAULT_DETECTION_PROFILE
+    if profile not in DETECTION_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile, expected one of {list(DETECTION_PROFILES)}")
+    try:
+        return profile, parse_roi(roi)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid roi: {e}")
+
+async def detect_frames(frames: list, profile: str = DEFAULT_DETECTION_PROFILE, roi: tuple = None,
+                        top_k: int = 1) -> list:
+    """Önbellekte olmayan karelerde tespiti havuzda paralel çalıştır"""
+    version = detection_cache.model_version()
+    keys = [detection_cache.make_key(frame, version, profile, roi, top_k) for frame in frames]
+    results = [detection_cache.get(key) for key in keys]
+    
+    missing = [i for i, faces in enumerate(results) if faces is None]
+    if missing:
+        try:
+            computed = await face_executor.run_many("detect_faces_bytes", [(frames[i], profile, roi, top_k) for i in missing])
+        except FaceServiceBusy:
+            raise HTTPException(status_code=429, detail="Face service busy, try again later")
+        except FaceServiceUnavailable:
+            raise HTTPException(status_code=503, detail="Face service restarting, try again later",
+                                headers={"Retry-After": "1"})
+        
+        for i, faces in zip(missing, computed):
+            results[i] = faces
+            if faces is not None:
+                detection_cache.put(keys[i], faces)
+    
+    return results
+
+def split_length_prefixed(body: bytes) -> list:
+    """[4 bayt big-endian uzunluk][görüntü] dizisini kopyasız parçalara ayır"""
+    view = memoryview(body)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if offset + 4 > len(view):
+            raise HTTPException(status_code=400, detail="Truncated length prefix")
+        (length,) = struct.unpack_from(">I", view, offset)
+        offset += 4
+        if offset + length > len(view):
+            raise HTTPException(status_code=400, detail="Truncated image data")
+        frames.append(view[offset:offset + length])
+        offset += length
+    return frames
+
 # Auth dependency
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: Session = Depends(get_db)):
-    return auth.verify_token(credentials.credentials, db)
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security), db: AsyncSession = Depends(get_async_db)):
+    return await auth.verify_token(credentials.credentials, db)
 
 @app.get("/")
 async def root():
@@ -46,58 +179,272 @@ async def health_check():
     return {"status": "healthy", "version": "1.0.0"}
 
 # Auth endpoints
+async def run_password_task(coro):
+    """Parola havuzu doluysa bekletmeden 503 döndür"""
+    try:
+        return await coro
+    except auth.PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="Authentication service busy, try again later",
+                            headers={"Retry-After": "1"})
+
 @app.post("/auth/login")
-async def login(credentials: dict, db: Session = Depends(get_db)):
-    return auth.authenticate_user(credentials["username"], credentials["password"], db)
+async def login(credentials: dict, db: AsyncSession = Depends(get_async_db)):
+    return await run_password_task(auth.authenticate_user(credentials["username"], credentials["password"], db))
 
 @app.post("/auth/register")
-async def register(user_data: dict, db: Session = Depends(get_db)):
-    return auth.create_user(user_data, db)
+async def register(user_data: dict, db: AsyncSession = Depends(get_async_db)):
+    return await run_password_task(auth.create_user(user_data, db))
+
+@app.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await auth.logout_user(credentials.credentials)
+
+@app.get("/auth/hasher/stats")
+async def auth_hasher_stats(current_user = Depends(get_current_user)):
+    return auth.password_hasher.get_stats()
+
+@app.get("/auth/cache/stats")
+async def auth_cache_stats(current_user = Depends(get_current_user)):
+    return user_cache.get_stats()
 
 # Dashboard endpoints
 @app.get("/dashboard/stats")
-async def dashboard_stats(current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_dashboard_stats(current_user = Depends(get_current_user)):
+    # Sayaçlar değişiklikte güncellenir; her yoklamada COUNT sorgusu çalışmaz
     return {
-        "total_devices": 0,
-        "online_devices": 0,
-        "total_users": 1,
-        "active_sessions": 1,
+        **(await dashboard_stats.read()),
         "system_health": "good"
     }
 
+@app.get("/dashboard/stats/status")
+async def dashboard_stats_status(current_user = Depends(get_current_user)):
+    return dashboard_stats.get_stats()
+
+# Metrics endpoints
+def parse_time(value: str, name: str):
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {name}, expected ISO 8601")
+    # Zaman damgaları UTC ve saat dilimsiz saklanır
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+@app.get("/metrics/{device_name}")
+async def get_device_metrics(device_name: str, metrics: str = "cpu,ram,disk", start: str = None, end: str = None,
+                             resolution: str = None, current_user = Depends(get_current_user)):
+    end_time = parse_time(end, "end") if end else datetime.utcnow()
+    start_time = parse_time(start, "start") if start else end_time - timedelta(hours=1)
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if resolution and resolution != "raw" and resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown resolution, expected raw or one of {list(ROLLUP_RESOLUTIONS)}")
+
+    metric_names = [m for m in metrics.split(",") if m]
+    return await asyncio.to_thread(metrics_store.query, device_name, metric_names, start_time, end_time, resolution)
+
 # Device endpoints
 @app.get("/devices")
-async def get_devices(current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return []
+@response_cache.cached(tags=("devices",), ttl=15)
+async def get_devices(request: Request, cursor: str = None, limit: int = LIST_DEFAULT_LIMIT, fields: str = None,
+                      user_id: int = None, status: str = None,
+                      current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await list_page(request, db, models.Device, cursor, limit, fields,
+                           owner_filter(current_user, user_id), status)
+
+DEVICE_FIELDS = ("name", "device_type", "ip_address", "mac_address", "location", "status")
 
 @app.post("/devices")
-async def create_device(device_data: dict, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return {"message": "Device created", "id": 1}
+async def create_device(device_data: dict, current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    if not device_data.get("name"):
+        raise HTTPException(status_code=400, detail="name required")
+    unknown = [key for key in device_data if key not in DEVICE_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields {unknown}, expected any of {list(DEVICE_FIELDS)}")
+
+    # ORM ekleme: pano sayaçları after_flush olayıyla güncellenir
+    device = models.Device(**device_data, user_id=current_user.id)
+    db.add(device)
+    # Kimlik commit öncesi alınır; commit sonrası erişim bağlantıyı yeniden tutar
+    await db.flush()
+    device_id = device.id
+    await db.commit()
+
+    await response_cache.invalidate("devices")
+    return {"message": "Device created", "id": device_id}
+
+# Bulk import/export endpoints
+def bulk_options(entity: str, format: str = None, content_type: str = None) -> str:
+    if entity not in bulk_io.ENTITIES:
+        raise HTTPException(status_code=404, detail=f"Unknown entity, expected one of {list(bulk_io.ENTITIES)}")
+    try:
+        return bulk_io.detect_format(format, content_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/bulk/{entity}/import")
+async def bulk_import(entity: str, request: Request, format: str = None, current_user = Depends(get_current_user)):
+    """CSV (başlıklı) ya da NDJSON gövdeyi akış halinde içe aktar; satır hatalarını raporla"""
+    fmt = bulk_options(entity, format, request.headers.get("content-type"))
+    try:
+        report = await bulk_io.import_rows(entity, fmt, request.stream(), current_user.id, bool(current_user.is_admin))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be UTF-8 encoded")
+    if report["inserted"]:
+        await response_cache.invalidate(entity)
+    return report
+
+@app.get("/bulk/{entity}/export")
+async def bulk_export(entity: str, format: str = "ndjson", fields: str = None, user_id: int = None, status: str = None,
+                      current_user = Depends(get_current_user)):
+    fmt = bulk_options(entity, format)
+    model = bulk_io.get_model(entity)
+    # Alanlar ve sahip akış başlamadan doğrulanır; akış içindeki hata 200 sonrası yakalanamaz
+    parse_fields(model, fields)
+    user_id = owner_filter(current_user, user_id)
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        bulk_io.export_rows(entity, fmt, current_user.id, bool(current_user.is_admin), fields, user_id, status),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{entity}.{fmt}"'}
+    )
+
+@app.get("/bulk/stats")
+async def bulk_stats(current_user = Depends(get_current_user)):
+    return {"recent": list(bulk_io.recent_runs)}
 
 # Network endpoints
+def start_network_scan(cidr: str = None, ports: str = None, user_id: int = None):
+    """Arka plan taramasını başlat (ya da süren taramayı döndür); bulunan cihazlar user_id'ye yazılır"""
+    try:
+        port_list = [int(p) for p in ports.split(",")] if ports else None
+        if port_list and any(not 0 < p < 65536 for p in port_list):
+            raise ValueError("Ports must be between 1 and 65535")
+        return network_scanner.start_scan(cidr, port_list, user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 @app.get("/network/scan")
-async def network_scan(current_user = Depends(get_current_user)):
-    return {"devices": [], "scan_time": "2026-01-22T07:30:00Z"}
+async def network_scan(cidr: str = None, ports: str = None, refresh: bool = False,
+                       current_user = Depends(get_current_user)):
+    # Son sonuç anında döner; eskiyse veya istenirse yeni tarama arka planda başlar
+    if refresh or cidr or network_scanner.is_stale():
+        start_network_scan(cidr, ports, current_user.id)
+
+    last = network_scanner.last
+    return {
+        "devices": last.hosts if last else [],
+        "scan_time": last.finished_at.isoformat() + "Z" if last else None,
+        "scan": network_scanner.current.summary() if network_scanner.current else (last.summary() if last else None)
+    }
+
+@app.get("/network/scan/stream")
+async def network_scan_stream(cidr: str = None, ports: str = None, current_user = Depends(get_current_user)):
+    """Taramayı başlat/katıl ve bulunan hostları NDJSON olarak akıt"""
+    job = start_network_scan(cidr, ports, current_user.id)
+
+    async def stream():
+        async for host in job.follow():
+            yield json.dumps(host) + "\n"
+        yield json.dumps({"scan": job.summary()}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 # CRM endpoints
 @app.get("/crm/customers")
-async def get_customers(current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return []
+async def get_customers(request: Request, cursor: str = None, limit: int = LIST_DEFAULT_LIMIT, fields: str = None,
+                        user_id: int = None, status: str = None,
+                        current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await list_page(request, db, models.Customer, cursor, limit, fields,
+                           owner_filter(current_user, user_id), status)
 
 # Vehicle tracking endpoints
 @app.get("/vehicles")
-async def get_vehicles(current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return []
+async def get_vehicles(request: Request, cursor: str = None, limit: int = LIST_DEFAULT_LIMIT, fields: str = None,
+                       user_id: int = None, status: str = None,
+                       current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await list_page(request, db, models.Vehicle, cursor, limit, fields,
+                           owner_filter(current_user, user_id), status)
+
+@app.post("/vehicles/positions")
+async def ingest_vehicle_positions(body: dict, current_user = Depends(get_current_user)):
+    """{"fixes": [{"gps_device_id" | "vehicle_id", "lat", "lng", "ts"?, "speed"?, "heading"?}, ...]}
+
+    Yönetici dışındaki kullanıcılar yalnızca kendi araçlarının konumlarını gönderebilir.
+    """
+    fixes = body.get("fixes")
+    if not isinstance(fixes, list):
+        raise HTTPException(status_code=400, detail="fixes must be a list")
+    return await vehicle_tracker.ingest(fixes, owner_filter(current_user, None))
+
+@app.get("/vehicles/nearby")
+async def vehicles_nearby(lat: float, lng: float, radius_km: float = 1.0, limit: int = 100, user_id: int = None,
+                          current_user = Depends(get_current_user)):
+    # Son konumlar bellekteki ızgara indeksten okunur; tablo taranmaz
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise HTTPException(status_code=400, detail="lat/lng out of range")
+    if radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km must be positive")
+    vehicles = vehicle_tracker.index.within_radius(lat, lng, radius_km, limit, owner_filter(current_user, user_id))
+    return {"vehicles": vehicles, "count": len(vehicles)}
+
+@app.get("/vehicles/within")
+async def vehicles_within(min_lat: float, min_lng: float, max_lat: float, max_lng: float, limit: int = 1000,
+                          user_id: int = None, current_user = Depends(get_current_user)):
+    if min_lat > max_lat or min_lng > max_lng:
+        raise HTTPException(status_code=400, detail="min values must not exceed max values")
+    vehicles = vehicle_tracker.index.within_bbox(min_lat, min_lng, max_lat, max_lng, limit,
+                                                 owner_filter(current_user, user_id))
+    return {"vehicles": vehicles, "count": len(vehicles)}
+
+@app.get("/vehicles/tracking/stats")
+async def vehicle_tracking_stats(current_user = Depends(get_current_user)):
+    return vehicle_tracker.get_stats()
+
+@app.get("/vehicles/{vehicle_id}/track")
+async def vehicle_track(vehicle_id: int, start: str = None, end: str = None, limit: int = 5000,
+                        current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    vehicle = await db.get(models.Vehicle, vehicle_id)
+    if vehicle is None or not (current_user.is_admin or vehicle.user_id == current_user.id):
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    end_time = parse_time(end, "end") if end else datetime.utcnow()
+    start_time = parse_time(start, "start") if start else end_time - timedelta(hours=1)
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    points = await asyncio.to_thread(vehicle_tracker.track, vehicle_id, start_time, end_time, limit)
+    return {"vehicle_id": vehicle_id, "last": vehicle_tracker.index.get(vehicle_id), "points": points}
 
 # PBX endpoints
 @app.get("/pbx/status")
+@response_cache.cached(ttl=5, per_user=False)
 async def pbx_status(current_user = Depends(get_current_user)):
     return {"status": "running", "extensions": 0, "active_calls": 0}
 
 # Camera endpoints
 @app.get("/cameras")
-async def get_cameras(current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return []
+@response_cache.cached(tags=("cameras",), ttl=30)
+async def get_cameras(request: Request, cursor: str = None, limit: int = LIST_DEFAULT_LIMIT, fields: str = None,
+                      user_id: int = None, status: str = None,
+                      current_user = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
+    return await list_page(request, db, models.Camera, cursor, limit, fields,
+                           owner_filter(current_user, user_id), status)
+
+@app.get("/cameras/analytics")
+async def get_camera_analytics(current_user = Depends(get_current_user)):
+    """Kamera analiz hattı durumu ve son sonuçlar"""
+    return {
+        "cameras": camera_pipeline.get_status(),
+        "results": list(camera_pipeline.results.values())
+    }
+
+@app.post("/cameras/analytics/sync")
+async def sync_camera_analytics(current_user = Depends(get_current_user)):
+    """Analiz hattını Camera tablosuyla yeniden eşitle"""
+    await camera_pipeline.sync()
+    return {"message": "Camera pipeline synced", "cameras": len(camera_pipeline.readers)}
 
 # Face Recognition endpoints
 @app.post("/face/detect")
@@ -106,9 +453,49 @@ async def detect_faces(data: dict, current_user = Depends(get_current_user)):
     if 'image' not in data:
         raise HTTPException(status_code=400, detail="Image data required")
     
-    faces = face_service.detect_faces(data['image'])
+    profile, roi = detection_options(data.get('profile'), data.get('roi'))
+    top_k = max(1, min(int(data.get('top_k', 1)), 10))
+    image_data = data['image']
+    try:
+        image_bytes = base64.b64decode(image_data.split(',')[1] if ',' in image_data else image_data)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid base64 image")
+    
+    faces = (await detect_frames([image_bytes], profile, roi, top_k))[0] or []
     return {"faces": faces, "count": len(faces)}
 
+@app.post("/face/detect/batch")
+async def detect_faces_batch(request: Request, profile: str = None, roi: str = None,
+                             current_user = Depends(get_current_user)):
+    """Birden çok görüntüde toplu yüz tespiti.
+    
+    multipart/form-data (her dosya bir görüntü) ya da application/octet-stream
+    gövdesinde uzunluk önekli ham görüntüler kabul eder. Profil ve ROI
+    ("x,y,w,h") sorgu parametresi olarak verilir.
+    """
+    profile, roi = detection_options(profile, roi)
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        frames = [await item.read() for _, item in form.multi_items() if hasattr(item, "read")]
+    else:
+        frames = split_length_prefixed(await request.body())
+    
+    if not frames:
+        raise HTTPException(status_code=400, detail="At least one image required")
+    if len(frames) > FACE_BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=413, detail=f"At most {FACE_BATCH_MAX_IMAGES} images per batch")
+    
+    batch = await detect_frames(frames, profile, roi)
+    
+    results = []
+    for index, faces in enumerate(batch):
+        if faces is None:
+            results.append({"index": index, "error": "Invalid image"})
+        else:
+            results.append({"index": index, "faces": faces, "count": len(faces)})
+    return {"results": results, "count": len(results)}
+
 @app.post("/face/add")
 async def add_face(data: dict, current_user = Depends(get_current_user)):
     """Yeni yüz ekle"""
@@ -117,46 +504,224 @@ async def add_face(data: dict, current_user = Depends(get_current_user)):
         if field not in data:
             raise HTTPException(status_code=400, detail=f"{field} required")
     
-    success = face_service.add_face(data['image'], data['person_name'], data['person_id'])
+    success = await run_face_task("add_face", data['image'], data['person_name'], data['person_id'])
     if success:
+        await response_cache.invalidate("faces")
         return {"message": "Face added successfully", "person_id": data['person_id']}
     else:
         raise HTTPException(status_code=400, detail="Failed to add face")
 
 @app.get("/face/registered")
+@response_cache.cached(tags=("faces",), ttl=300)
 async def get_registered_faces(current_user = Depends(get_current_user)):
     """Kayıtlı yüzlerin listesini getir"""
-    faces = face_service.get_registered_faces()
+    faces = await run_face_task("get_registered_faces")
     return {"registered_faces": faces}
 
+@app.put("/face/{person_id}/threshold")
+async def set_face_threshold(person_id: int, data: dict, current_user = Depends(get_current_user)):
+    """Kişiye özel eşleşme eşiğini ayarla (vektör motoru, null varsayılana döner)"""
+    threshold = data.get('threshold')
+    success = await run_face_task("set_threshold", person_id, None if threshold is None else float(threshold))
+    if success:
+        await response_cache.invalidate("faces")
+        return {"message": "Threshold updated", "person_id": person_id, "threshold": threshold}
+    else:
+        raise HTTPException(status_code=404, detail="Face not found")
+
 @app.delete("/face/{person_id}")
 async def delete_face(person_id: int, current_user = Depends(get_current_user)):
     """Kayıtlı yüzü sil"""
-    success = face_service.delete_face(person_id)
+    success = await run_face_task("delete_face", person_id)
     if success:
+        await response_cache.invalidate("faces")
         return {"message": "Face deleted successfully"}
     else:
         raise HTTPException(status_code=404, detail="Face not found")
 
+@app.get("/face/model")
+async def face_model_info(current_user = Depends(get_current_user)):
+    """Geçerli yüz tanıma modeli sürümü"""
+    return await run_face_task("get_model_info")
+
+@app.get("/cache/stats")
+async def response_cache_stats(current_user = Depends(get_current_user)):
+    """Uç nokta yanıt önbelleği istatistikleri"""
+    return response_cache.get_stats()
+
+@app.get("/face/cache/stats")
+async def face_cache_stats(current_user = Depends(get_current_user)):
+    """Yüz tespiti sonuç önbelleği istatistikleri"""
+    return detection_cache.get_stats()
+
+@app.get("/face/executor/stats")
+async def face_executor_stats(current_user = Depends(get_current_user)):
+    """Yüz tanıma işçi havuzu durumu"""
+    return face_executor.get_stats()
+
 @app.post("/face/train")
 async def train_model(current_user = Depends(get_current_user)):
     """Yüz tanıma modelini yeniden eğit"""
-    success = face_service.train_model()
+    success = await run_face_task("train_model")
     if success:
+        await response_cache.invalidate("faces")
         return {"message": "Model trained successfully"}
     else:
         raise HTTPException(status_code=400, detail="Training failed - no faces registered")
 
 # WebSocket endpoint
+@app.get("/ws/stats")
+async def websocket_stats(current_user = Depends(get_current_user)):
+    """Canlı yayın bağlantıları, abone sayıları ve kuyruk derinlikleri"""
+    return realtime_hub.get_stats()
+
+async def authenticate_websocket(websocket: WebSocket, token: str):
+    """Token geçersizse bağlantıyı 1008 ile kapat; kullanıcıyı ya da None döndür"""
+    try:
+        async with AsyncSessionLocal() as db:
+            return await auth.verify_token(token or "", db)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return None
+
 @app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+async def websocket_endpoint(websocket: WebSocket, token: str = None, topics: str = None):
+    """Canlı olaylar: {"action": "subscribe"|"unsubscribe", "topics": [...]} ile konu seçilir.
+
+    Her çerçeve mesaj dizisidir: [{"topic", "key", "data", "ts"}, ...]; istemci
+    geride kalırsa aynı anahtarın bekleyen eski güncellemesi yenisiyle değiştirilir.
+    """
+    user = await authenticate_websocket(websocket, token)
+    if user is None:
+        return
+
+    client = realtime_hub.add_client(websocket, user)
+    if client is None:
+        await websocket.close(code=1013)
+        return
     await websocket.accept()
+    sender = asyncio.create_task(client.sender())
+    replies = 0
+
+    def reply(message: dict):
+        nonlocal replies
+        replies += 1
+        client.offer("control", str(replies), json.dumps(message))
+
+    try:
+        if topics:
+            try:
+                reply({"subscribed": realtime_hub.subscribe(client, topics.split(","))})
+            except ValueError as e:
+                reply({"error": str(e)})
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                action = message.get("action")
+                requested = message.get("topics") or []
+                if action == "subscribe":
+                    reply({"subscribed": realtime_hub.subscribe(client, requested)})
+                elif action == "unsubscribe":
+                    reply({"subscribed": realtime_hub.unsubscribe(client, requested)})
+                elif action == "ping":
+                    reply({"pong": True})
+                else:
+                    reply({"error": "Unknown action, expected subscribe, unsubscribe or ping"})
+            except (ValueError, AttributeError, TypeError) as e:
+                reply({"error": f"Invalid message: {e}"})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        realtime_hub.remove_client(client)
+        sender.cancel()
+
+@app.websocket("/ws/face")
+async def face_stream(websocket: WebSocket, token: str = None, profile: str = None, roi: str = None,
+                      top_k: int = 1):
+    """İkili JPEG kareleri al, yalnızca en yeni karede yüz tespiti yap.
+
+    Kare kimliği bu bağlantıdaki ikili mesaj sırasıdır (1'den başlar). Tespit
+    sürerken gelen kareler kuyruğa alınmaz; bekleyen kare yenisiyle değiştirilir
+    ve atlanmış sayılır. Yanıt: {"frame_id", "faces", "count", "latency_ms",
+    "processing_ms", "skipped"}.
+    """
+    if await authenticate_websocket(websocket, token) is None:
+        return
+    try:
+        profile, roi = detection_options(profile or FACE_STREAM_PROFILE, roi)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
+    top_k = max(1, min(top_k, 10))
+    await websocket.accept()
+
+    latest = None  # (kare kimliği, JPEG, alınma zamanı)
+    frame_ready = asyncio.Event()
+    send_lock = asyncio.Lock()
+    counters = {"received": 0, "processed": 0, "skipped": 0}
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_text(json.dumps(message))
+
+    async def detector():
+        nonlocal latest
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            frame_id, frame, received_at = latest
+            latest = None
+            started = time.perf_counter()
+            try:
+                faces = (await detect_frames([frame], profile, roi, top_k))[0]
+            except HTTPException:
+                # Yüz servisi meşgul: kare atlanır, bir sonraki kare denenir
+                counters["skipped"] += 1
+                await send({"frame_id": frame_id, "error": "busy", "skipped": counters["skipped"]})
+                continue
+            except Exception as e:
+                print(f"Canlı yüz tespiti hatası: {e}")
+                await send({"frame_id": frame_id, "error": "Detection failed", "skipped": counters["skipped"]})
+                continue
+            done = time.perf_counter()
+            counters["processed"] += 1
+            if faces is None:
+                await send({"frame_id": frame_id, "error": "Invalid image", "skipped": counters["skipped"]})
+                continue
+            await send({
+                "frame_id": frame_id,
+                "faces": faces,
+                "count": len(faces),
+                "latency_ms": round((done - received_at) * 1000, 1),
+                "processing_ms": round((done - started) * 1000, 1),
+                "skipped": counters["skipped"]
+            })
+
+    task = asyncio.create_task(detector())
     try:
         while True:
-            data = await websocket.receive_text()
-            await websocket.send_text(f"Echo: {data}")
-    except:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            frame = message.get("bytes")
+            if frame is None:
+                if message.get("text") == "stats":
+                    await send({"stats": counters})
+                continue
+            counters["received"] += 1
+            if len(frame) > FACE_STREAM_MAX_FRAME_BYTES:
+                counters["skipped"] += 1
+                await send({"frame_id": counters["received"], "error": "Frame too large"})
+                continue
+            if latest is not None:
+                # Önceki kare henüz işlenmedi: yalnızca en yenisi tutulur
+                counters["skipped"] += 1
+            latest = (counters["received"], frame, time.perf_counter())
+            frame_ready.set()
+    except (WebSocketDisconnect, RuntimeError):
         pass
+    finally:
+        task.cancel()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,341 @@
+import asyncio
+import math
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from database import SessionLocal, engine
+import models
+
+# Ham örnekler bu boyuta ulaşınca ya da bu aralıkta bir toplu yazılır
+METRICS_FLUSH_SIZE = int(os.getenv("METRICS_FLUSH_SIZE", "1000"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "5"))
+# Veritabanına yazılamazken bellekte tutulacak en fazla satır; aşılırsa en eskiler düşer
+METRICS_MAX_BUFFER = int(os.getenv("METRICS_MAX_BUFFER", "100000"))
+# Saklama süreleri (gün)
+METRICS_RAW_RETENTION_DAYS = float(os.getenv("METRICS_RAW_RETENTION_DAYS", "7"))
+METRICS_1M_RETENTION_DAYS = float(os.getenv("METRICS_1M_RETENTION_DAYS", "30"))
+METRICS_1H_RETENTION_DAYS = float(os.getenv("METRICS_1H_RETENTION_DAYS", "730"))
+METRICS_RETENTION_INTERVAL = float(os.getenv("METRICS_RETENTION_INTERVAL", "3600"))
+# Sorguda hedeflenen en fazla nokta sayısı; çözünürlük buna göre seçilir
+METRICS_MAX_POINTS = int(os.getenv("METRICS_MAX_POINTS", "2000"))
+
+ROLLUP_RESOLUTIONS = {
+    "1m": timedelta(minutes=1),
+    "1h": timedelta(hours=1),
+}
+RETENTION = {
+    "raw": timedelta(days=METRICS_RAW_RETENTION_DAYS),
+    "1m": timedelta(days=METRICS_1M_RETENTION_DAYS),
+    "1h": timedelta(days=METRICS_1H_RETENTION_DAYS),
+}
+
+
+def bucket_start(ts: datetime, resolution: str) -> datetime:
+    if resolution == "1m":
+        return ts.replace(second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def choose_resolution(start: datetime, end: datetime, now: Optional[datetime] = None, allow_raw: bool = True) -> str:
+    """Aralığı METRICS_MAX_POINTS noktayla karşılayabilecek en ince çözünürlük.
+
+    Ham örneklerin gerçek sıklığı bilinmez (30 sn'lik DeviceMonitor varsayılanı
+    yalnızca ön eleme içindir); query() ham seçimi satır sayısıyla doğrular.
+    """
+    now = now or datetime.utcnow()
+    span = end - start
+    if allow_raw and start >= now - RETENTION["raw"] and span <= timedelta(seconds=30) * METRICS_MAX_POINTS:
+        return "raw"
+    if start >= now - RETENTION["1m"] and span <= ROLLUP_RESOLUTIONS["1m"] * METRICS_MAX_POINTS:
+        return "1m"
+    return "1h"
+
+
+class MetricsStore:
+    """Cihaz metriklerini toplu yazan, yazarken dakikalık/saatlik özetleri güncelleyen depo"""
+
+    def __init__(self):
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_event: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def record(self, device_name: str, values: Dict[str, float], ts: Optional[datetime] = None):
+        """Örneği belleğe al; veritabanına arka planda toplu yazılır"""
+        ts = ts or datetime.utcnow()
+        rows = []
+        for metric, value in values.items():
+            if value is None:
+                continue
+            value = float(value)
+            # NaN/sonsuz değerler özetleri bozar ve bazı veritabanlarında yazılamaz
+            if not math.isfinite(value):
+                self.rejected += 1
+                continue
+            rows.append({"device_name": device_name, "metric": metric, "ts": ts, "value": value})
+        with self._lock:
+            self._buffer.extend(rows)
+            self._trim_buffer()
+            full = len(self._buffer) >= METRICS_FLUSH_SIZE
+        if full and self._flush_event is not None:
+            self._flush_event.set()
+
+    def _trim_buffer(self):
+        """Kilit altında çağrılır; sınırı aşan en eski örnekler düşer"""
+        if len(self._buffer) > METRICS_MAX_BUFFER:
+            self.dropped += len(self._buffer) - METRICS_MAX_BUFFER
+            del self._buffer[:len(self._buffer) - METRICS_MAX_BUFFER]
+
+    def flush(self) -> int:
+        """Biriken ham örnekleri ve özet güncellemelerini tek işlemde yaz"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+
+        try:
+            self._write(rows)
+        except (DataError, IntegrityError) as e:
+            # Kalıcı hata: yeniden denemek tüm yazımları tıkar; hatalı satırlar ayıklanıp atılır
+            print(f"Metrik yazma hatası, satırlar tek tek deneniyor: {e}")
+            written = self._write_each(rows)
+            self.flushes += 1
+            return written
+        except Exception as e:
+            print(f"Metrik yazma hatası: {e}")
+            # Geçici hata: örnekler kaybolmasın, bir sonraki turda yeniden denenir
+            with self._lock:
+                self._buffer[:0] = rows
+                self._trim_buffer()
+            return 0
+
+        self.flushes += 1
+        return len(rows)
+
+    def _write(self, rows: List[Dict]):
+        rollups = {}
+        for row in rows:
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (row["device_name"], row["metric"], resolution, bucket_start(row["ts"], resolution))
+                value = row["value"]
+                current = rollups.get(key)
+                if current is None:
+                    rollups[key] = [value, value, value, 1]
+                else:
+                    current[0] = min(current[0], value)
+                    current[1] = max(current[1], value)
+                    current[2] += value
+                    current[3] += 1
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(models.DeviceMetric), rows)
+            self._upsert_rollups(db, rollups)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.written += len(rows)
+
+    def _write_each(self, rows: List[Dict]) -> int:
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                self._write([row])
+                written += 1
+            except (DataError, IntegrityError) as e:
+                self.rejected += 1
+                print(f"Metrik satırı atıldı ({row['device_name']}/{row['metric']}): {e}")
+            except Exception as e:
+                # Ayıklama sırasında bağlantı koptu: kalanlar sonraki turda yeniden denenir
+                print(f"Metrik yazma hatası: {e}")
+                with self._lock:
+                    self._buffer[:0] = rows[i:]
+                    self._trim_buffer()
+                break
+        return written
+
+    def _upsert_rollups(self, db, rollups: Dict[tuple, list]):
+        table = models.DeviceMetricRollup.__table__
+        values = [{
+            "device_name": device_name, "metric": metric, "resolution": resolution, "bucket": bucket,
+            "min_value": agg[0], "max_value": agg[1], "sum_value": agg[2], "count": agg[3]
+        } for (device_name, metric, resolution, bucket), agg in rollups.items()]
+
+        dialect = engine.dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as upsert
+                least, greatest = func.least, func.greatest
+            else:
+                from sqlalchemy.dialects.sqlite import insert as upsert
+                least, greatest = func.min, func.max
+            stmt = upsert(table)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=["device_name", "metric", "resolution", "bucket"],
+                set_={
+                    "min_value": least(table.c.min_value, stmt.excluded.min_value),
+                    "max_value": greatest(table.c.max_value, stmt.excluded.max_value),
+                    "sum_value": table.c.sum_value + stmt.excluded.sum_value,
+                    "count": table.c.count + stmt.excluded.count,
+                }
+            )
+            db.execute(stmt, values)
+            return
+
+        # Diğer veritabanları: oku-birleştir-yaz
+        for row in values:
+            existing = db.query(models.DeviceMetricRollup).filter_by(
+                device_name=row["device_name"], metric=row["metric"],
+                resolution=row["resolution"], bucket=row["bucket"]
+            ).with_for_update().first()
+            if existing is None:
+                db.add(models.DeviceMetricRollup(**row))
+            else:
+                existing.min_value = min(existing.min_value, row["min_value"])
+                existing.max_value = max(existing.max_value, row["max_value"])
+                existing.sum_value += row["sum_value"]
+                existing.count += row["count"]
+
+    def apply_retention(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Saklama süresini aşan ham ve özet satırlarını sil"""
+        now = now or datetime.utcnow()
+        removed = {}
+        db = SessionLocal()
+        try:
+            result = db.execute(delete(models.DeviceMetric).where(models.DeviceMetric.ts < now - RETENTION["raw"]))
+            removed["raw"] = result.rowcount
+            for resolution in ROLLUP_RESOLUTIONS:
+                result = db.execute(delete(models.DeviceMetricRollup).where(
+                    models.DeviceMetricRollup.resolution == resolution,
+                    models.DeviceMetricRollup.bucket < now - RETENTION[resolution]
+                ))
+                removed[resolution] = result.rowcount
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Metrik saklama hatası: {e}")
+        finally:
+            db.close()
+        return removed
+
+    def query(self, device_name: str, metrics: List[str], start: datetime, end: datetime,
+              resolution: Optional[str] = None) -> Dict:
+        """Aralıktaki noktalar; çözünürlük verilmezse pencereye göre seçilir.
+
+        Ham seri metrik başına en fazla METRICS_MAX_POINTS nokta döner; fazlası
+        varsa otomatik seçimde özete geçilir, açıkça raw istendiyse kesilir.
+        """
+        auto = resolution is None
+        resolution = resolution or choose_resolution(start, end)
+        series = {metric: [] for metric in metrics}
+        truncated = False
+        db = SessionLocal()
+        try:
+            if resolution == "raw":
+                table = models.DeviceMetric
+                where = (table.device_name == device_name, table.ts >= start, table.ts < end)
+                if auto:
+                    # Örnek sıklığı sabit değil; ham seçim gerçek yoğunlukla doğrulanır
+                    densest = db.execute(
+                        select(func.count()).select_from(table).where(*where, table.metric.in_(metrics))
+                        .group_by(table.metric).order_by(func.count().desc()).limit(1)
+                    ).scalar() or 0
+                    if densest > METRICS_MAX_POINTS:
+                        resolution = choose_resolution(start, end, allow_raw=False)
+            if resolution == "raw":
+                for metric in metrics:
+                    rows = db.execute(
+                        select(table.ts, table.value)
+                        .where(*where, table.metric == metric)
+                        .order_by(table.ts)
+                        .limit(METRICS_MAX_POINTS + 1)
+                    ).all()
+                    if len(rows) > METRICS_MAX_POINTS:
+                        truncated = True
+                        rows = rows[:METRICS_MAX_POINTS]
+                    series[metric] = [{"ts": ts.isoformat() + "Z", "value": value} for ts, value in rows]
+            else:
+                table = models.DeviceMetricRollup
+                rows = db.execute(
+                    select(table.metric, table.bucket, table.min_value, table.max_value, table.sum_value, table.count)
+                    .where(table.device_name == device_name, table.metric.in_(metrics),
+                           table.resolution == resolution, table.bucket >= bucket_start(start, resolution),
+                           table.bucket < end)
+                    .order_by(table.metric, table.bucket)
+                ).all()
+                for metric, bucket, min_value, max_value, sum_value, count in rows:
+                    series[metric].append({
+                        "ts": bucket.isoformat() + "Z",
+                        "min": min_value,
+                        "max": max_value,
+                        "avg": sum_value / count if count else None,
+                        "count": count
+                    })
+        finally:
+            db.close()
+
+        return {
+            "device_name": device_name,
+            "resolution": resolution,
+            "start": start.isoformat() + "Z",
+            "end": end.isoformat() + "Z",
+            "truncated": truncated,
+            "series": series
+        }
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), METRICS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await asyncio.to_thread(self.flush)
+
+    async def _retention_loop(self):
+        while True:
+            await asyncio.to_thread(self.apply_retention)
+            await asyncio.sleep(METRICS_RETENTION_INTERVAL)
+
+    def start(self):
+        if not self._tasks:
+            self._flush_event = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._retention_loop())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Kapanışta bellekte kalan örnekleri yaz
+        await asyncio.to_thread(self.flush)
+
+    def get_stats(self) -> Dict:
+        return {
+            "buffered": len(self._buffer),
+            "written": self.written,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "max_buffer": METRICS_MAX_BUFFER
+        }
+
+
+# Global metrik deposu instance
+metrics_store = MetricsStore()
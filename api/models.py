@@ -1,9 +1,7 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Float, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Text, Float, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
-
-Base = declarative_base()
+from database import Base
 
 class User(Base):
     __tablename__ = "users"
@@ -20,6 +18,11 @@ class User(Base):
 
 class Device(Base):
     __tablename__ = "devices"
+    # Liste uç noktalarındaki anahtar kümesi sayfalama (id azalan) filtreleri için
+    __table_args__ = (
+        Index("ix_devices_user_id_id", "user_id", "id"),
+        Index("ix_devices_status_id", "status", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
@@ -34,6 +37,11 @@ class Device(Base):
 
 class Customer(Base):
     __tablename__ = "customers"
+    # Liste uç noktalarındaki anahtar kümesi sayfalama (id azalan) filtreleri için
+    __table_args__ = (
+        Index("ix_customers_user_id_id", "user_id", "id"),
+        Index("ix_customers_status_id", "status", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
@@ -47,6 +55,11 @@ class Customer(Base):
 
 class Vehicle(Base):
     __tablename__ = "vehicles"
+    # Liste uç noktalarındaki anahtar kümesi sayfalama (id azalan) filtreleri için
+    __table_args__ = (
+        Index("ix_vehicles_user_id_id", "user_id", "id"),
+        Index("ix_vehicles_status_id", "status", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     plate_number = Column(String, unique=True, index=True)
@@ -64,6 +77,11 @@ class Vehicle(Base):
 
 class Camera(Base):
     __tablename__ = "cameras"
+    # Liste uç noktalarındaki anahtar kümesi sayfalama (id azalan) filtreleri için
+    __table_args__ = (
+        Index("ix_cameras_user_id_id", "user_id", "id"),
+        Index("ix_cameras_status_id", "status", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
@@ -77,3 +95,54 @@ class Camera(Base):
     status = Column(String, default="offline")
     created_at = Column(DateTime, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"))
+
+class DeviceMetric(Base):
+    """Ham metrik örnekleri (cihaz, metrik adı, zaman başına tek değer)"""
+    __tablename__ = "device_metrics"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    device_name = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    ts = Column(DateTime, nullable=False)
+    value = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_device_metrics_device_metric_ts", "device_name", "metric", "ts"),
+        Index("ix_device_metrics_ts", "ts"),
+    )
+
+class DeviceMetricRollup(Base):
+    """Dakikalık/saatlik özetler; uzun aralıklı grafikler ham tabloyu taramaz"""
+    __tablename__ = "device_metric_rollups"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    device_name = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    resolution = Column(String, nullable=False)  # 1m, 1h
+    bucket = Column(DateTime, nullable=False)
+    min_value = Column(Float, nullable=False)
+    max_value = Column(Float, nullable=False)
+    sum_value = Column(Float, nullable=False)
+    count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("device_name", "metric", "resolution", "bucket", name="uq_device_metric_rollups_key"),
+        Index("ix_device_metric_rollups_resolution_bucket", "resolution", "bucket"),
+    )
+
+class VehiclePosition(Base):
+    """Araç konum geçmişi (GPS izleyicilerinden gelen her konum)"""
+    __tablename__ = "vehicle_positions"
+
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), nullable=False)
+    ts = Column(DateTime, nullable=False)
+    lat = Column(Float, nullable=False)
+    lng = Column(Float, nullable=False)
+    speed = Column(Float)
+    heading = Column(Float)
+
+    __table_args__ = (
+        Index("ix_vehicle_positions_vehicle_ts", "vehicle_id", "ts"),
+        Index("ix_vehicle_positions_ts", "ts"),
+    )
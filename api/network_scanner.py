@@ -0,0 +1,370 @@
+import asyncio
+import ipaddress
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from dashboard_stats import record as record_stats
+from database import SessionLocal
+from realtime_hub import realtime_hub
+from response_cache import response_cache
+import models
+
+# Varsayılan taranacak ağ (boşsa yerel arayüzden bulunur)
+NETWORK_SCAN_CIDR = os.getenv("NETWORK_SCAN_CIDR", "")
+# Canlılık ve servis tespiti için denenecek TCP portları
+NETWORK_SCAN_PORTS = [int(p) for p in os.getenv("NETWORK_SCAN_PORTS", "22,80,443,445,554,3389,8000,8080").split(",") if p]
+# Aynı anda açık bağlantı denemesi sayısı ve deneme zaman aşımı (saniye)
+NETWORK_SCAN_CONCURRENCY = int(os.getenv("NETWORK_SCAN_CONCURRENCY", "1000"))
+NETWORK_SCAN_TIMEOUT = float(os.getenv("NETWORK_SCAN_TIMEOUT", "0.5"))
+# Ters DNS sorguları engelleyici olduğundan ayrı bir iş parçacığı havuzunda yapılır
+NETWORK_SCAN_RESOLVERS = int(os.getenv("NETWORK_SCAN_RESOLVERS", "64"))
+NETWORK_SCAN_MAX_HOSTS = int(os.getenv("NETWORK_SCAN_MAX_HOSTS", "4096"))
+# Son tarama sonucu bu süreden eskiyse yeni tarama arka planda başlatılır
+NETWORK_SCAN_CACHE_TTL = float(os.getenv("NETWORK_SCAN_CACHE_TTL", "300"))
+# Veritabanına toplu yazım boyutu
+NETWORK_SCAN_UPSERT_BATCH = int(os.getenv("NETWORK_SCAN_UPSERT_BATCH", "256"))
+
+ARP_TABLE_PATH = "/proc/net/arp"
+
+
+def default_cidr() -> str:
+    """Yerel IPv4 arayüzünün /24 ağı"""
+    if NETWORK_SCAN_CIDR:
+        return NETWORK_SCAN_CIDR
+    try:
+        import netifaces
+        gateway = netifaces.gateways().get('default', {}).get(netifaces.AF_INET)
+        if gateway:
+            address = netifaces.ifaddresses(gateway[1])[netifaces.AF_INET][0]
+            return str(ipaddress.ip_interface(f"{address['addr']}/{address['netmask']}").network)
+    except Exception:
+        pass
+    try:
+        # Paket gönderilmez; yalnızca çıkış arayüzünün adresi öğrenilir
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("10.255.255.255", 1))
+            local_ip = s.getsockname()[0]
+        return str(ipaddress.ip_network(f"{local_ip}/24", strict=False))
+    except OSError:
+        return "192.168.1.0/24"
+
+
+def parse_targets(cidr: str) -> List[str]:
+    """CIDR'ı taranacak adres listesine çevir (ValueError: geçersiz/çok büyük)"""
+    network = ipaddress.ip_network(cidr, strict=False)
+    if network.version != 4:
+        raise ValueError("Only IPv4 networks are supported")
+    if network.num_addresses > NETWORK_SCAN_MAX_HOSTS:
+        raise ValueError(f"Network too large, at most {NETWORK_SCAN_MAX_HOSTS} addresses")
+    hosts = list(network.hosts()) or [network.network_address]
+    return [str(host) for host in hosts]
+
+
+def read_arp_table(path: str = ARP_TABLE_PATH) -> Dict[str, str]:
+    """Çekirdeğin ARP tablosundan IP -> MAC eşlemesi"""
+    table = {}
+    try:
+        with open(path, 'r') as f:
+            next(f, None)
+            for line in f:
+                parts = line.split()
+                # Flags 0x0: çözülememiş kayıt
+                if len(parts) >= 4 and parts[2] != "0x0" and parts[3] != "00:00:00:00:00:00":
+                    table[parts[0]] = parts[3].lower()
+    except OSError:
+        pass
+    return table
+
+
+class ScanJob:
+    """Tek tarama: sonuçlar geldikçe eklenir, akış dinleyicileri uyandırılır"""
+
+    def __init__(self, cidr: str, ports: List[int], total: int, user_id: Optional[int] = None):
+        self.cidr = cidr
+        self.ports = ports
+        self.total = total
+        # Yeni bulunan cihazlar taramayı başlatan kullanıcıya yazılır
+        self.user_id = user_id
+        self.probed = 0
+        self.hosts: List[Dict] = []
+        self.started_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+        self._changed = asyncio.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.finished_at is not None
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def follow(self) -> AsyncIterator[Dict]:
+        """Bulunan hostları (önce birikmiş olanlar) tarama bitene kadar üret"""
+        index = 0
+        while True:
+            while index < len(self.hosts):
+                yield self.hosts[index]
+                index += 1
+            if self.done:
+                return
+            async with self._changed:
+                if index >= len(self.hosts) and not self.done:
+                    await self._changed.wait()
+
+    def summary(self) -> Dict:
+        return {
+            "cidr": self.cidr,
+            "status": "completed" if self.done else "running",
+            "probed": self.probed,
+            "total": self.total,
+            "found": len(self.hosts),
+            "started_at": self.started_at.isoformat() + "Z",
+            "finished_at": self.finished_at.isoformat() + "Z" if self.finished_at else None,
+            "error": self.error
+        }
+
+
+class NetworkScanner:
+    """TCP-connect ile asyncio ağ taraması; sonuçları devices tablosuna yazar.
+
+    ICMP ham soket (root) gerektirdiğinden kullanılmaz: bağlantının kabul
+    edilmesi ya da reddedilmesi (RST) hostun ayakta olduğunu gösterir.
+    """
+
+    def __init__(self, concurrency: int = NETWORK_SCAN_CONCURRENCY, timeout: float = NETWORK_SCAN_TIMEOUT):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.current: Optional[ScanJob] = None
+        self.last: Optional[ScanJob] = None
+        self._task: Optional[asyncio.Task] = None
+        self._resolver: Optional[ThreadPoolExecutor] = None
+
+    async def _probe_port(self, ip: str, port: int, semaphore: asyncio.Semaphore) -> Optional[bool]:
+        """True: açık, False: reddedildi (host ayakta), None: yanıt yok"""
+        async with semaphore:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), self.timeout)
+            except ConnectionRefusedError:
+                return False
+            except (asyncio.TimeoutError, OSError):
+                return None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+            return True
+
+    async def _resolve_hostname(self, ip: str) -> Optional[str]:
+        try:
+            if self._resolver is None:
+                self._resolver = ThreadPoolExecutor(NETWORK_SCAN_RESOLVERS, thread_name_prefix="scan-resolver")
+            loop = asyncio.get_running_loop()
+            host, _, _ = await asyncio.wait_for(loop.run_in_executor(self._resolver, socket.gethostbyaddr, ip),
+                                                self.timeout * 2)
+            return host
+        except (asyncio.TimeoutError, OSError):
+            return None
+
+    async def probe_host(self, ip: str, ports: List[int], semaphore: asyncio.Semaphore) -> Optional[Dict]:
+        results = await asyncio.gather(*(self._probe_port(ip, port, semaphore) for port in ports))
+        if all(result is None for result in results):
+            return None
+        return {
+            "ip_address": ip,
+            "open_ports": [port for port, result in zip(ports, results) if result],
+            "hostname": await self._resolve_hostname(ip)
+        }
+
+    async def _run(self, job: ScanJob, targets: List[str]):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending_upsert: List[Dict] = []
+        try:
+            # Aynı anda oluşturulan görev sayısı da sınırlı kalsın
+            probes = set()
+            target_iter = iter(targets)
+            while True:
+                for ip in target_iter:
+                    probes.add(asyncio.create_task(self.probe_host(ip, job.ports, semaphore)))
+                    if len(probes) >= self.concurrency:
+                        break
+                if not probes:
+                    break
+
+                finished, probes = await asyncio.wait(probes, return_when=asyncio.FIRST_COMPLETED)
+                arp = read_arp_table()
+                for task in finished:
+                    job.probed += 1
+                    host = task.result()
+                    if host is None:
+                        continue
+                    host["mac_address"] = arp.get(host["ip_address"])
+                    host["last_seen"] = datetime.utcnow().isoformat() + "Z"
+                    job.hosts.append(host)
+                    pending_upsert.append(host)
+                await job._notify()
+
+                if len(pending_upsert) >= NETWORK_SCAN_UPSERT_BATCH:
+                    await save_hosts(pending_upsert, job.user_id)
+                    pending_upsert = []
+
+            await save_hosts(pending_upsert, job.user_id)
+            offline = await asyncio.to_thread(mark_offline, targets, {host["ip_address"] for host in job.hosts})
+            publish_status(offline, "offline")
+            if offline:
+                await response_cache.invalidate("devices")
+        except Exception as e:
+            print(f"Ağ tarama hatası: {e}")
+            job.error = str(e)
+        finally:
+            job.finished_at = datetime.utcnow()
+            self.last = job
+            if self.current is job:
+                self.current = None
+            await job._notify()
+
+    def start_scan(self, cidr: Optional[str] = None, ports: Optional[List[int]] = None,
+                   user_id: Optional[int] = None) -> ScanJob:
+        """Arka planda tarama başlat; aynı ağ zaten taranıyorsa o işi döndür"""
+        cidr = cidr or default_cidr()
+        targets = parse_targets(cidr)
+        if self.current is not None and not self.current.done:
+            if self.current.cidr == cidr:
+                return self.current
+            raise RuntimeError("Another scan is already running")
+
+        job = ScanJob(cidr, ports or NETWORK_SCAN_PORTS, len(targets), user_id)
+        self.current = job
+        self._task = asyncio.create_task(self._run(job, targets))
+        return job
+
+    def is_stale(self) -> bool:
+        if self.last is None:
+            return True
+        age = (datetime.utcnow() - self.last.finished_at).total_seconds()
+        return age > NETWORK_SCAN_CACHE_TTL
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._resolver is not None:
+            self._resolver.shutdown(wait=False, cancel_futures=True)
+            self._resolver = None
+
+
+def publish_status(ips: List[str], status: str):
+    """Durumu değişen cihazları canlı panele bildir"""
+    realtime_hub.publish_many("devices", [(ip, {"ip_address": ip, "status": status}) for ip in ips])
+
+
+async def save_hosts(hosts: List[Dict], user_id: Optional[int] = None):
+    """Hostları kaydet, durum değişikliklerini yayınla ve önbellekteki cihaz listelerini geçersiz kıl"""
+    if not hosts:
+        return
+    publish_status(await asyncio.to_thread(upsert_devices, hosts, user_id), "online")
+    # last_seen her taramada değişir; /devices eski durumu TTL boyunca sunmasın
+    await response_cache.invalidate("devices")
+
+
+def _pick_duplicate(rows: List[tuple], host: Dict) -> tuple:
+    """Aynı IP'yi paylaşan kayıtlardan güncellenecek olanı seç: MAC eşleşeni, yoksa en yenisi"""
+    mac = host.get("mac_address")
+    if mac:
+        for row in rows:
+            if row[3] and row[3].lower() == mac.lower():
+                return row
+    return max(rows, key=lambda row: row[0])
+
+
+def upsert_devices(hosts: List[Dict], user_id: Optional[int] = None) -> List[str]:
+    """Bulunan hostları IP adresine göre toplu ekle/güncelle; çevrimiçi olan IP'leri döndür.
+
+    Yeni kayıtlar ve sahibi olmayan eski kayıtlar user_id'ye (taramayı başlatan) yazılır.
+    """
+    if not hosts:
+        return []
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        by_ip = {host["ip_address"]: host for host in hosts}
+        existing = db.query(models.Device.id, models.Device.ip_address, models.Device.status,
+                            models.Device.mac_address, models.Device.user_id).filter(
+            models.Device.ip_address.in_(list(by_ip))
+        ).all()
+
+        # ip_address benzersiz değil; aynı IP'li kayıtlardan yalnızca biri güncellenir
+        rows_by_ip = {}
+        for row in existing:
+            rows_by_ip.setdefault(row[1], []).append(row)
+
+        updates = []
+        came_online = []
+        for ip, rows in rows_by_ip.items():
+            host = by_ip.pop(ip)
+            device_id, _, status, _, owner_id = _pick_duplicate(rows, host)
+            if status != "online":
+                came_online.append(ip)
+            update = {"id": device_id, "status": "online", "last_seen": now}
+            if host.get("mac_address"):
+                update["mac_address"] = host["mac_address"]
+            if owner_id is None and user_id is not None:
+                update["user_id"] = user_id
+            updates.append(update)
+
+        inserts = [{
+            "name": host.get("hostname") or ip,
+            "device_type": "unknown",
+            "ip_address": ip,
+            "mac_address": host.get("mac_address"),
+            "status": "online",
+            "last_seen": now,
+            "user_id": user_id
+        } for ip, host in by_ip.items()]
+
+        if updates:
+            db.bulk_update_mappings(models.Device, updates)
+        if inserts:
+            db.bulk_insert_mappings(models.Device, inserts)
+        # Toplu işlemler ORM olayı üretmez; pano sayaçlarına elle bildirilir
+        record_stats(db, total_devices=len(inserts), online_devices=len(came_online) + len(inserts))
+        db.commit()
+        return came_online + list(by_ip)
+    except Exception as e:
+        db.rollback()
+        print(f"Cihaz kayıt hatası: {e}")
+        return []
+    finally:
+        db.close()
+
+
+def mark_offline(targets: List[str], alive: set) -> List[str]:
+    """Taranan aralıkta yanıt vermeyen çevrimiçi cihazları çevrimdışı yap; IP'lerini döndür"""
+    db = SessionLocal()
+    try:
+        target_set = set(targets)
+        online = db.query(models.Device.id, models.Device.ip_address).filter(models.Device.status == "online").all()
+        offline = [(device_id, ip) for device_id, ip in online if ip in target_set and ip not in alive]
+        if offline:
+            db.bulk_update_mappings(models.Device, [{"id": device_id, "status": "offline"} for device_id, _ in offline])
+            record_stats(db, online_devices=-len(offline))
+            db.commit()
+        return [ip for _, ip in offline]
+    except Exception as e:
+        db.rollback()
+        print(f"Cihaz durum güncelleme hatası: {e}")
+        return []
+    finally:
+        db.close()
+
+
+# Global tarayıcı instance
+network_scanner = NetworkScanner()
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+
+import redis_client
+
+# İstemci başına bekleyen en fazla mesaj; aynı (konu, anahtar) için yalnızca en yenisi tutulur
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256"))
+# Tek gönderim bu süreden uzun sürerse istemci yavaş sayılır ve bağlantı kapatılır
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+# Redis'e yayınlanmayı bekleyen en fazla grup (Redis yavaşsa eskiler düşer)
+WS_REDIS_OUTBOX_SIZE = int(os.getenv("WS_REDIS_OUTBOX_SIZE", "10000"))
+WS_REDIS_RETRY_INTERVAL = float(os.getenv("WS_REDIS_RETRY_INTERVAL", "5"))
+
+TOPICS = ("devices", "metrics", "faces", "vehicles")
+# Bu konuların mesajları yalnızca data["user_id"] sahibine ve yöneticilere iletilir
+OWNED_TOPICS = ("vehicles",)
+CHANNEL_PREFIX = "dakitai:ws:"
+
+
+class HubClient:
+    """Tek WebSocket bağlantısı: abonelikler ve birleştiren sınırlı gönderim kuyruğu"""
+
+    def __init__(self, websocket: WebSocket, hub: "RealtimeHub", queue_size: int = WS_CLIENT_QUEUE_SIZE,
+                 user_id: Optional[int] = None, is_admin: bool = False):
+        self.websocket = websocket
+        self.hub = hub
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.queue_size = queue_size
+        self.topics: Set[str] = set()
+        # (konu, anahtar) -> mesaj metni; yeni güncelleme bekleyen eskisinin yerini alır
+        self._pending: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._ready = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def offer(self, topic: str, key: str, text: str):
+        slot = (topic, key)
+        if slot in self._pending:
+            # Gönderilmemiş eski durum artık geçersiz; sırası korunarak değiştirilir
+            self._pending[slot] = text
+            self.coalesced += 1
+            self.hub.coalesced += 1
+            return
+        if len(self._pending) >= self.queue_size:
+            self._pending.popitem(last=False)
+            self.dropped += 1
+            self.hub.dropped += 1
+        self._pending[slot] = text
+        self._ready.set()
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    async def sender(self):
+        """Bekleyenleri tek çerçevede (JSON dizisi) gönder; gönderim takılırsa yalnızca bu istemci kapanır"""
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            if not self._pending:
+                continue
+            texts = list(self._pending.values())
+            self._pending.clear()
+            try:
+                await asyncio.wait_for(self.websocket.send_text("[" + ",".join(texts) + "]"), WS_SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.hub.slow_disconnects += 1
+                await self.websocket.close(code=1013)
+                return
+            self.sent += len(texts)
+            self.hub.delivered += len(texts)
+            self.hub.frames += 1
+
+
+class RealtimeHub:
+    """Konu tabanlı WebSocket yayın merkezi.
+
+    Yayın metni bir kez üretilir ve abonelerin kuyruğuna eklenir; yavaş istemci
+    yalnızca kendi kuyruğunda birleştirme/düşürme yaşar. Redis varsa yayınlar
+    diğer işçilere pub/sub ile dağıtılır.
+    """
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.clients: Set[HubClient] = set()
+        self._subscribers: Dict[str, Set[HubClient]] = {topic: set() for topic in TOPICS}
+        self._outbox: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.published = 0
+        self.remote_received = 0
+        self.delivered = 0
+        self.frames = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.redis_dropped = 0
+        self.slow_disconnects = 0
+        self.rejected_connections = 0
+
+    # Bağlantılar
+    def add_client(self, websocket: WebSocket, user=None) -> Optional[HubClient]:
+        """user: bağlantının kullanıcısı; sahipli konularda süzme için"""
+        if len(self.clients) >= WS_MAX_CONNECTIONS:
+            self.rejected_connections += 1
+            return None
+        client = HubClient(websocket, self, user_id=getattr(user, "id", None),
+                           is_admin=bool(getattr(user, "is_admin", False)))
+        self.clients.add(client)
+        return client
+
+    def remove_client(self, client: HubClient):
+        self.clients.discard(client)
+        for subscribers in self._subscribers.values():
+            subscribers.discard(client)
+
+    def subscribe(self, client: HubClient, topics: Iterable[str]) -> List[str]:
+        """Bilinmeyen konular ValueError"""
+        topics = list(topics)
+        unknown = [topic for topic in topics if topic not in self._subscribers]
+        if unknown:
+            raise ValueError(f"Unknown topics {unknown}, expected any of {list(TOPICS)}")
+        for topic in topics:
+            self._subscribers[topic].add(client)
+            client.topics.add(topic)
+        return sorted(client.topics)
+
+    def unsubscribe(self, client: HubClient, topics: Iterable[str]) -> List[str]:
+        for topic in topics:
+            if topic in self._subscribers:
+                self._subscribers[topic].discard(client)
+            client.topics.discard(topic)
+        return sorted(client.topics)
+
+    # Yayın
+    def _fan_out(self, topic: str, items: List[Tuple[str, object]], ts: float):
+        subscribers = self._subscribers.get(topic)
+        if not subscribers:
+            return
+        owned = topic in OWNED_TOPICS
+        for key, data in items:
+            text = json.dumps({"topic": topic, "key": key, "data": data, "ts": ts}, default=str)
+            owner_id = data.get("user_id") if owned and isinstance(data, dict) else None
+            for client in subscribers:
+                if owned and not client.is_admin and (owner_id is None or client.user_id != owner_id):
+                    continue
+                client.offer(topic, key, text)
+
+    def publish(self, topic: str, key, data):
+        self.publish_many(topic, [(key, data)])
+
+    def publish_many(self, topic: str, items: List[Tuple[object, object]]):
+        """Olay döngüsü iş parçacığından çağrılmalı; beklemez"""
+        if not items:
+            return
+        ts = time.time()
+        items = [(str(key), data) for key, data in items]
+        self.published += len(items)
+        self._fan_out(topic, items, ts)
+        if self._outbox is not None:
+            if self._outbox.full():
+                self._outbox.get_nowait()
+                self.redis_dropped += 1
+            self._outbox.put_nowait((topic, items, ts))
+
+    # Redis dağıtımı
+    async def _redis_publisher(self, client):
+        while True:
+            topic, items, ts = await self._outbox.get()
+            message = json.dumps({"origin": self.worker_id, "items": items, "ts": ts}, default=str)
+            try:
+                await client.publish(CHANNEL_PREFIX + topic, message)
+            except Exception as e:
+                print(f"Redis yayın hatası: {e}")
+                self.redis_dropped += 1
+                await asyncio.sleep(WS_REDIS_RETRY_INTERVAL)
+
+    async def _redis_listener(self, client):
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(*[CHANNEL_PREFIX + topic for topic in TOPICS])
+                async for message in pubsub.listen():
+                    if message is None or message.get("type") != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    # Bu işçinin yayınları yerelde zaten dağıtıldı
+                    if payload.get("origin") == self.worker_id:
+                        continue
+                    topic = message["channel"].decode()[len(CHANNEL_PREFIX):]
+                    self.remote_received += len(payload["items"])
+                    self._fan_out(topic, [tuple(item) for item in payload["items"]], payload["ts"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis abonelik hatası: {e}")
+                await asyncio.sleep(WS_REDIS_RETRY_INTERVAL)
+            finally:
+                # redis-py 5.0.1 öncesinde aclose yok
+                closer = getattr(pubsub, "aclose", None) or pubsub.close
+                try:
+                    await closer()
+                except Exception:
+                    pass
+
+    def start(self):
+        if self._tasks:
+            return
+        client = redis_client.new_async_redis()
+        if client is not None:
+            self._outbox = asyncio.Queue(maxsize=WS_REDIS_OUTBOX_SIZE)
+            self._tasks = [asyncio.create_task(self._redis_publisher(client)),
+                           asyncio.create_task(self._redis_listener(client))]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._outbox = None
+
+    def get_stats(self) -> Dict:
+        depths = [client.depth for client in self.clients]
+        return {
+            "worker_id": self.worker_id,
+            "redis": self._outbox is not None,
+            "connections": len(self.clients),
+            "max_connections": WS_MAX_CONNECTIONS,
+            "subscribers": {topic: len(clients) for topic, clients in self._subscribers.items()},
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_avg": sum(depths) / len(depths) if depths else 0.0,
+            "queue_size": WS_CLIENT_QUEUE_SIZE,
+            "published": self.published,
+            "remote_received": self.remote_received,
+            "delivered": self.delivered,
+            "frames": self.frames,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "redis_outbox": self._outbox.qsize() if self._outbox is not None else 0,
+            "redis_dropped": self.redis_dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "rejected_connections": self.rejected_connections
+        }
+
+
+# Global yayın merkezi instance
+realtime_hub = RealtimeHub()
@@ -0,0 +1,85 @@
+import os
+import time
+from typing import Optional
+
+try:
+    import redis
+except ImportError:  # Redis isteğe bağlı; yoksa süreç içi yedekler kullanılır
+    redis = None
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "0.5"))
+# Bağlantı koptuğunda yeniden deneme aralığı (saniye)
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", "10"))
+
+_client = None
+_async_client = None
+_failed_at = 0.0
+
+
+def redis_available() -> bool:
+    return redis is not None and bool(REDIS_URL)
+
+
+def mark_failed():
+    """İşlem hatasında Redis'i bir süre devre dışı say (yedek yol kullanılır)"""
+    global _failed_at
+    _failed_at = time.monotonic()
+
+
+def get_redis() -> Optional["redis.Redis"]:
+    """Paylaşılan senkron Redis istemcisi; yapılandırılmamış/erişilemiyorsa None"""
+    global _client
+    if not redis_available() or time.monotonic() - _failed_at < REDIS_RETRY_INTERVAL:
+        return None
+    if _client is None:
+        try:
+            client = redis.Redis.from_url(
+                REDIS_URL,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                health_check_interval=30
+            )
+            client.ping()
+            _client = client
+        except redis.RedisError as e:
+            print(f"Redis bağlantı hatası: {e}")
+            mark_failed()
+            return None
+    return _client
+
+
+def get_async_redis() -> Optional["redis.asyncio.Redis"]:
+    """Paylaşılan async Redis istemcisi (bağlantı ilk komutta açılır)"""
+    global _async_client
+    if not redis_available() or time.monotonic() - _failed_at < REDIS_RETRY_INTERVAL:
+        return None
+    if _async_client is None:
+        import redis.asyncio
+        _async_client = redis.asyncio.Redis.from_url(
+            REDIS_URL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+            health_check_interval=30
+        )
+    return _async_client
+
+
+def new_async_redis(**options) -> Optional["redis.asyncio.Redis"]:
+    """Paylaşılmayan async istemci (ör. pub/sub: okuma zaman aşımı olmadan bekler)"""
+    if not redis_available():
+        return None
+    import redis.asyncio
+    return redis.asyncio.Redis.from_url(REDIS_URL, socket_connect_timeout=REDIS_SOCKET_TIMEOUT, **options)
+
+
+async def close():
+    global _client, _async_client
+    if _async_client is not None:
+        # redis-py 5.0.1 öncesinde aclose yok
+        closer = getattr(_async_client, "aclose", None) or _async_client.close
+        await closer()
+        _async_client = None
+    if _client is not None:
+        _client.close()
+        _client = None
@@ -0,0 +1,269 @@
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import Response
+
+import redis_client
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))
+# Redis yokken süreç içi kayıtların en uzun ömrü (saniye); diğer işçilerin geçersiz
+# kılmaları görülemediğinden uç noktanın TTL'i bununla sınırlanır
+RESPONSE_CACHE_LOCAL_TTL = float(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "5"))
+# Başka bir işçi aynı yanıtı hesaplarken beklenecek en uzun süre (saniye)
+RESPONSE_CACHE_LOCK_TIMEOUT = float(os.getenv("RESPONSE_CACHE_LOCK_TIMEOUT", "10"))
+RESPONSE_CACHE_POLL_INTERVAL = float(os.getenv("RESPONSE_CACHE_POLL_INTERVAL", "0.05"))
+
+KEY_PREFIX = "dakitai:resp:"
+TAG_PREFIX = "dakitai:resp-tag:"
+LOCK_PREFIX = "dakitai:resp-lock:"
+
+# Önbellekte saklanan yanıt başlıkları
+CACHED_HEADERS = ("etag", "cache-control", "content-disposition")
+
+
+def _is_key_param(value) -> bool:
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+class ResponseCache:
+    """FastAPI uç noktaları için yanıt önbelleği.
+
+    Anahtar: uç nokta + kullanıcı + sorgu parametreleri + etiket sürümleri.
+    Etiket geçersiz kılma sürümü artırır; eski anahtarlar TTL ile kendiliğinden
+    düşer. Redis yoksa süreç içi LRU ve yerel etiket sürümleri kullanılır;
+    diğer işçilerin geçersiz kılmaları görülemediği için kayıtlar en fazla
+    RESPONSE_CACHE_LOCAL_TTL saniye tutulur.
+    """
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE, default_ttl: float = RESPONSE_CACHE_TTL):
+        self.max_size = max_size
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._tag_versions: Dict[str, int] = {}
+        # Aynı anahtar için süren hesaplama; eşzamanlı istekler sonucu bekler
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def _versions(self, tags: Tuple[str, ...]):
+        """(etiket sürümleri, Redis istemcisi ya da None)"""
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                values = await client.mget([TAG_PREFIX + tag for tag in tags]) if tags else []
+                return [int(value or 0) for value in values], client
+            except Exception as e:
+                print(f"Redis önbellek hatası: {e}")
+                redis_client.mark_failed()
+        return [self._tag_versions.get(tag, 0) for tag in tags], None
+
+    async def _get(self, client, key: str) -> Optional[str]:
+        if client is not None:
+            try:
+                value = await client.get(key)
+                return value.decode() if value is not None else None
+            except Exception as e:
+                print(f"Redis önbellek okuma hatası: {e}")
+                redis_client.mark_failed()
+                return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    async def _set(self, client, key: str, payload: str, ttl: float):
+        if client is not None:
+            try:
+                await client.set(key, payload, px=max(1, int(ttl * 1000)))
+                return
+            except Exception as e:
+                print(f"Redis önbellek yazma hatası: {e}")
+                redis_client.mark_failed()
+        self._entries[key] = (time.monotonic() + min(ttl, RESPONSE_CACHE_LOCAL_TTL), payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _wait_for_peer(self, client, key: str) -> Optional[str]:
+        """Kilidi tutan işçinin sonucu yazmasını bekle; süre dolarsa None"""
+        deadline = time.monotonic() + RESPONSE_CACHE_LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            await asyncio.sleep(RESPONSE_CACHE_POLL_INTERVAL)
+            payload = await self._get(client, key)
+            if payload is not None:
+                return payload
+            try:
+                if not await client.exists(LOCK_PREFIX + key):
+                    return None
+            except Exception:
+                return None
+        return None
+
+    async def get_or_compute(self, key_base: str, tags: Tuple[str, ...], ttl: float, compute):
+        """Önbellekteki yükü döndür; yoksa tek bir hesaplama yap (single-flight).
+
+        compute() (sonuç, yük) döndürür; yük None ise sonuç önbelleğe alınmaz.
+        Dönüş: (sonuç ya da None, yük ya da None)
+        """
+        versions, client = await self._versions(tags)
+        key = KEY_PREFIX + key_base + ":" + ".".join(map(str, versions))
+
+        payload = await self._get(client, key)
+        if payload is not None:
+            self.hits += 1
+            return None, payload
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            payload = await asyncio.shield(inflight)
+            if payload is not None:
+                return None, payload
+            return await compute()
+
+        future = asyncio.get_running_loop().create_future()
+        # Bekleyen yoksa istisna "hiç alınmadı" uyarısı üretmesin
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        locked = False
+        try:
+            if client is not None:
+                try:
+                    locked = bool(await client.set(LOCK_PREFIX + key, "1", nx=True,
+                                                   px=int(RESPONSE_CACHE_LOCK_TIMEOUT * 1000)))
+                except Exception as e:
+                    print(f"Redis kilit hatası: {e}")
+                    redis_client.mark_failed()
+                    client = None
+                if client is not None and not locked:
+                    # Başka bir işçi hesaplıyor: sonucunu bekle
+                    payload = await self._wait_for_peer(client, key)
+                    if payload is not None:
+                        self.coalesced += 1
+                        future.set_result(payload)
+                        return None, payload
+
+            self.misses += 1
+            result, payload = await compute()
+            if payload is not None:
+                await self._set(client, key, payload, ttl)
+            future.set_result(payload)
+            return result, payload
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            if locked:
+                try:
+                    await client.delete(LOCK_PREFIX + key)
+                except Exception:
+                    pass
+
+    async def invalidate(self, *tags: str):
+        """Etiketli tüm yanıtları geçersiz kıl (sürüm artırılır)"""
+        self.invalidations += len(tags)
+        for tag in tags:
+            self._tag_versions[tag] = self._tag_versions.get(tag, 0) + 1
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                pipe = client.pipeline(transaction=False)
+                for tag in tags:
+                    pipe.incr(TAG_PREFIX + tag)
+                await pipe.execute()
+            except Exception as e:
+                print(f"Redis önbellek geçersiz kılma hatası: {e}")
+                redis_client.mark_failed()
+
+    @staticmethod
+    def _serialize(result) -> Optional[str]:
+        if isinstance(result, Response):
+            # Yalnızca tam gövdeli başarılı yanıtlar saklanır (304, akış vb. değil)
+            if result.status_code != 200 or not hasattr(result, "body"):
+                return None
+            headers = {name: result.headers[name] for name in CACHED_HEADERS if name in result.headers}
+            return json.dumps({"body": result.body.decode(), "media_type": result.media_type, "headers": headers})
+        body = json.dumps(jsonable_encoder(result), separators=(",", ":"))
+        return json.dumps({"body": body, "media_type": "application/json", "headers": {}})
+
+    @staticmethod
+    def _to_response(payload: str, request=None) -> Response:
+        data = json.loads(payload)
+        headers = data["headers"]
+        etag = headers.get("etag")
+        if etag and request is not None:
+            if_none_match = request.headers.get("if-none-match", "")
+            if etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+                return Response(status_code=304, headers=headers)
+        return Response(content=data["body"], media_type=data["media_type"], headers=headers)
+
+    def cached(self, tags: Iterable[str] = (), ttl: Optional[float] = None, per_user: bool = True):
+        """Uç nokta dekoratörü (@app.get altına yazılır).
+
+        Anahtar, uç noktanın basit tipli parametrelerinden ve per_user ise
+        current_user.id'den oluşturulur.
+        """
+        tags = tuple(tags)
+        ttl = ttl or self.default_ttl
+
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                user = kwargs.get("current_user")
+                params = {name: value for name, value in kwargs.items()
+                          if name != "current_user" and _is_key_param(value)}
+                digest = hashlib.blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=12).hexdigest()
+                owner = getattr(user, "id", None) if per_user else "*"
+                key_base = f"{func.__name__}:{owner}:{digest}"
+
+                async def compute():
+                    result = await func(*args, **kwargs)
+                    return result, self._serialize(result)
+
+                result, payload = await self.get_or_compute(key_base, tags, ttl, compute)
+                if payload is None:
+                    return result
+                # Hesaplayan istek If-None-Match'i kendisi değerlendirmiş olabilir
+                if isinstance(result, Response):
+                    return result
+                return self._to_response(payload, kwargs.get("request"))
+            return wrapper
+        return decorator
+
+    def get_stats(self) -> Dict:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "redis": redis_client.get_async_redis() is not None,
+            "local_size": len(self._entries),
+            "max_size": self.max_size,
+            "default_ttl": self.default_ttl,
+            "local_ttl": RESPONSE_CACHE_LOCAL_TTL,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_ratio": (self.hits + self.coalesced) / total if total else 0.0,
+            "invalidations": self.invalidations,
+            "inflight": len(self._inflight)
+        }
+
+
+# Global yanıt önbelleği instance
+response_cache = ResponseCache()
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import redis_client
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+# Redis paylaşılırken diğer işçilerin silmelerini en geç bu sürede görmek için yerel TTL
+USER_CACHE_LOCAL_TTL = float(os.getenv("USER_CACHE_LOCAL_TTL", "5"))
+
+REDIS_KEY_PREFIX = "dakitai:user:"
+
+# Önbellekte tutulan kullanıcı alanları (parola özeti tutulmaz)
+USER_FIELDS = ("id", "username", "email", "full_name", "is_active", "is_admin")
+
+
+class CachedUser:
+    """Oturumdan bağımsız kullanıcı görüntüsü (models.User alanlarıyla aynı adlar)"""
+
+    def __init__(self, **fields):
+        for name in USER_FIELDS:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_model(cls, user) -> "CachedUser":
+        return cls(**{name: getattr(user, name) for name in USER_FIELDS})
+
+    def to_dict(self) -> Dict:
+        return {name: getattr(self, name) for name in USER_FIELDS}
+
+
+class UserCache:
+    """Token sahibi (sub) -> kullanıcı; yerel TTL'li LRU + isteğe bağlı Redis"""
+
+    def __init__(self, max_size: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Commit kancasından gelen, Redis'ten henüz silinmemiş kullanıcı adları
+        self._pending_deletes = set()
+        self._delete_task: Optional[asyncio.Task] = None
+
+    async def get(self, username: str) -> Optional[CachedUser]:
+        if self._pending_deletes:
+            await self._flush_deletes()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(username)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[username]
+
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                raw = await client.get(REDIS_KEY_PREFIX + username)
+            except Exception as e:
+                print(f"Redis okuma hatası: {e}")
+                redis_client.mark_failed()
+                raw = None
+            if raw is not None:
+                user = CachedUser(**json.loads(raw))
+                self._put_local(username, user, USER_CACHE_LOCAL_TTL)
+                with self._lock:
+                    self.redis_hits += 1
+                return user
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _put_local(self, username: str, user: CachedUser, ttl: float):
+        with self._lock:
+            self._entries[username] = (time.monotonic() + ttl, user)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    async def put(self, username: str, user: CachedUser):
+        client = redis_client.get_async_redis()
+        local_ttl = self.ttl
+        if client is not None:
+            try:
+                await client.set(REDIS_KEY_PREFIX + username, json.dumps(user.to_dict()), ex=max(1, int(self.ttl)))
+                local_ttl = min(self.ttl, USER_CACHE_LOCAL_TTL)
+            except Exception as e:
+                print(f"Redis yazma hatası: {e}")
+                redis_client.mark_failed()
+        self._put_local(username, user, local_ttl)
+
+    def _drop_local(self, usernames) -> list:
+        usernames = [name for name in usernames if name]
+        with self._lock:
+            for username in usernames:
+                self._entries.pop(username, None)
+            self.invalidations += len(usernames)
+        return usernames
+
+    async def _delete_remote(self, usernames: list):
+        client = redis_client.get_async_redis()
+        if client is not None:
+            try:
+                await client.delete(*[REDIS_KEY_PREFIX + name for name in usernames])
+            except Exception as e:
+                print(f"Redis silme hatası: {e}")
+                redis_client.mark_failed()
+
+    async def invalidate(self, *usernames: str):
+        """Kullanıcı değiştiğinde/silindiğinde kaydı yerelde ve Redis'te sil"""
+        usernames = self._drop_local(usernames)
+        if usernames:
+            await self._delete_remote(usernames)
+
+    def invalidate_later(self, *usernames: str):
+        """Senkron bağlamdan (commit kancası) geçersiz kıl: yerel kayıt hemen, Redis kaydı
+        olay döngüsünde silinir. Döngü dışındaki bir iş parçacığından gelen silmeler
+        bu işçinin bir sonraki get çağrısında gönderilir."""
+        usernames = self._drop_local(usernames)
+        if not usernames:
+            return
+        with self._lock:
+            self._pending_deletes.update(usernames)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._delete_task is None or self._delete_task.done():
+            self._delete_task = loop.create_task(self._flush_deletes())
+
+    async def _flush_deletes(self):
+        # Silme sürerken gelen yeni adlar da aynı görevde gönderilir
+        while True:
+            with self._lock:
+                usernames, self._pending_deletes = list(self._pending_deletes), set()
+            if not usernames:
+                return
+            await self._delete_remote(usernames)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict:
+        total = self.hits + self.redis_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "redis": redis_client.get_async_redis() is not None,
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.redis_hits) / total if total else 0.0,
+            "invalidations": self.invalidations
+        }
+
+
+# Global önbellek instance
+user_cache = UserCache()
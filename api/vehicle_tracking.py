@@ -0,0 +1,499 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, bindparam, delete, insert, or_, select, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from database import AsyncSessionLocal, SessionLocal
+from realtime_hub import realtime_hub
+import models
+
+# Izgara hücre boyutu (derece); 0.01 ≈ 1.1 km enlem
+GPS_GRID_CELL_DEG = float(os.getenv("GPS_GRID_CELL_DEG", "0.01"))
+# Konum geçmişi bu boyuta ulaşınca ya da bu aralıkta bir toplu yazılır
+GPS_FLUSH_SIZE = int(os.getenv("GPS_FLUSH_SIZE", "5000"))
+GPS_FLUSH_INTERVAL = float(os.getenv("GPS_FLUSH_INTERVAL", "2"))
+# Veritabanına yazılamazken bellekte tutulacak en fazla konum; aşılırsa en eskiler düşer
+GPS_MAX_BUFFER = int(os.getenv("GPS_MAX_BUFFER", "200000"))
+# Son konumların veritabanından yeniden okunma aralığı (saniye, 0 kapatır); indeks işçi
+# başınadır, diğer işçilere gelen konumlar onların yazımından sonra bu turda görünür
+GPS_INDEX_SYNC_INTERVAL = float(os.getenv("GPS_INDEX_SYNC_INTERVAL", "5"))
+GPS_HISTORY_RETENTION_DAYS = float(os.getenv("GPS_HISTORY_RETENTION_DAYS", "30"))
+GPS_RETENTION_INTERVAL = float(os.getenv("GPS_RETENTION_INTERVAL", "3600"))
+# Bilinmeyen gps_device_id'lerin veritabanında yeniden aranmadan önce beklenen süre
+GPS_UNKNOWN_DEVICE_TTL = float(os.getenv("GPS_UNKNOWN_DEVICE_TTL", "60"))
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.32
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_fix_time(value) -> datetime:
+    """Unix zamanı (saniye) ya da ISO 8601; UTC, saat dilimsiz"""
+    if value is None:
+        return datetime.utcnow()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.utcfromtimestamp(value)
+    parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+class GridIndex:
+    """Son bilinen konumlar için sabit boyutlu enlem/boylam ızgarası.
+
+    Sorgu yalnızca aralıkla kesişen hücreleri gezer; geniş aralıklarda
+    dolu hücre sayısı daha azsa onlar taranır.
+    """
+
+    def __init__(self, cell_deg: float = GPS_GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells: Dict[Tuple[int, int], set] = {}
+        # vehicle_id -> (lat, lng, ts, speed, heading, hücre, sahip user_id)
+        self._positions: Dict[int, tuple] = {}
+
+    def __len__(self):
+        return len(self._positions)
+
+    @property
+    def cell_count(self) -> int:
+        return len(self._cells)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def update(self, vehicle_id: int, lat: float, lng: float, ts: datetime,
+               speed: Optional[float] = None, heading: Optional[float] = None, owner_id: Optional[int] = None) -> bool:
+        """Konum mevcut kayıttan yeniyse güncelle (sırası bozuk gelen konumlar atlanır)"""
+        current = self._positions.get(vehicle_id)
+        if current is not None and current[2] >= ts:
+            if current[6] != owner_id:
+                # Araç başka kullanıcıya geçti; konum aynı kalır
+                self._positions[vehicle_id] = current[:6] + (owner_id,)
+            return False
+        cell = self._cell(lat, lng)
+        if current is not None and current[5] != cell:
+            members = self._cells[current[5]]
+            members.discard(vehicle_id)
+            if not members:
+                del self._cells[current[5]]
+        if current is None or current[5] != cell:
+            self._cells.setdefault(cell, set()).add(vehicle_id)
+        self._positions[vehicle_id] = (lat, lng, ts, speed, heading, cell, owner_id)
+        return True
+
+    def remove(self, vehicle_id: int):
+        current = self._positions.pop(vehicle_id, None)
+        if current is not None:
+            members = self._cells.get(current[5])
+            if members is not None:
+                members.discard(vehicle_id)
+                if not members:
+                    del self._cells[current[5]]
+
+    def get(self, vehicle_id: int) -> Optional[Dict]:
+        current = self._positions.get(vehicle_id)
+        return self._as_dict(vehicle_id, current) if current else None
+
+    @staticmethod
+    def _as_dict(vehicle_id: int, position: tuple) -> Dict:
+        lat, lng, ts, speed, heading, _, owner_id = position
+        return {"vehicle_id": vehicle_id, "lat": lat, "lng": lng, "ts": ts.isoformat() + "Z",
+                "speed": speed, "heading": heading, "user_id": owner_id}
+
+    def _candidates(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float):
+        low = self._cell(min_lat, min_lng)
+        high = self._cell(max_lat, max_lng)
+        span = (high[0] - low[0] + 1) * (high[1] - low[1] + 1)
+        if span <= len(self._cells):
+            for x in range(low[0], high[0] + 1):
+                for y in range(low[1], high[1] + 1):
+                    members = self._cells.get((x, y))
+                    if members:
+                        yield from members
+        else:
+            for (x, y), members in self._cells.items():
+                if low[0] <= x <= high[0] and low[1] <= y <= high[1]:
+                    yield from members
+
+    def within_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                    limit: Optional[int] = None, owner_id: Optional[int] = None) -> List[Dict]:
+        """owner_id verilirse yalnızca o kullanıcının araçları"""
+        results = []
+        for vehicle_id in self._candidates(min_lat, min_lng, max_lat, max_lng):
+            position = self._positions[vehicle_id]
+            if owner_id is not None and position[6] != owner_id:
+                continue
+            if min_lat <= position[0] <= max_lat and min_lng <= position[1] <= max_lng:
+                results.append(self._as_dict(vehicle_id, position))
+                if limit and len(results) >= limit:
+                    break
+        return results
+
+    def within_radius(self, lat: float, lng: float, radius_km: float, limit: Optional[int] = None,
+                      owner_id: Optional[int] = None) -> List[Dict]:
+        """Merkeze uzaklığa göre sıralı; kutu ön elemesi + haversine. owner_id verilirse yalnızca o kullanıcının araçları"""
+        dlat = radius_km / KM_PER_DEG_LAT
+        cos_lat = math.cos(math.radians(lat))
+        dlng = 180.0 if cos_lat < 1e-6 else min(180.0, radius_km / (KM_PER_DEG_LAT * cos_lat))
+        results = []
+        for vehicle_id in self._candidates(max(-90.0, lat - dlat), max(-180.0, lng - dlng),
+                                           min(90.0, lat + dlat), min(180.0, lng + dlng)):
+            position = self._positions[vehicle_id]
+            if owner_id is not None and position[6] != owner_id:
+                continue
+            distance = haversine_km(lat, lng, position[0], position[1])
+            if distance <= radius_km:
+                item = self._as_dict(vehicle_id, position)
+                item["distance_km"] = round(distance, 4)
+                results.append(item)
+        results.sort(key=lambda item: item["distance_km"])
+        return results[:limit] if limit else results
+
+
+class VehicleTracker:
+    """GPS konumlarını alır: geçmiş toplu yazılır, son konumlar ızgara indekste tutulur.
+
+    İndeks süreç içidir; çok işçili kurulumda her işçi vehicles.last_location_*
+    sütunlarını GPS_INDEX_SYNC_INTERVAL aralığıyla yeniden okuyarak diğer
+    işçilerin aldığı konumları görür (gecikme: yazma + eşitleme aralığı).
+    """
+
+    def __init__(self):
+        self.index = GridIndex()
+        self._devices: Dict[str, int] = {}
+        # vehicle_id -> sahip user_id; konum alma ve sorgular sahibe göre süzülür
+        self._owners: Dict[int, Optional[int]] = {}
+        self._unknown_devices: Dict[str, float] = {}
+        self._vehicle_ids: set = set()
+        self._buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._flush_event: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected_writes = 0
+        self.flushes = 0
+        self.syncs = 0
+
+    async def load(self):
+        """Araç kimliklerini ve son konumları veritabanından indekse yükle.
+
+        Periyodik eşitlemede de çalışır: yalnızca daha yeni konumlar uygulanır,
+        silinen araçlar indeksten çıkar.
+        """
+        known = set(self._vehicle_ids)
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(
+                models.Vehicle.id, models.Vehicle.gps_device_id, models.Vehicle.user_id,
+                models.Vehicle.last_location_lat, models.Vehicle.last_location_lng, models.Vehicle.last_update
+            ))).all()
+        present = set()
+        for vehicle_id, gps_device_id, owner_id, lat, lng, last_update in rows:
+            present.add(vehicle_id)
+            self._vehicle_ids.add(vehicle_id)
+            self._owners[vehicle_id] = owner_id
+            if gps_device_id:
+                self._devices[gps_device_id] = vehicle_id
+            if lat is not None and lng is not None and last_update is not None:
+                self.index.update(vehicle_id, lat, lng, last_update, owner_id=owner_id)
+        for vehicle_id in known - present:
+            self._forget(vehicle_id)
+        self.syncs += 1
+
+    def _forget(self, vehicle_id: int):
+        """Silinmiş aracı kimliklerden ve indeksten çıkar"""
+        self._vehicle_ids.discard(vehicle_id)
+        self._owners.pop(vehicle_id, None)
+        self.index.remove(vehicle_id)
+        for gps_device_id in [d for d, v in self._devices.items() if v == vehicle_id]:
+            del self._devices[gps_device_id]
+
+    async def _resolve_devices(self, device_ids: set):
+        """İndekste olmayan araç/izleyici kimliklerini tek sorguda çöz"""
+        now = time.monotonic()
+        missing_devices = [d for d in device_ids if isinstance(d, str) and d not in self._devices
+                           and now - self._unknown_devices.get(d, -GPS_UNKNOWN_DEVICE_TTL) >= GPS_UNKNOWN_DEVICE_TTL]
+        missing_ids = [v for v in device_ids if isinstance(v, int) and v not in self._vehicle_ids
+                       and now - self._unknown_devices.get(v, -GPS_UNKNOWN_DEVICE_TTL) >= GPS_UNKNOWN_DEVICE_TTL]
+        if not missing_devices and not missing_ids:
+            return
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(select(models.Vehicle.id, models.Vehicle.gps_device_id, models.Vehicle.user_id).where(or_(
+                models.Vehicle.gps_device_id.in_(missing_devices), models.Vehicle.id.in_(missing_ids)
+            )))).all()
+        for vehicle_id, gps_device_id, owner_id in rows:
+            self._vehicle_ids.add(vehicle_id)
+            self._owners[vehicle_id] = owner_id
+            if gps_device_id:
+                self._devices[gps_device_id] = vehicle_id
+        for key in missing_devices:
+            if key not in self._devices:
+                self._unknown_devices[key] = now
+        for key in missing_ids:
+            if key not in self._vehicle_ids:
+                self._unknown_devices[key] = now
+
+    async def ingest(self, fixes: List[Dict], owner_id: Optional[int] = None) -> Dict:
+        """Bir konum grubunu doğrula, indeksi güncelle ve geçmişi yazma kuyruğuna al.
+
+        owner_id verilirse yalnızca o kullanıcının araçlarına ait konumlar kabul edilir;
+        diğerleri bilinmeyen araç gibi reddedilir.
+        """
+        keys = set()
+        for fix in fixes:
+            if isinstance(fix, dict):
+                key = fix.get("vehicle_id") if fix.get("vehicle_id") is not None else fix.get("gps_device_id")
+                if isinstance(key, (int, str)) and not isinstance(key, bool):
+                    keys.add(key)
+        await self._resolve_devices(keys)
+
+        rows, errors, moved = [], [], set()
+        for i, fix in enumerate(fixes):
+            try:
+                if not isinstance(fix, dict):
+                    raise ValueError("fix must be an object")
+                if fix.get("vehicle_id") is not None:
+                    vehicle_id = fix["vehicle_id"]
+                    if vehicle_id not in self._vehicle_ids or not self._owned(vehicle_id, owner_id):
+                        raise ValueError(f"unknown vehicle_id {vehicle_id!r}")
+                else:
+                    vehicle_id = self._devices.get(fix.get("gps_device_id"))
+                    if vehicle_id is None or not self._owned(vehicle_id, owner_id):
+                        raise ValueError(f"unknown gps_device_id {fix.get('gps_device_id')!r}")
+                lat, lng = float(fix["lat"]), float(fix["lng"])
+                if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+                    raise ValueError("lat/lng out of range")
+                speed = float(fix["speed"]) if fix.get("speed") is not None else None
+                heading = float(fix["heading"]) if fix.get("heading") is not None else None
+                ts = parse_fix_time(fix.get("ts"))
+            except (KeyError, TypeError, ValueError, OverflowError, OSError) as e:
+                if isinstance(e, KeyError):
+                    e = f"{e.args[0]} is required"
+                errors.append({"index": i, "error": str(e)})
+                continue
+            if self.index.update(vehicle_id, lat, lng, ts, speed, heading, self._owners.get(vehicle_id)):
+                moved.add(vehicle_id)
+            rows.append({"vehicle_id": vehicle_id, "ts": ts, "lat": lat, "lng": lng, "speed": speed, "heading": heading})
+
+        with self._lock:
+            self._buffer.extend(rows)
+            self._trim_buffer()
+            full = len(self._buffer) >= GPS_FLUSH_SIZE
+        if full and self._flush_event is not None:
+            self._flush_event.set()
+
+        # Grup başına araç başına tek canlı güncelleme (en yeni konum); yayın merkezi
+        # "vehicles" konusunu data["user_id"] ile aracın sahibine (ve yöneticilere) iletir
+        realtime_hub.publish_many("vehicles", [(vehicle_id, self.index.get(vehicle_id)) for vehicle_id in moved])
+        self.accepted += len(rows)
+        self.rejected += len(errors)
+        return {"accepted": len(rows), "rejected": len(errors), "errors": errors[:100]}
+
+    def _owned(self, vehicle_id: int, owner_id: Optional[int]) -> bool:
+        return owner_id is None or self._owners.get(vehicle_id) == owner_id
+
+    def _trim_buffer(self):
+        """Kilit altında çağrılır; sınırı aşan en eski konumlar düşer"""
+        if len(self._buffer) > GPS_MAX_BUFFER:
+            self.dropped += len(self._buffer) - GPS_MAX_BUFFER
+            del self._buffer[:len(self._buffer) - GPS_MAX_BUFFER]
+
+    def flush(self) -> Tuple[int, set]:
+        """Biriken konumları geçmişe yaz ve araçların son konumunu tek işlemde güncelle.
+
+        (yazılan konum sayısı, silindiği anlaşılan araç kimlikleri) döndürür; iş
+        parçacığında çalıştığından indeks burada değiştirilmez, bkz. _flush.
+        """
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0, set()
+
+        try:
+            self._write(rows)
+        except (DataError, IntegrityError) as e:
+            # Kalıcı hata (ör. çözümlendikten sonra silinen araç): yeniden denemek tüm
+            # yazımları tıkar; satırlar tek tek denenip hatalı olanlar atılır
+            print(f"Konum yazma hatası, satırlar tek tek deneniyor: {e}")
+            result = self._write_each(rows)
+            self.flushes += 1
+            return result
+        except Exception as e:
+            print(f"Konum yazma hatası: {e}")
+            # Geçici hata: konumlar kaybolmasın, bir sonraki turda yeniden denenir
+            with self._lock:
+                self._buffer[:0] = rows
+                self._trim_buffer()
+            return 0, set()
+
+        self.flushes += 1
+        return len(rows), set()
+
+    async def _flush(self) -> int:
+        """flush'ı iş parçacığında çalıştır; silinen araçları olay döngüsünde unut"""
+        written, gone = await asyncio.to_thread(self.flush)
+        for vehicle_id in gone:
+            self._forget(vehicle_id)
+        return written
+
+    def _write(self, rows: List[Dict]):
+        latest = {}
+        for row in rows:
+            current = latest.get(row["vehicle_id"])
+            if current is None or row["ts"] > current["ts"]:
+                latest[row["vehicle_id"]] = row
+
+        table = models.Vehicle.__table__
+        # Sırası bozuk gelen eski konum daha yeni bir son konumun üzerine yazılmaz
+        stmt = update(table).where(and_(
+            table.c.id == bindparam("b_id"),
+            or_(table.c.last_update.is_(None), table.c.last_update < bindparam("b_ts"))
+        )).values(last_location_lat=bindparam("b_lat"), last_location_lng=bindparam("b_lng"),
+                  last_update=bindparam("b_ts"))
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(models.VehiclePosition), rows)
+            db.execute(stmt, [{"b_id": row["vehicle_id"], "b_ts": row["ts"], "b_lat": row["lat"], "b_lng": row["lng"]}
+                              for row in latest.values()])
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.written += len(rows)
+
+    def _write_each(self, rows: List[Dict]) -> Tuple[int, set]:
+        written, gone = 0, set()
+        for i, row in enumerate(rows):
+            try:
+                self._write([row])
+                written += 1
+            except IntegrityError as e:
+                # Araç artık yok: sonraki konumları da kabul edilmesin
+                self.rejected_writes += 1
+                gone.add(row["vehicle_id"])
+                print(f"Konum atıldı (araç {row['vehicle_id']}): {e.orig}")
+            except DataError as e:
+                self.rejected_writes += 1
+                print(f"Konum atıldı (araç {row['vehicle_id']}): {e.orig}")
+            except Exception as e:
+                # Ayıklama sırasında bağlantı koptu: kalanlar sonraki turda yeniden denenir
+                print(f"Konum yazma hatası: {e}")
+                with self._lock:
+                    self._buffer[:0] = rows[i:]
+                    self._trim_buffer()
+                break
+        return written, gone
+
+    def apply_retention(self, now: Optional[datetime] = None) -> int:
+        now = now or datetime.utcnow()
+        db = SessionLocal()
+        try:
+            result = db.execute(delete(models.VehiclePosition).where(
+                models.VehiclePosition.ts < now - timedelta(days=GPS_HISTORY_RETENTION_DAYS)
+            ))
+            db.commit()
+            return result.rowcount
+        except Exception as e:
+            db.rollback()
+            print(f"Konum saklama hatası: {e}")
+            return 0
+        finally:
+            db.close()
+
+    def track(self, vehicle_id: int, start: datetime, end: datetime, limit: int) -> List[Dict]:
+        db = SessionLocal()
+        try:
+            table = models.VehiclePosition
+            rows = db.execute(
+                select(table.ts, table.lat, table.lng, table.speed, table.heading)
+                .where(table.vehicle_id == vehicle_id, table.ts >= start, table.ts < end)
+                .order_by(table.ts).limit(limit)
+            ).all()
+        finally:
+            db.close()
+        return [{"ts": ts.isoformat() + "Z", "lat": lat, "lng": lng, "speed": speed, "heading": heading}
+                for ts, lat, lng, speed, heading in rows]
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), GPS_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self._flush()
+
+    async def _retention_loop(self):
+        while True:
+            await asyncio.to_thread(self.apply_retention)
+            await asyncio.sleep(GPS_RETENTION_INTERVAL)
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(GPS_INDEX_SYNC_INTERVAL)
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Araç konumları eşitlenemedi: {e}")
+
+    async def start(self):
+        if not self._tasks:
+            try:
+                await self.load()
+            except Exception as e:
+                print(f"Araç konumları yüklenemedi: {e}")
+            self._flush_event = asyncio.Event()
+            self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._retention_loop())]
+            if GPS_INDEX_SYNC_INTERVAL > 0:
+                self._tasks.append(asyncio.create_task(self._sync_loop()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        # Kapanışta bellekte kalan konumları yaz
+        await self._flush()
+
+    def get_stats(self) -> Dict:
+        return {
+            "indexed_vehicles": len(self.index),
+            "grid_cells": self.index.cell_count,
+            "cell_deg": self.index.cell_deg,
+            "buffered": len(self._buffer),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "written": self.written,
+            "flushes": self.flushes,
+            "dropped": self.dropped,
+            "rejected_writes": self.rejected_writes,
+            "max_buffer": GPS_MAX_BUFFER,
+            "syncs": self.syncs,
+            "sync_interval": GPS_INDEX_SYNC_INTERVAL
+        }
+
+
+# Global araç takip instance
+vehicle_tracker = VehicleTracker()